@@ -4,6 +4,7 @@ import sqlite3
 import base64
 import json
 import requests
+import shutil
 import time
 import threading
 from datetime import datetime
@@ -30,8 +31,15 @@ class BackupSystem:
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             backup_file = f'backups/vigili_backup_{timestamp}.db'
             
-            # Copia il database
-            shutil.copy2(DATABASE_NAME, backup_file)
+            # Copia il database con l'API di backup online di SQLite:
+            # in modalità WAL una copia del file perderebbe le pagine non ancora nel checkpoint
+            source = sqlite3.connect(DATABASE_NAME)
+            destination = sqlite3.connect(backup_file)
+            try:
+                source.backup(destination)
+            finally:
+                destination.close()
+                source.close()
             
             # Mantieni solo gli ultimi 10 backup
             self.clean_old_backups()
@@ -84,6 +92,11 @@ class BackupSystem:
             # Prendi il backup più recente
             latest_backup = max(backups, key=lambda x: x[1])[0]
             
+            # Rimuovi eventuali file WAL/SHM del database precedente
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(DATABASE_NAME + suffix):
+                    os.remove(DATABASE_NAME + suffix)
+            
             # Ripristina il database
             shutil.copy2(latest_backup, DATABASE_NAME)
             print(f"✅ Database ripristinato da: {latest_backup}")
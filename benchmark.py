@@ -0,0 +1,908 @@
+# benchmark.py
+"""Benchmark del livello database su dati sintetici.
+
+Uso: python benchmark.py <nome>   (senza argomenti elenca i benchmark disponibili)
+"""
+import ast
+import asyncio
+import csv
+import gc
+import io
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import date
+
+from database import CONNECTION_PROFILE, DatabasePool, connect
+from migrations import schema_iniziale, applica_migrazioni
+import esportazione
+import indirizzi
+import interventi
+import ricerca
+import statistiche
+from cache import CacheVersionata, IndiceNomi
+from data_precompilati import PERSONALE_PRECOMPILATO, MEZZI_PRECOMPILATI, TIPOLOGIE_INTERVENTO
+
+# Profilo SQLite di default (quello usato dal bot prima del profilo di connessione)
+PROFILO_DEFAULT = {
+    'journal_mode': 'DELETE',
+    'synchronous': 'FULL',
+    'cache_size': -2000,
+    'mmap_size': 0,
+    'busy_timeout': 5000,
+    'temp_store': 'DEFAULT',
+}
+
+INSERT_INTERVENTO = '''
+    INSERT INTO interventions
+    (report_number, year, exit_time, return_time, address, intervention_type,
+     squad_leader, driver, participants, vehicles_used, created_by)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+# 🔧 DATI SINTETICI
+def intervento_casuale(rng, numero, anno):
+    """Genera la tupla di un intervento plausibile"""
+    nomi = [p['nome'] for p in PERSONALE_PRECOMPILATO]
+    targhe = [m['targa'] for m in MEZZI_PRECOMPILATI]
+    giorno, mese = rng.randint(1, 28), rng.randint(1, 12)
+    ora, minuti = rng.randint(0, 22), rng.randint(0, 59)
+    durata = rng.randint(0, 1)
+    return (
+        str(numero),
+        anno,
+        f"{giorno:02d}/{mese:02d}/{anno} {ora:02d}:{minuti:02d}",
+        f"{giorno:02d}/{mese:02d}/{anno} {ora + durata:02d}:{minuti:02d}",
+        f"Via {rng.choice(['Roma', 'Milano', 'Como', 'Lecco', 'Garibaldi'])} {rng.randint(1, 120)}",
+        rng.choice(TIPOLOGIE_INTERVENTO),
+        rng.choice(nomi),
+        rng.choice(nomi),
+        json.dumps(rng.sample(nomi, rng.randint(1, 4))),
+        json.dumps(rng.sample(targhe, rng.randint(1, 2))),
+        1,
+    )
+
+
+def popola_interventi(conn, righe, seed=42):
+    """Inserisce `righe` interventi sintetici distribuiti su più anni"""
+    rng = random.Random(seed)
+    anni = list(range(2015, 2026))
+    per_anno = righe // len(anni) + 1
+    dati = (
+        intervento_casuale(rng, i % per_anno + 1, anni[i // per_anno])
+        for i in range(righe)
+    )
+    conn.executemany(INSERT_INTERVENTO, dati)
+    conn.commit()
+
+
+def crea_db_sintetico(path, righe, profilo=None):
+    """Crea un database con lo schema originale e `righe` interventi, poi applica
+    le migrazioni come farebbe il bot con un backup ripristinato"""
+    conn = connect(path, profilo)
+    schema_iniziale(conn)
+    popola_interventi(conn, righe)
+    applica_migrazioni(conn)
+    return conn
+
+
+def percentile(valori, p):
+    if not valori:
+        return 0.0
+    valori = sorted(valori)
+    return valori[min(len(valori) - 1, int(len(valori) * p))]
+
+
+# 📊 BENCHMARK
+def bench_wal(durata=3.0, lettori=4, righe=20000):
+    """Letture concorrenti durante scritture: profilo di default contro profilo del bot"""
+    for nome, profilo in (('default', PROFILO_DEFAULT), ('profilo bot', CONNECTION_PROFILE)):
+        with tempfile.TemporaryDirectory() as cartella:
+            path = os.path.join(cartella, 'bench.db')
+            crea_db_sintetico(path, righe, profilo).close()
+
+            stop = threading.Event()
+            latenze, errori, scritture = [], [], [0]
+            lock = threading.Lock()
+
+            def scrittore():
+                rng = random.Random(1)
+                c = connect(path, profilo, check_same_thread=False)
+                numero = righe * 10
+                while not stop.is_set():
+                    numero += 1
+                    try:
+                        c.execute(INSERT_INTERVENTO, intervento_casuale(rng, numero, 2026))
+                        c.commit()
+                        scritture[0] += 1
+                    except sqlite3.OperationalError as e:
+                        with lock:
+                            errori.append(str(e))
+                c.close()
+
+            def lettore(seed):
+                rng = random.Random(seed)
+                c = connect(path, profilo, check_same_thread=False)
+                locali = []
+                while not stop.is_set():
+                    inizio = time.perf_counter()
+                    try:
+                        c.execute(
+                            'SELECT COUNT(*), MAX(created_at) FROM interventions WHERE year = ?',
+                            (rng.randint(2015, 2026),)
+                        ).fetchone()
+                        locali.append(time.perf_counter() - inizio)
+                    except sqlite3.OperationalError as e:
+                        with lock:
+                            errori.append(str(e))
+                c.close()
+                with lock:
+                    latenze.extend(locali)
+
+            threads = [threading.Thread(target=scrittore)]
+            threads += [threading.Thread(target=lettore, args=(i,)) for i in range(lettori)]
+            for t in threads:
+                t.start()
+            time.sleep(durata)
+            stop.set()
+            for t in threads:
+                t.join()
+
+        print(
+            f"{nome:>12}: letture {len(latenze) / durata:8.0f}/s | "
+            f"p50 {percentile(latenze, 0.5) * 1000:6.2f} ms | "
+            f"p95 {percentile(latenze, 0.95) * 1000:6.2f} ms | "
+            f"max {max(latenze or [0]) * 1000:7.2f} ms | "
+            f"scritture {scritture[0] / durata:6.0f}/s | errori {len(errori)}"
+        )
+
+
+def bench_avvio(righe=20000):
+    """Costo delle migrazioni all'avvio: prima applicazione contro schema già aggiornato"""
+    with tempfile.TemporaryDirectory() as cartella:
+        path = os.path.join(cartella, 'bench.db')
+        conn = connect(path)
+        schema_iniziale(conn)
+        popola_interventi(conn, righe)
+        for nome in ('prima applicazione', 'schema aggiornato'):
+            inizio = time.perf_counter()
+            applica_migrazioni(conn)
+            print(f"{nome:>20}: {(time.perf_counter() - inizio) * 1000:8.2f} ms")
+        conn.close()
+
+
+def bench_scrittura(scrittori=200, righe=20000):
+    """Scritture concorrenti: connessione e commit per operazione contro scrittore unico"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def intervento(numero):
+        return intervento_casuale(random.Random(numero), numero, 2026)
+
+    with tempfile.TemporaryDirectory() as cartella:
+        path = os.path.join(cartella, 'bench.db')
+        crea_db_sintetico(path, righe).close()
+
+        # Prima: ogni handler apre la sua connessione e fa commit da solo
+        def scrittura_diretta(numero):
+            conn = sqlite3.connect(path)
+            try:
+                conn.execute(INSERT_INTERVENTO, intervento(numero))
+                conn.commit()
+            finally:
+                conn.close()
+
+        async def prima():
+            loop = asyncio.get_running_loop()
+            with ThreadPoolExecutor(max_workers=16) as executor:
+                return await asyncio.gather(
+                    *(loop.run_in_executor(executor, scrittura_diretta, righe * 10 + i) for i in range(scrittori)),
+                    return_exceptions=True
+                )
+
+        # Dopo: scrittore unico con commit di gruppo (un duplicato per verificare l'errore UNIQUE)
+        async def dopo():
+            pool = DatabasePool(path)
+            try:
+                numeri = [righe * 20 + i for i in range(scrittori - 1)] + [righe * 20]
+                return await asyncio.gather(
+                    *(pool.write(lambda conn, n=n: conn.execute(INSERT_INTERVENTO, intervento(n)).lastrowid)
+                      for n in numeri),
+                    return_exceptions=True
+                )
+            finally:
+                await pool.stop_writer()
+                pool.close()
+
+        for nome, scenario in (('commit singoli', prima), ('scrittore unico', dopo)):
+            inizio = time.perf_counter()
+            esiti = asyncio.run(scenario())
+            durata = time.perf_counter() - inizio
+            errori = [e for e in esiti if isinstance(e, Exception)]
+            tipi = sorted({type(e).__name__ + ': ' + str(e) for e in errori})
+            print(f"{nome:>16}: {scrittori} scritture in {durata * 1000:7.1f} ms | errori {len(errori)} {tipi}")
+
+
+def bench_statistiche(dimensioni=(10000, 100000), ripetizioni=20):
+    """📈 Statistiche: query sull'intero archivio contro tabelle aggregate"""
+    def query_complete(conn):
+        conn.execute('SELECT COUNT(*) FROM interventions').fetchone()
+        conn.execute('SELECT exit_time FROM interventions WHERE exit_at IS NOT NULL ORDER BY exit_at LIMIT 1').fetchone()
+        conn.execute('SELECT exit_time FROM interventions WHERE exit_at IS NOT NULL ORDER BY exit_at DESC LIMIT 1').fetchone()
+        conn.execute('SELECT COUNT(DISTINCT year) FROM interventions').fetchone()
+        conn.execute('SELECT DISTINCT year FROM interventions ORDER BY year').fetchall()
+        conn.execute('SELECT intervention_type, COUNT(*) FROM interventions GROUP BY intervention_type').fetchall()
+        conn.execute('''
+            SELECT license_plate, COUNT(DISTINCT intervention_id) FROM intervention_vehicles
+            GROUP BY license_plate ORDER BY 2 DESC LIMIT 5
+        ''').fetchall()
+
+    for righe in dimensioni:
+        with tempfile.TemporaryDirectory() as cartella:
+            conn = crea_db_sintetico(os.path.join(cartella, 'bench.db'), righe)
+            for nome, lettura in (('query complete', query_complete), ('aggregati', statistiche.leggi_statistiche)):
+                tempi = []
+                for _ in range(ripetizioni):
+                    inizio = time.perf_counter()
+                    lettura(conn)
+                    tempi.append(time.perf_counter() - inizio)
+                print(f"{righe:>7} righe | {nome:>14}: p50 {percentile(tempi, 0.5) * 1000:7.2f} ms")
+            inizio = time.perf_counter()
+            statistiche.ricostruisci_statistiche(conn)
+            print(f"{righe:>7} righe | {'ricalcolo':>14}: {(time.perf_counter() - inizio) * 1000:7.2f} ms")
+            conn.close()
+
+
+def bench_mezzi(righe=100000, ripetizioni=5):
+    """Utilizzo per mezzo: JSON in Python, json_each, tabelle di collegamento e aggregati"""
+    durata = statistiche.DURATA_MINUTI_SQL
+
+    def json_in_python(conn):
+        utilizzo = {}
+        for vehicles_used, minuti, exit_at in conn.execute(
+            f'SELECT vehicles_used, {durata}, exit_at FROM interventions'
+        ):
+            for targa in set(json.loads(vehicles_used)):
+                conteggio, totale, ultimo = utilizzo.get(targa, (0, 0, None))
+                utilizzo[targa] = (conteggio + 1, totale + max(minuti or 0, 0), max(ultimo or '', exit_at or ''))
+        return sorted((t, *v) for t, v in utilizzo.items())
+
+    def json_each(conn):
+        return conn.execute(f'''
+            SELECT targa, COUNT(*), SUM(minuti), max(exit_at) FROM (
+                SELECT DISTINCT j.value AS targa, i.id, i.exit_at, max(COALESCE({durata}, 0), 0) AS minuti
+                FROM interventions i, json_each(i.vehicles_used) j
+            ) GROUP BY targa ORDER BY targa
+        ''').fetchall()
+
+    def collegamenti(conn):
+        return conn.execute(f'''
+            SELECT license_plate, COUNT(*), SUM(minuti), max(exit_at) FROM (
+                SELECT DISTINCT v.license_plate, v.intervention_id, i.exit_at,
+                       max(COALESCE({durata}, 0), 0) AS minuti
+                FROM intervention_vehicles v JOIN interventions i ON i.id = v.intervention_id
+            ) GROUP BY license_plate ORDER BY license_plate
+        ''').fetchall()
+
+    def aggregati(conn):
+        return conn.execute(
+            'SELECT license_plate, interventions, minutes_out, last_exit_at FROM stats_by_vehicle ORDER BY license_plate'
+        ).fetchall()
+
+    with tempfile.TemporaryDirectory() as cartella:
+        conn = crea_db_sintetico(os.path.join(cartella, 'bench.db'), righe)
+        riferimento = None
+        for nome, calcolo in (('json in Python', json_in_python), ('json_each', json_each),
+                              ('collegamenti', collegamenti), ('aggregati', aggregati)):
+            tempi = []
+            for _ in range(ripetizioni):
+                inizio = time.perf_counter()
+                risultato = [tuple(r) for r in calcolo(conn)]
+                tempi.append(time.perf_counter() - inizio)
+            riferimento = riferimento or risultato
+            esito = 'ok' if risultato == riferimento else 'DIVERSO'
+            print(f"{nome:>15}: p50 {percentile(tempi, 0.5) * 1000:8.2f} ms | {len(risultato)} mezzi | {esito}")
+        conn.close()
+
+
+def bench_carico(dimensioni=(20000, 100000), ripetizioni=5):
+    """Carico per vigile: tutte le righe con json.loads in Python contro query indicizzata"""
+    def in_python(conn, inizio, fine):
+        carico = {}
+        for squad_leader, driver, participants, exit_at in conn.execute(
+            'SELECT squad_leader, driver, participants, exit_at FROM interventions'
+        ):
+            if not exit_at or not inizio <= exit_at < fine:
+                continue
+            for nome, ruolo in [(squad_leader, 0), (driver, 1)] + [(p, 2) for p in json.loads(participants)]:
+                carico.setdefault(nome, [0, 0, 0])[ruolo] += 1
+        return carico
+
+    for righe in dimensioni:
+        with tempfile.TemporaryDirectory() as cartella:
+            conn = crea_db_sintetico(os.path.join(cartella, 'bench.db'), righe)
+            for periodo in ('03/2020', 'T2 2020', '2020'):
+                inizio, fine, etichetta = statistiche.finestra_periodo(periodo)
+                for nome, calcolo in (('json in Python', in_python), ('query', statistiche.carico_vigili)):
+                    tempi = []
+                    for _ in range(ripetizioni):
+                        t = time.perf_counter()
+                        calcolo(conn, inizio, fine)
+                        tempi.append(time.perf_counter() - t)
+                    print(f"{righe:>7} righe | {etichetta:>8} | {nome:>14}: p50 {percentile(tempi, 0.5) * 1000:8.2f} ms")
+            attesi = {n: c for n, c in in_python(conn, '2020-01-01', '2021-01-01').items()}
+            ottenuti = {r[0]: [r[1], r[2], r[3]] for r in statistiche.carico_vigili(conn, '2020-01-01', '2021-01-01')}
+            print(f"{righe:>7} righe | risultati {'uguali' if attesi == ottenuti else 'DIVERSI'}")
+            conn.close()
+
+
+def bench_durate(righe=100000, ripetizioni=3):
+    """Durate: parsing e aggregazione riga per riga in Python contro ricalcolo e lettura degli aggregati"""
+    from datetime import datetime
+
+    def in_python(conn):
+        gruppi = {'anno': {}, 'tipologia': {}, 'mezzo': {}, 'vigile': {}}
+        for year, tipo, exit_time, return_time, squad_leader, driver, participants, vehicles_used in conn.execute(
+            '''SELECT year, intervention_type, exit_time, return_time, squad_leader, driver,
+                      participants, vehicles_used FROM interventions'''
+        ):
+            try:
+                uscita = datetime.strptime(exit_time, '%d/%m/%Y %H:%M')
+                rientro = datetime.strptime(return_time, '%d/%m/%Y %H:%M')
+            except (TypeError, ValueError):
+                continue
+            minuti = round((rientro - uscita).total_seconds() / 60)
+            if minuti < 0:
+                continue
+            chiavi = [('anno', year), ('tipologia', tipo)]
+            chiavi += [('mezzo', t) for t in set(json.loads(vehicles_used))]
+            chiavi += [('vigile', n) for n in {squad_leader, driver, *json.loads(participants)}]
+            for gruppo, chiave in chiavi:
+                count, totale = gruppi[gruppo].get(chiave, (0, 0))
+                gruppi[gruppo][chiave] = (count + 1, totale + minuti)
+        return gruppi
+
+    with tempfile.TemporaryDirectory() as cartella:
+        conn = crea_db_sintetico(os.path.join(cartella, 'bench.db'), righe)
+        risultati = {}
+        inizio = time.perf_counter()
+        statistiche.ricostruisci_durate(conn)
+        print(f"{righe:>7} righe | {'ricalcolo SQL':>15}: {(time.perf_counter() - inizio) * 1000:8.1f} ms")
+        for nome, calcolo in (('Python per riga', in_python), ('SQL', statistiche.analisi_durate)):
+            tempi = []
+            for _ in range(ripetizioni):
+                inizio = time.perf_counter()
+                risultati[nome] = calcolo(conn)
+                tempi.append(time.perf_counter() - inizio)
+            print(f"{righe:>7} righe | {nome:>15}: p50 {percentile(tempi, 0.5) * 1000:8.1f} ms")
+        python, sql = risultati['Python per riga'], risultati['SQL']
+        uguali = all(
+            python[gruppo] == {r[0]: (r[1], r[2]) for r in sql['per_' + gruppo]}
+            for gruppo in ('anno', 'tipologia', 'mezzo', 'vigile')
+        )
+        print(f"risultati {'uguali' if uguali else 'DIVERSI'}")
+        conn.close()
+
+
+def bench_avanzate(righe=100000, ripetizioni=10):
+    """📊 Statistiche Avanzate: calcolo SQL a freddo, lettura dalla cache e invalidazione"""
+    from cache import CacheVersionata
+
+    with tempfile.TemporaryDirectory() as cartella:
+        path = os.path.join(cartella, 'bench.db')
+        crea_db_sintetico(path, righe).close()
+
+        async def scenario():
+            pool = DatabasePool(path)
+            cache = CacheVersionata()
+            try:
+                for nome, invalida in (('a freddo', True), ('dalla cache', False)):
+                    tempi = []
+                    for _ in range(ripetizioni):
+                        if invalida:
+                            cache.invalida()
+                        inizio = time.perf_counter()
+                        await cache.get('statistiche_avanzate', pool.run, statistiche.statistiche_avanzate)
+                        tempi.append(time.perf_counter() - inizio)
+                    print(f"{righe:>7} righe | {nome:>12}: p50 {percentile(tempi, 0.5) * 1000:8.3f} ms")
+            finally:
+                pool.close()
+
+        asyncio.run(scenario())
+
+
+def bench_confronto(righe=100000, ripetizioni=20):
+    """📅 Confronto Anni: rollup annuali contro GROUP BY sugli interventi di due anni"""
+    with tempfile.TemporaryDirectory() as cartella:
+        path = os.path.join(cartella, 'bench.db')
+        conn = crea_db_sintetico(path, righe)
+        anno = conn.execute('SELECT MAX(year) FROM interventions').fetchone()[0]
+        oggi = date(anno, 6, 30)
+
+        def al_volo(conn):
+            for a in (anno, anno - 1):
+                conn.execute('''
+                    SELECT intervention_type, COUNT(*) FROM interventions WHERE year = ? GROUP BY intervention_type
+                ''', (a,)).fetchall()
+                conn.execute('''
+                    SELECT v.license_plate, COUNT(DISTINCT i.id)
+                    FROM interventions i JOIN intervention_vehicles v ON v.intervention_id = i.id
+                    WHERE i.year = ? GROUP BY v.license_plate
+                ''', (a,)).fetchall()
+
+        for nome, funzione in (('GROUP BY', al_volo), ('rollup', lambda c: statistiche.confronto_anni(c, anno, oggi))):
+            tempi = []
+            for _ in range(ripetizioni):
+                inizio = time.perf_counter()
+                funzione(conn)
+                tempi.append(time.perf_counter() - inizio)
+            print(f"{righe:>7} righe | {nome:>8}: p50 {percentile(tempi, 0.5) * 1000:8.3f} ms")
+
+        inizio = time.perf_counter()
+        statistiche.ricostruisci_rollup(conn, anno)
+        print(f"Ricalcolo rollup di un anno: {(time.perf_counter() - inizio) * 1000:.1f} ms")
+        conn.close()
+
+
+def bench_indirizzi(righe=100000, lotti=(100, 500, 2000), ripetizioni=10):
+    """📍 Indirizzi: riempimento a lotti di address_key e report dei luoghi ricorrenti"""
+    with tempfile.TemporaryDirectory() as cartella:
+        path = os.path.join(cartella, 'bench.db')
+        conn = crea_db_sintetico(path, righe)
+        for lotto in lotti:
+            conn.execute('UPDATE interventions SET address_key = NULL')
+            conn.commit()
+            durate = []
+            inizio = time.perf_counter()
+            while True:
+                inizio_lotto = time.perf_counter()
+                elaborati = indirizzi.completa_indirizzi(conn, lotto)
+                conn.commit()
+                durate.append(time.perf_counter() - inizio_lotto)
+                if not elaborati:
+                    break
+            print(
+                f"Lotto {lotto:>5}: {righe} righe in {time.perf_counter() - inizio:6.2f} s, "
+                f"scrittore occupato p50 {percentile(durate, 0.5) * 1000:.1f} ms / max {max(durate) * 1000:.1f} ms per lotto"
+            )
+
+        tempi = []
+        for _ in range(ripetizioni):
+            inizio = time.perf_counter()
+            indirizzi.luoghi_ricorrenti(conn)
+            tempi.append(time.perf_counter() - inizio)
+        print(f"{righe:>7} righe | luoghi ricorrenti: p50 {percentile(tempi, 0.5) * 1000:8.3f} ms")
+        conn.close()
+
+
+def bench_ricerca(righe=100000, ripetizioni=10):
+    """🔎 Ricerca libera: LIKE su tutte le colonne contro indice FTS5 con ranking bm25"""
+    ricerche = ['roma 12', 'incendio garibaldi', 'allagamento lecco 7', 'bianchi', 'zanzibar']
+    with tempfile.TemporaryDirectory() as cartella:
+        path = os.path.join(cartella, 'bench.db')
+        conn = crea_db_sintetico(path, righe)
+
+        def con_like(conn, testo):
+            condizioni, parametri = [], []
+            for parola in testo.split():
+                condizioni.append(
+                    '(address LIKE ? OR intervention_type LIKE ? OR squad_leader LIKE ? OR driver LIKE ? OR participants LIKE ?)'
+                )
+                parametri += [f'%{parola}%'] * 5
+            return conn.execute(
+                f'SELECT report_number, year FROM interventions WHERE {" AND ".join(condizioni)} LIMIT 10', parametri
+            ).fetchall()
+
+        for testo in ricerche:
+            for nome, funzione in (('LIKE', con_like), ('FTS5', lambda c, t: ricerca.cerca_interventi(c, t, True))):
+                tempi = []
+                for _ in range(ripetizioni):
+                    inizio = time.perf_counter()
+                    funzione(conn, testo)
+                    tempi.append(time.perf_counter() - inizio)
+                print(f"{righe:>7} righe | {testo!r:>22} {nome:>4}: p50 {percentile(tempi, 0.5) * 1000:8.3f} ms")
+        conn.close()
+
+
+def bench_inline(righe=100000):
+    """⚡ Ricerca inline: una query per tasto premuto, senza e con la cache delle ricerche"""
+    with tempfile.TemporaryDirectory() as cartella:
+        path = os.path.join(cartella, 'bench.db')
+        conn = crea_db_sintetico(path, righe)
+        numero, anno = conn.execute('SELECT report_number, year FROM interventions ORDER BY id DESC LIMIT 1').fetchone()
+        digitati = [f'{numero}/{anno}', 'via garibaldi 12', 'incendio como']
+        # Quello che arriva a ogni tasto (il bot ignora i testi sotto i due caratteri)
+        tasti = [testo[:fine] for testo in digitati for fine in range(2, len(testo) + 1)]
+        cache = CacheVersionata(limite=1000)
+
+        async def digita():
+            tempi = []
+            for testo in tasti:
+                inizio = time.perf_counter()
+                await cache.get(testo.casefold(), calcola, testo)
+                tempi.append(time.perf_counter() - inizio)
+            return tempi
+
+        async def calcola(testo):
+            return ricerca.cerca_inline(conn, testo)
+
+        for nome in ('senza cache', 'con cache'):
+            tempi = asyncio.run(digita())
+            print(
+                f"{righe:>7} righe | {len(tasti)} tasti {nome:>12}: p50 {percentile(tempi, 0.5) * 1000:8.3f} ms | "
+                f"p99 {percentile(tempi, 0.99) * 1000:8.3f} ms | max {max(tempi) * 1000:8.3f} ms"
+            )
+        conn.close()
+
+
+def esporta_in_memoria(conn):
+    """Esportazione completa com'era prima dello streaming: fetchall, StringIO, encode, BytesIO"""
+    righe = conn.execute(f'''
+        SELECT {esportazione.COLONNE_EXPORT}
+        FROM interventions
+        ORDER BY year DESC, exit_at, id
+    ''').fetchall()
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(esportazione.INTESTAZIONE_CSV)
+    for riga in righe:
+        writer.writerow(esportazione.riga_csv(riga))
+    return io.BytesIO(output.getvalue().encode('utf-8'))
+
+
+def bench_esportazione(righe=500000):
+    """📁 Esportazione completa: CSV in memoria contro streaming su file temporaneo (picco con tracemalloc)"""
+    with tempfile.TemporaryDirectory() as cartella:
+        path = os.path.join(cartella, 'bench.db')
+        conn = crea_db_sintetico(path, righe)
+        contenuti = {}
+        for nome, funzione in (('in memoria', esporta_in_memoria), ('streaming', lambda c: esportazione.esporta_csv(c)[0])):
+            gc.collect()
+            tracemalloc.start()
+            inizio = time.perf_counter()
+            file_csv = funzione(conn)
+            durata = time.perf_counter() - inizio
+            picco = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            contenuti[nome] = file_csv.read()
+            file_csv.close()
+            print(
+                f"{righe:>7} righe | {nome:>10}: {durata:6.2f} s | picco {picco / 2**20:8.1f} MiB | "
+                f"file {len(contenuti[nome]) / 2**20:6.1f} MiB"
+            )
+        print("✅ File identici" if len(set(contenuti.values())) == 1 else "❌ I due file sono diversi")
+        conn.close()
+
+
+def bench_zip(righe=200000):
+    """🗜️ Esportazione completa: CSV unico contro ZIP per anno (a freddo, e con i CSV degli anni in cache)"""
+    with tempfile.TemporaryDirectory() as cartella:
+        path = os.path.join(cartella, 'bench.db')
+        conn = crea_db_sintetico(path, righe)
+        esportazione.CARTELLA_CACHE = os.path.join(cartella, 'cache')
+        lavoratori = esportazione.LAVORATORI_ZIP
+
+        def misura(nome, funzione):
+            inizio = time.perf_counter()
+            file_export = funzione(conn)[0]
+            durata = time.perf_counter() - inizio
+            dimensione = file_export.seek(0, os.SEEK_END)
+            file_export.close()
+            print(f"{righe:>7} righe | {nome:>24}: {durata:6.2f} s | {dimensione / 2**20:6.1f} MiB")
+
+        misura('CSV unico', esportazione.esporta_csv)
+        misura(f'ZIP a freddo, {lavoratori} thread', esportazione.esporta_zip)
+        for numero in sorted({1, lavoratori}):
+            esportazione.LAVORATORI_ZIP = numero
+            misura(f'ZIP in cache, {numero} thread', esportazione.esporta_zip)
+        esportazione.LAVORATORI_ZIP = lavoratori
+        conn.close()
+
+
+def bench_delta(archivi=(20000, 200000), nuovi=50, ripetizioni=10):
+    """🆕 Export delle novità: costo con `nuovi` interventi dopo il watermark, al crescere dell'archivio"""
+    for righe in archivi:
+        with tempfile.TemporaryDirectory() as cartella:
+            path = os.path.join(cartella, 'bench.db')
+            conn = crea_db_sintetico(path, righe)
+            ultimo_id = conn.execute('SELECT MAX(id) FROM interventions').fetchone()[0]
+            esportazione.avanza_watermark(
+                conn, 'Provincia', {'fino_a_id': ultimo_id - nuovi, 'ultimo_inserimento': None, 'totale': 0}, 1
+            )
+            tempi = []
+            for _ in range(ripetizioni):
+                inizio = time.perf_counter()
+                file_csv, riepilogo = esportazione.esporta_delta(conn, 'Provincia')
+                tempi.append(time.perf_counter() - inizio)
+                file_csv.close()
+            inizio = time.perf_counter()
+            esportazione.esporta_csv(conn)[0].close()
+            completo = time.perf_counter() - inizio
+            print(
+                f"{righe:>7} righe | novità ({riepilogo['totale']} interventi) p50 {percentile(tempi, 0.5) * 1000:7.2f} ms | "
+                f"export completo {completo * 1000:9.1f} ms"
+            )
+            conn.close()
+
+
+def bench_filtri(righe=100000, pagine=(1, 10, 100, 500), limite=8, ripetizioni=20):
+    """🧰 Ricerca con filtri: pagina N con OFFSET contro keyset su (exit_at, id)"""
+    filtri = {'inizio': '2016-01-01', 'fine': '2025-01-01', 'tipologia': 'Incidente stradale'}
+    with tempfile.TemporaryDirectory() as cartella:
+        path = os.path.join(cartella, 'bench.db')
+        conn = crea_db_sintetico(path, righe)
+        condizioni, parametri = ricerca.compila_filtri(filtri)
+
+        # Cursori di keyset di ogni pagina, come li porterebbero i pulsanti ▶️
+        cursori, cursore = [None], None
+        for _ in range(max(pagine)):
+            pagina, _, successiva = ricerca.pagina_filtrata(conn, filtri, cursore=cursore, limite=limite)
+            if not successiva:
+                break
+            cursore = (pagina[-1][1], pagina[-1][0])
+            cursori.append(cursore)
+
+        for numero in pagine:
+            if numero > len(cursori):
+                break
+            con_offset, con_keyset = [], []
+            for _ in range(ripetizioni):
+                inizio = time.perf_counter()
+                conn.execute(f'''
+                    SELECT id, exit_at, report_number, year, exit_time, address, intervention_type
+                    FROM interventions WHERE {condizioni}
+                    ORDER BY exit_at DESC, id DESC LIMIT ? OFFSET ?
+                ''', parametri + [limite + 1, (numero - 1) * limite]).fetchall()
+                con_offset.append(time.perf_counter() - inizio)
+                inizio = time.perf_counter()
+                ricerca.pagina_filtrata(conn, filtri, cursore=cursori[numero - 1], limite=limite)
+                con_keyset.append(time.perf_counter() - inizio)
+            print(
+                f"Pagina {numero:>5}: OFFSET p50 {percentile(con_offset, 0.5) * 1000:8.3f} ms | "
+                f"keyset p50 {percentile(con_keyset, 0.5) * 1000:8.3f} ms"
+            )
+        conn.close()
+
+
+def bench_ultimi(righe=100000, pagine=(1, 100, 1000, 10000), ripetizioni=20):
+    """📊 Ultimi Interventi: pagina N con OFFSET contro keyset su (created_at, id)"""
+    with tempfile.TemporaryDirectory() as cartella:
+        path = os.path.join(cartella, 'bench.db')
+        conn = crea_db_sintetico(path, righe)
+        limite = 11
+        # Cursori come li porterebbero i pulsanti ▶️ (10 interventi per pagina)
+        cursori, cursore = [None], None
+        for _ in range(max(pagine)):
+            righe_pagina = interventi.pagina_interventi(conn, cursore, limite=limite)
+            if len(righe_pagina) < limite:
+                break
+            cursore = (righe_pagina[limite - 2][1], righe_pagina[limite - 2][0])
+            cursori.append(cursore)
+
+        for numero in pagine:
+            if numero > len(cursori):
+                break
+            con_offset, con_keyset = [], []
+            for _ in range(ripetizioni):
+                inizio = time.perf_counter()
+                conn.execute(f'''
+                    SELECT id, created_at, report_number, {interventi.MEZZI_SQL} FROM interventions
+                    ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?
+                ''', (limite, (numero - 1) * (limite - 1))).fetchall()
+                con_offset.append(time.perf_counter() - inizio)
+                inizio = time.perf_counter()
+                interventi.pagina_interventi(conn, cursori[numero - 1], limite=limite)
+                con_keyset.append(time.perf_counter() - inizio)
+            print(
+                f"Pagina {numero:>6}: OFFSET p50 {percentile(con_offset, 0.5) * 1000:8.3f} ms | "
+                f"keyset p50 {percentile(con_keyset, 0.5) * 1000:8.3f} ms"
+            )
+        conn.close()
+
+
+def bench_nomi(vigili=500, ricerche=2000):
+    """Nomi digitati nel wizard: risoluzione con indice di trigrammi, aggiornamento incrementale contro ricostruzione"""
+    rng = random.Random(42)
+    nomi_base = ['Mario', 'Luca', 'Andrea', 'Giuseppe', 'Francesca', 'Paolo', 'Chiara', 'Davide', 'Marco', 'Elena']
+    cognomi = ['Rossi', 'Bianchi', 'Romano', 'Colombo', 'Ricci', 'Marino', 'Greco', 'Bruno', 'Gallo', 'Conti', 'Fontana', 'Caruso']
+    ruolino = sorted({f"{rng.choice(nomi_base)} {rng.choice(cognomi)}{'' if i < 40 else i}" for i in range(vigili)})
+
+    def refuso(nome):
+        posizione = rng.randrange(len(nome))
+        return nome[:posizione] + nome[posizione + 1:]
+
+    indice = IndiceNomi()
+    indice.aggiorna(ruolino)
+    digitati = [refuso(rng.choice(ruolino)).lower() for _ in range(ricerche)]
+    tempi, certi = [], 0
+    for testo in digitati:
+        inizio = time.perf_counter()
+        certi += indice.risolvi(testo).nome is not None
+        tempi.append(time.perf_counter() - inizio)
+    print(f"Ruolino di {len(ruolino)} vigili, {ricerche} nomi con un refuso")
+    print(f"Risoluzione: p50 {percentile(tempi, 0.5) * 1e6:.0f} µs, p99 {percentile(tempi, 0.99) * 1e6:.0f} µs, certi {certi / ricerche:.0%}")
+
+    modificato = ruolino[1:] + ['Nuovo Vigile']
+    inizio = time.perf_counter()
+    indice.aggiorna(modificato)
+    incrementale = time.perf_counter() - inizio
+    inizio = time.perf_counter()
+    IndiceNomi().aggiorna(modificato)
+    completa = time.perf_counter() - inizio
+    print(f"Aggiornamento (1 aggiunto, 1 rimosso): incrementale {incrementale * 1000:.3f} ms | ricostruzione {completa * 1000:.3f} ms")
+
+
+# 🔍 PIANI DI ESECUZIONE
+# Moduli le cui query girano a runtime (le migrazioni sono escluse: girano una volta)
+MODULI_QUERY = ['bot.py', 'interventi.py', 'statistiche.py', 'indirizzi.py', 'ricerca.py', 'esportazione.py']
+
+# Valori per i segnaposto delle f-string non definiti nei moduli
+SOSTITUZIONI = {
+    'colonna': 'qualification',
+    'filtro': 'WHERE year = ?',
+    'filtro_anno': 'AND year = ?',
+    'tabella': 'stats_by_year',
+    'durate': statistiche.cte_durate('WHERE year = ?'),
+    'condizioni': ricerca.compila_filtri({'inizio': '', 'tipologia': '', 'mezzo': '', 'vigile': ''}, True)[0]
+                  + ' AND (exit_at, id) < (?, ?)',
+    'ordine': 'exit_at DESC, id DESC',
+    'confronto': '<',
+    'verso': ' DESC',
+    'colonne': ricerca.COLONNE_INLINE,
+}
+
+# Query che leggono volutamente tutta la tabella o tutto un indice (frammento SQL -> motivo)
+SCANSIONI_AMMESSE = {
+    'UPDATE intervention_participants': 'riallineamento completo dopo ricarica anagrafiche',
+    'UPDATE intervention_vehicles': 'riallineamento completo dopo ricarica anagrafiche',
+    'SELECT COUNT(*) FROM personnel': 'anagrafica di poche decine di righe (ricarica dati precompilati)',
+    'SELECT COUNT(*) FROM vehicles': 'anagrafica di poche decine di righe (ricarica dati precompilati)',
+    'FROM personnel ORDER BY full_name': 'anagrafica completa nel pacchetto ZIP',
+    'FROM vehicles ORDER BY license_plate': 'anagrafica completa nel pacchetto ZIP',
+    "WHERE target NOT LIKE 'admin:%'": 'poche destinazioni con nome degli export delle novità',
+    'ORDER BY created_at DESC LIMIT': "indice letto in ordine e fermato dal LIMIT (ultimi interventi)",
+    'FROM stats_by_': 'tabella aggregata di poche righe (una per anno, tipologia o mezzo)',
+    'INSERT INTO stats_by_year (year, interventions)': 'ricalcolo completo degli aggregati',
+    'UPDATE stats_by_year': 'ricalcolo completo degli aggregati',
+    'INSERT INTO stats_by_type (intervention_type, interventions)': 'ricalcolo completo degli aggregati',
+    'INSERT INTO stats_by_vehicle (license_plate': 'ricalcolo completo degli aggregati',
+    "SELECT intervention_type, CAST(substr(exit_at, 1, 4) AS INTEGER)": (
+        "tipologie per anno su tutto lo storico (statistiche avanzate): solo l'indice coprente (tipologia, exit_at)"
+    ),
+    'WITH durate AS': 'CTE materializzata sugli interventi filtrati (tutto lo storico o un anno)',
+    'WHERE interventions_fts MATCH': "ricerca sull'indice FTS5 (la tabella virtuale legge solo le corrispondenze)",
+}
+
+
+def estrai_query(percorso):
+    """Estrae dal sorgente le stringhe SQL (anche f-string) passate agli execute"""
+    albero = ast.parse(open(percorso, encoding='utf-8').read())
+    valori = {**vars(interventi), **vars(statistiche), **vars(ricerca), **vars(esportazione), **SOSTITUZIONI}
+    query = []
+    # Le parti costanti di una f-string non sono query a sé
+    frammenti = {id(parte) for nodo in ast.walk(albero) if isinstance(nodo, ast.JoinedStr) for parte in nodo.values}
+    for nodo in ast.walk(albero):
+        if id(nodo) in frammenti:
+            continue
+        if isinstance(nodo, ast.Constant) and isinstance(nodo.value, str):
+            testo = nodo.value
+        elif isinstance(nodo, ast.JoinedStr):
+            parti = []
+            for parte in nodo.values:
+                if isinstance(parte, ast.Constant):
+                    parti.append(parte.value)
+                elif isinstance(parte.value, ast.Name) and parte.value.id in valori:
+                    parti.append(str(valori[parte.value.id]))
+                else:
+                    parti = None
+                    break
+            if parti is None:
+                continue
+            testo = ''.join(parti)
+        else:
+            continue
+        if testo.strip().split(' ')[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+            query.append((nodo.lineno, ' '.join(testo.split())))
+    return sorted(query)
+
+
+def piano_query(conn, sql):
+    """Dettagli dell'EXPLAIN QUERY PLAN di `sql` e le letture complete di tabella, None per i frammenti"""
+    try:
+        piano = conn.execute('EXPLAIN QUERY PLAN ' + sql, (None,) * sql.count('?')).fetchall()
+    except sqlite3.OperationalError as e:
+        # Frammenti riusati in altre query (es. la sola CTE)
+        if 'incomplete input' not in str(e):
+            raise
+        return None
+    dettagli = [p[3] for p in piano]
+    # SCAN (subquery-n) è la lettura di una co-routine, non di una tabella. Un SCAN che passa
+    # da un indice resta una lettura completa (dell'indice): va in SCANSIONI_AMMESSE come le altre
+    scansioni = [d for d in dettagli if d.startswith('SCAN ') and not d.startswith('SCAN (')]
+    return dettagli, scansioni
+
+
+def scansione_ammessa(sql):
+    """Motivo per cui la query può leggere tutta la tabella (SCANSIONI_AMMESSE), None se non può"""
+    return next((m for f, m in SCANSIONI_AMMESSE.items() if f in sql), None)
+
+
+def query_moduli():
+    """(modulo, riga, sql) di ogni query dei MODULI_QUERY"""
+    cartella = os.path.dirname(os.path.abspath(__file__))
+    return [(modulo, riga, sql) for modulo in MODULI_QUERY
+            for riga, sql in estrai_query(os.path.join(cartella, modulo))]
+
+
+def db_piani(path, righe=50000):
+    """Database sintetico per i piani di esecuzione (anche per tests/test_query_plans.py)"""
+    conn = crea_db_sintetico(path, righe)
+    conn.create_function('parse_timestamp', 1, interventi.parse_timestamp)
+    return conn
+
+
+def bench_piani(righe=50000):
+    """EXPLAIN QUERY PLAN di ogni query: fallisce se una tabella viene letta per intero"""
+    falliti = 0
+    with tempfile.TemporaryDirectory() as cartella:
+        conn = db_piani(os.path.join(cartella, 'bench.db'), righe)
+        for modulo, riga, sql in query_moduli():
+            risultato = piano_query(conn, sql)
+            if risultato is None:
+                print(f"⏭️  {modulo}:{riga} frammento: {sql[:80]}")
+                continue
+            dettagli, scansioni = risultato
+            ammessa = scansione_ammessa(sql)
+            if scansioni and not ammessa:
+                esito = '❌'
+                falliti += 1
+            else:
+                esito = '⚠️ ' if scansioni else '✅'
+            print(f"{esito} {modulo}:{riga} {sql[:90]}")
+            for d in dettagli:
+                print(f"      {d}")
+            if scansioni and ammessa:
+                print(f"      (ammessa: {ammessa})")
+        conn.close()
+    print(f"\n{'❌ ' + str(falliti) + ' query con scansione completa' if falliti else '✅ Nessuna scansione completa'}")
+    return 1 if falliti else 0
+
+
+BENCHMARKS = {
+    'wal': bench_wal,
+    'avvio': bench_avvio,
+    'piani': bench_piani,
+    'scrittura': bench_scrittura,
+    'statistiche': bench_statistiche,
+    'mezzi': bench_mezzi,
+    'carico': bench_carico,
+    'durate': bench_durate,
+    'avanzate': bench_avanzate,
+    'confronto': bench_confronto,
+    'indirizzi': bench_indirizzi,
+    'ricerca': bench_ricerca,
+    'esportazione': bench_esportazione,
+    'zip': bench_zip,
+    'delta': bench_delta,
+    'inline': bench_inline,
+    'filtri': bench_filtri,
+    'ultimi': bench_ultimi,
+    'nomi': bench_nomi,
+}
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("Benchmark disponibili: " + ', '.join(BENCHMARKS))
+        return
+    sys.exit(BENCHMARKS[sys.argv[1]]() or 0)
+
+
+if __name__ == "__main__":
+    main()
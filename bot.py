@@ -1,24 +1,53 @@
 #gist id d6b7f54ec9ab952abbec068dc2fdf0c1 # apikey rnd_vwifq7NnYes2wGlWKDOkfwpbGN0i
 import os
 import logging
+import re
 import sqlite3
 import json
 import csv
 import io
 from datetime import datetime
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, ConversationHandler, filters
+from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton, InlineQueryResultArticle, InputTextMessageContent
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, InlineQueryHandler, ContextTypes, ConversationHandler, filters
 
 # Import sistema backup e keep-alive
 from backup_system import enhanced_restore_on_startup, start_backup_system
 from keep_alive import start_keep_alive
 
+# Import accesso database (pool di connessioni su thread)
+from database import db, monitor_event_loop_lag
+from interventi import PARTECIPANTI_SQL, MEZZI_SQL, SCHEDA_SQL, elenco, parse_timestamp, salva_intervento, ricollega_anagrafiche, pagina_interventi
+from migrations import applica_migrazioni
+from indirizzi import completa_indirizzi, luoghi_ricorrenti
+from esportazione import (anni_esportabili, esporta_csv, esporta_zip, prepara_export_anno, salva_export,
+                          svuota_cache_export, destinazioni_delta, esporta_delta, avanza_watermark)
+from ricerca import cerca_interventi, cerca_inline, intervallo_date, pagina_filtrata
+from statistiche import MESI, GIORNI, PERIODI_RAPIDI, leggi_statistiche, ricostruisci_statistiche, finestra_periodo, carico_vigili, analisi_durate, statistiche_avanzate, confronto_anni
+from cache import autorizzazioni, anagrafiche, viste_interventi, ricerche_inline
+
 # Import dati precompilati
 from data_precompilati import PERSONALE_PRECOMPILATO, MEZZI_PRECOMPILATI, TIPOLOGIE_INTERVENTO
 
 # Configurazione
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
-DATABASE_NAME = 'vigili.db'
+
+# Limiti dei messaggi Telegram e delle pagine sfogliabili
+MAX_MESSAGGIO = 4096
+MAX_INTERVENTI_PAGINA = 10
+
+# Pulsanti che accettano nomi fuori dal ruolino così come sono scritti
+TIENI_NOMI = '✏️ Tieni: '
+USA_NOMI = '✅ Usa: '
+
+
+def lunghezza_telegram(testo):
+    """Lunghezza come la conta Telegram (unità UTF-16: le emoji valgono 2)"""
+    return len(testo.encode('utf-16-le')) // 2
+
+
+def tronca_telegram(testo, limite=MAX_MESSAGGIO):
+    """Testo tagliato a `limite` unità UTF-16 (senza spezzare un'emoji a metà)"""
+    return testo.encode('utf-16-le')[:limite * 2].decode('utf-16-le', errors='ignore')
 
 # Configurazione logging
 logging.basicConfig(
@@ -41,8 +70,9 @@ logger = logging.getLogger(__name__)
     UPDATE_QUALIFICATION_CONFIRM, UPDATE_NAUTICAL_CONFIRM, UPDATE_SAF_TPSS_CONFIRM,
     MODIFICA_VIGILE_SELECT, MODIFICA_CAMPO_SELECT, MODIFICA_NUOVO_VALORE,
     NEW_INTERVENTION_REPORT_PROGRESSIVO,
-    CONFERMA_RICARICA_DATI
-) = range(32)
+    CONFERMA_RICARICA_DATI,
+    EXPORT_DELTA_TARGET
+) = range(33)
 
 class VigiliBot:
     def __init__(self, token):
@@ -52,100 +82,18 @@ class VigiliBot:
         self.carica_dati_precompilati()
     
     def init_db(self):
-        """Inizializza database SQLite"""
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        
-        # Tabella interventi CON TIPOLOGIA
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS interventions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                report_number TEXT NOT NULL,
-                year INTEGER NOT NULL,
-                exit_time TEXT NOT NULL,
-                return_time TEXT,
-                address TEXT NOT NULL,
-                intervention_type TEXT DEFAULT 'Incendio',
-                squad_leader TEXT NOT NULL,
-                driver TEXT NOT NULL,
-                participants TEXT NOT NULL,
-                vehicles_used TEXT NOT NULL,
-                created_by INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(report_number, year)
-            )
-        ''')
-        
-        # Tabella utenti
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER UNIQUE,
-                username TEXT,
-                full_name TEXT,
-                role TEXT DEFAULT 'user',
-                is_active BOOLEAN DEFAULT TRUE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Tabella richieste accesso
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS access_requests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER UNIQUE,
-                username TEXT,
-                full_name TEXT,
-                requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                status TEXT DEFAULT 'pending'
-            )
-        ''')
-        
-        # Tabella personale
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS personnel (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                full_name TEXT NOT NULL,
-                qualification TEXT,
-                license_grade TEXT,
-                has_nautical_license BOOLEAN DEFAULT FALSE,
-                is_saf BOOLEAN DEFAULT FALSE,
-                is_tpss BOOLEAN DEFAULT FALSE,
-                squadra_notturna TEXT,
-                squadra_serale TEXT,
-                squadra_domenicale TEXT,
-                is_active BOOLEAN DEFAULT TRUE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Tabella mezzi
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS vehicles (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                license_plate TEXT UNIQUE NOT NULL,
-                model TEXT NOT NULL,
-                is_active BOOLEAN DEFAULT TRUE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Tabella admin
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS admins (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER UNIQUE,
-                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
-        logger.info("✅ Database inizializzato")
+        """Inizializza database SQLite (migrazioni di schema versionate)"""
+        with db.connection() as conn:
+            versione = applica_migrazioni(conn)
+            journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+        logger.info(f"✅ Database inizializzato (schema v{versione}, journal: {journal_mode})")
     
-    def carica_dati_precompilati(self):
+    def carica_dati_precompilati(self, conn=None):
         """Carica i dati precompilati nel database se non esistono"""
-        conn = sqlite3.connect(DATABASE_NAME)
+        if conn is None:
+            with db.connection() as conn:
+                return self.carica_dati_precompilati(conn)
+        
         c = conn.cursor()
         
         # Carica personale precompilato
@@ -183,8 +131,9 @@ class VigiliBot:
                 ''', (mezzo['targa'], mezzo['modello']))
             logger.info(f"✅ Caricati {len(MEZZI_PRECOMPILATI)} mezzi precompilati")
         
-        conn.commit()
-        conn.close()
+        # Nuove anagrafiche: riallinea gli id nelle tabelle di collegamento
+        if count_personale == 0 or count_mezzi == 0:
+            ricollega_anagrafiche(conn)
     
     async def ricarica_dati_precompilati(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Forza la ricarica dei dati precompilati (COMANDO ADMIN)"""
@@ -209,28 +158,26 @@ class VigiliBot:
         """Configura admin e utenti automaticamente all'avvio"""
         admin_ids = [1816045269, 653425963, 693843502]
         
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
+        with db.connection() as conn:
+            c = conn.cursor()
         
-        # Configura admin
-        for admin_id in admin_ids:
-            # Inserisci nella tabella admins
-            c.execute('INSERT OR IGNORE INTO admins (telegram_id) VALUES (?)', (admin_id,))
-            # Inserisci anche nella tabella users come attivo
-            c.execute('''
-                INSERT OR REPLACE INTO users (telegram_id, username, full_name, role, is_active) 
-                VALUES (?, 'admin', 'Admin User', 'user', TRUE)
-            ''', (admin_id,))
-        
-        conn.commit()
-        conn.close()
+            # Configura admin
+            for admin_id in admin_ids:
+                # Inserisci nella tabella admins
+                c.execute('INSERT OR IGNORE INTO admins (telegram_id) VALUES (?)', (admin_id,))
+                # Inserisci anche nella tabella users come attivo
+                c.execute('''
+                    INSERT OR REPLACE INTO users (telegram_id, username, full_name, role, is_active) 
+                    VALUES (?, 'admin', 'Admin User', 'user', TRUE)
+                ''', (admin_id,))
         logger.info(f"👑 Admin configurati automaticamente: {admin_ids}")
     
     def get_main_keyboard(self, is_admin=False):
-            """Tastiera principale migliorata - SOLO FUNZIONI ESSENZIALI"""
+        """Tastiera principale migliorata - SOLO FUNZIONI ESSENZIALI"""
         keyboard = [
             ['📋 Nuovo Intervento', '📊 Ultimi Interventi'],
             ['📈 Statistiche', '🔍 Cerca Rapporto'],
+            ['🔎 Ricerca Libera', '🧰 Ricerca con Filtri'],
             ['📁 Esporta Dati', '🔄 Health Check']
         ]
         if is_admin:
@@ -238,23 +185,13 @@ class VigiliBot:
             keyboard.append(['👨‍🚒 Modifica Vigile', '⚙️ Altro'])
         return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     
-    def is_admin(self, user_id):
-        """Verifica se utente è admin"""
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('SELECT * FROM admins WHERE telegram_id = ?', (user_id,))
-        admin = c.fetchone()
-        conn.close()
-        return admin is not None
-
-    def get_available_years(self):
-        """Recupera tutti gli anni disponibili nel database"""
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('SELECT DISTINCT year FROM interventions ORDER BY year DESC')
-        years = [str(row[0]) for row in c.fetchall()]
-        conn.close()
-        return years
+    async def is_admin(self, user_id):
+        """Verifica se utente è admin (da cache)"""
+        return await autorizzazioni.is_admin(user_id)
+
+    async def get_available_years(self):
+        """Recupera tutti gli anni disponibili nel database (dagli aggregati, una riga per anno)"""
+        return [str(anno) for anno in await db.run(anni_esportabili)]
 
     # 🔥 GESTIONE UTENTI E ACCESSO
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -264,23 +201,21 @@ class VigiliBot:
         # Lista degli admin pre-autorizzati
         admin_ids = [1816045269, 653425963, 693843502]
         
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        
         # Se l'utente è nella lista admin, approvalo automaticamente
         if telegram_id in admin_ids:
-            c.execute('''
-                INSERT OR REPLACE INTO users (telegram_id, username, full_name, role, is_active) 
-                VALUES (?, ?, ?, 'user', TRUE)
-            ''', (telegram_id, user.username, user.full_name))
-            
-            # Assicurati che sia nella tabella admins
-            c.execute('INSERT OR IGNORE INTO admins (telegram_id) VALUES (?)', (telegram_id,))
+            def registra_admin(conn):
+                conn.execute('''
+                    INSERT OR REPLACE INTO users (telegram_id, username, full_name, role, is_active) 
+                    VALUES (?, ?, ?, 'user', TRUE)
+                ''', (telegram_id, user.username, user.full_name))
+                
+                # Assicurati che sia nella tabella admins
+                conn.execute('INSERT OR IGNORE INTO admins (telegram_id) VALUES (?)', (telegram_id,))
             
-            conn.commit()
-            conn.close()
+            await db.write(registra_admin)
+            autorizzazioni.invalida(telegram_id)
             
-            is_admin = self.is_admin(telegram_id)
+            is_admin = await self.is_admin(telegram_id)
             await update.message.reply_text(
                 f"👑 Benvenuto Admin {user.full_name}!\n"
                 f"Sei stato riconosciuto automaticamente come amministratore.",
@@ -288,78 +223,69 @@ class VigiliBot:
             )
         else:
             # Per utenti normali, richiesta di accesso
-            c.execute('SELECT * FROM users WHERE telegram_id = ? AND is_active = TRUE', (telegram_id,))
-            existing_user = c.fetchone()
+            # /start rilegge sempre lo stato (es. utente appena approvato)
+            autorizzazioni.invalida(telegram_id)
+            existing_user, is_admin = await autorizzazioni.stato(telegram_id)
             
             if existing_user:
-                is_admin = self.is_admin(telegram_id)
                 await update.message.reply_text(
                     f"Benvenuto {user.full_name}!\n"
                     f"Sei registrato come: {'Admin' if is_admin else 'User'}",
                     reply_markup=self.get_main_keyboard(is_admin)
                 )
             else:
-                c.execute('''
+                await db.execute('''
                     INSERT OR REPLACE INTO access_requests (telegram_id, username, full_name, status)
                     VALUES (?, ?, ?, 'pending')
                 ''', (telegram_id, user.username, user.full_name))
-                conn.commit()
                 await update.message.reply_text(
                     f"Ciao {user.full_name}!\n"
                     "La tua richiesta di accesso è stata inviata agli amministratori.\n"
                     "Riceverai una notifica quando verrà approvata.",
                     reply_markup=ReplyKeyboardRemove()
                 )
-        conn.close()
 
     # 🔥 GESTIONE MESSAGGI PRINCIPALI
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
         message_text = update.message.text
         
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('SELECT * FROM users WHERE telegram_id = ? AND is_active = TRUE', (user.id,))
-        user_data = c.fetchone()
-        conn.close()
+        user_data, is_admin = await autorizzazioni.stato(user.id)
         
         if not user_data:
             await update.message.reply_text("Il tuo account non è ancora stato autorizzato.")
             return
         
-        is_admin = self.is_admin(user.id)
         
         # Gestione conferma ricarica dati
         if context.user_data.get('awaiting_reload_confirmation'):
             if message_text == '✅ Sì, ricarica tutto':
-                # Procedi con la ricarica
-                conn = sqlite3.connect(DATABASE_NAME)
-                c = conn.cursor()
+                # Procedi con la ricarica (una sola transazione)
+                def ricarica(conn):
+                    c = conn.cursor()
+                    
+                    # Conta quanti record ci sono prima
+                    c.execute('SELECT COUNT(*) FROM personnel')
+                    count_vigili_prima = c.fetchone()[0]
+                    c.execute('SELECT COUNT(*) FROM vehicles') 
+                    count_mezzi_prima = c.fetchone()[0]
+                    
+                    # Svuota le tabelle (ATTENZIONE: cancella i dati esistenti!)
+                    c.execute('DELETE FROM personnel')
+                    c.execute('DELETE FROM vehicles')
+                    
+                    # Ricarica i dati precompilati
+                    self.carica_dati_precompilati(conn)
+                    
+                    # Conta quanti record ci sono dopo
+                    c.execute('SELECT COUNT(*) FROM personnel')
+                    count_vigili_dopo = c.fetchone()[0]
+                    c.execute('SELECT COUNT(*) FROM vehicles')
+                    count_mezzi_dopo = c.fetchone()[0]
+                    return count_vigili_prima, count_mezzi_prima, count_vigili_dopo, count_mezzi_dopo
                 
-                # Conta quanti record ci sono prima
-                c.execute('SELECT COUNT(*) FROM personnel')
-                count_vigili_prima = c.fetchone()[0]
-                c.execute('SELECT COUNT(*) FROM vehicles') 
-                count_mezzi_prima = c.fetchone()[0]
-                
-                # Svuota le tabelle (ATTENZIONE: cancella i dati esistenti!)
-                c.execute('DELETE FROM personnel')
-                c.execute('DELETE FROM vehicles')
-                
-                conn.commit()
-                conn.close()
-                
-                # Ricarica i dati precompilati
-                self.carica_dati_precompilati()
-                
-                # Conta quanti record ci sono dopo
-                conn = sqlite3.connect(DATABASE_NAME)
-                c = conn.cursor()
-                c.execute('SELECT COUNT(*) FROM personnel')
-                count_vigili_dopo = c.fetchone()[0]
-                c.execute('SELECT COUNT(*) FROM vehicles')
-                count_mezzi_dopo = c.fetchone()[0]
-                conn.close()
+                count_vigili_prima, count_mezzi_prima, count_vigili_dopo, count_mezzi_dopo = await db.write(ricarica)
+                anagrafiche.invalida()
                 
                 # Reset dello stato
                 context.user_data['awaiting_reload_confirmation'] = False
@@ -386,6 +312,31 @@ class VigiliBot:
                 )
                 return
         
+        # Report carico vigili: scelta periodo / download CSV
+        if context.user_data.get('awaiting_carico_periodo') and is_admin:
+            await self.carico_vigili_periodo(update, context)
+            return
+        
+        # Export novità: la destinazione scelta o scritta dall'admin
+        if context.user_data.get('awaiting_delta_destinazione') and is_admin:
+            await self.delta_export_target(update, context)
+            return
+        
+        # Menu esportazione: anno, tutto, ZIP o novità fino a Indietro
+        if context.user_data.get('awaiting_export') and is_admin:
+            await self.export_selected_year(update, context)
+            return
+        
+        # Ricerca libera: ogni messaggio è una nuova ricerca fino a Indietro
+        if context.user_data.get('awaiting_ricerca_testo'):
+            await self.free_text_search(update, context, is_admin)
+            return
+        
+        # Ricerca con filtri: scelta e valore dei filtri fino a Indietro
+        if context.user_data.get('awaiting_filtri'):
+            await self.filter_search_step(update, context, is_admin)
+            return
+        
         if message_text == '📋 Nuovo Intervento':
             await self.start_new_intervention(update, context)
         elif message_text == '📊 Ultimi Interventi':
@@ -394,6 +345,16 @@ class VigiliBot:
             await self.show_statistics(update, context)
         elif message_text == '🔍 Cerca Rapporto':
             await self.search_report_start(update, context)
+        elif message_text == '🔎 Ricerca Libera':
+            context.user_data['awaiting_ricerca_testo'] = True
+            await update.message.reply_text(
+                "🔎 Scrivi cosa cercare (indirizzo, tipologia, caposquadra, autista...):\n"
+                "es. \"roma 12\" oppure \"incendio garibaldi\"",
+                reply_markup=ReplyKeyboardMarkup([['🔙 Indietro']], resize_keyboard=True)
+            )
+        elif message_text == '🧰 Ricerca con Filtri':
+            context.user_data['filtri'] = {}
+            await self.filter_search_menu(update, context)
         elif message_text == '📁 Esporta Dati':
             await self.export_data_menu(update, context)
         elif message_text == '🔄 Health Check':
@@ -405,6 +366,16 @@ class VigiliBot:
             await self.ricarica_dati_precompilati(update, context)
         elif message_text == '⚙️ Altro' and is_admin:
             await self.menu_altro(update, context)
+        elif message_text == '👥 Carico Vigili' and is_admin:
+            await self.carico_vigili_start(update, context)
+        elif message_text == '⏱️ Durate Interventi' and is_admin:
+            await self.show_durations(update, context)
+        elif message_text == '📊 Statistiche Avanzate' and is_admin:
+            await self.show_advanced_statistics(update, context)
+        elif message_text == '📅 Confronto Anni' and is_admin:
+            await self.show_year_comparison(update, context)
+        elif message_text == '📍 Luoghi Ricorrenti' and is_admin:
+            await self.show_hotspots(update, context)
         else:
             await update.message.reply_text("Comando non riconosciuto.")
 
@@ -413,6 +384,8 @@ class VigiliBot:
         keyboard = [
             ['📋 Lista Vigili Completa', '🚗 Lista Mezzi Completa'],
             ['🔄 Ricarica Dati Precompilati', '📊 Statistiche Avanzate'],
+            ['👥 Carico Vigili', '⏱️ Durate Interventi'],
+            ['📅 Confronto Anni', '📍 Luoghi Ricorrenti'],
             ['🔙 Indietro']
         ]
         
@@ -422,6 +395,202 @@ class VigiliBot:
             reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         )
 
+    # 👥 REPORT CARICO VIGILI (ADMIN)
+    async def carico_vigili_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Chiede il periodo del report carico vigili"""
+        rapidi = list(PERIODI_RAPIDI)
+        keyboard = [rapidi[0:2], rapidi[2:4], rapidi[4:6], ['🔙 Indietro']]
+        context.user_data['awaiting_carico_periodo'] = True
+        context.user_data.pop('carico_finestra', None)
+        
+        await update.message.reply_text(
+            "👥 **CARICO VIGILI**\n\n"
+            "Seleziona il periodo oppure scrivilo come MM/AAAA, T1 AAAA o AAAA:",
+            reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        )
+
+    async def carico_vigili_periodo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Mostra il carico per vigile nel periodo scelto (o invia il CSV dell'ultimo periodo)"""
+        message_text = update.message.text
+        
+        if message_text == '🔙 Indietro':
+            context.user_data['awaiting_carico_periodo'] = False
+            context.user_data.pop('carico_finestra', None)
+            await update.message.reply_text(
+                "Operazione annullata.",
+                reply_markup=self.get_main_keyboard(True)
+            )
+            return
+        
+        if message_text == '📊 Scarica CSV' and context.user_data.get('carico_finestra'):
+            inizio, fine, etichetta = context.user_data['carico_finestra']
+            righe = await db.run(carico_vigili, inizio, fine)
+            
+            output = io.StringIO()
+            writer = csv.writer(output)
+            writer.writerow(['Vigile', 'Caposquadra', 'Autista', 'Partecipante'])
+            writer.writerows(righe)
+            csv_content = output.getvalue().encode('utf-8')
+            output.close()
+            
+            await update.message.reply_document(
+                document=io.BytesIO(csv_content),
+                filename=f"carico_vigili_{etichetta.replace(' ', '_')}.csv",
+                caption=f"👥 Carico vigili {etichetta} ({len(righe)} vigili)"
+            )
+            return
+        
+        finestra = finestra_periodo(message_text)
+        if not finestra:
+            await update.message.reply_text("❌ Periodo non valido. Usa i pulsanti oppure MM/AAAA, T1 AAAA o AAAA.")
+            return
+        
+        inizio, fine, etichetta = finestra
+        righe = await db.run(carico_vigili, inizio, fine)
+        context.user_data['carico_finestra'] = finestra
+        
+        if not righe:
+            await update.message.reply_text(f"❌ Nessun intervento nel periodo {etichetta}.")
+            return
+        
+        response = f"👥 **CARICO VIGILI {etichetta}**\n👨‍🚒 caposquadra · 🚗 autista · 👥 partecipante\n\n"
+        for nome, caposquadra, autista, partecipante in righe:
+            riga = f"• {nome}: 👨‍🚒 {caposquadra} · 🚗 {autista} · 👥 {partecipante}\n"
+            if len(response) + len(riga) > 3900:
+                response += "…\nElenco completo nel CSV."
+                break
+            response += riga
+        
+        rapidi = list(PERIODI_RAPIDI)
+        keyboard = [['📊 Scarica CSV'], rapidi[0:2], rapidi[2:4], rapidi[4:6], ['🔙 Indietro']]
+        await update.message.reply_text(
+            response,
+            reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        )
+
+    # 📊 STATISTICHE AVANZATE (ADMIN)
+    async def show_advanced_statistics(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Istogrammi per mese, giorno, ora e tipologie per anno (in cache fino al prossimo intervento)"""
+        stats = await viste_interventi.get('statistiche_avanzate', db.run, statistiche_avanzate)
+        
+        def barre(etichette, valori):
+            massimo = max(valori) or 1
+            return "".join(
+                f"{etichetta} {'█' * round(valore * 12 / massimo)} {valore}\n"
+                for etichetta, valore in zip(etichette, valori)
+            )
+        
+        # Settimana da lunedì
+        giorni = list(range(1, 7)) + [0]
+        response = (
+            "📊 **STATISTICHE AVANZATE**\n\n"
+            "📆 **PER MESE**\n" + barre(MESI, stats['per_mese']) + "\n"
+            "📅 **PER GIORNO DELLA SETTIMANA**\n"
+            + barre([GIORNI[g] for g in giorni], [stats['per_giorno'][g] for g in giorni]) + "\n"
+            "🕐 **PER FASCIA ORARIA**\n"
+            + barre([f"{h:02d}-{h + 3:02d}" for h in range(0, 24, 3)],
+                    [sum(stats['per_ora'][h:h + 3]) for h in range(0, 24, 3)])
+            + (f"(escluse {stats['senza_ora']} uscite senza ora)\n" if stats['senza_ora'] else "") + "\n"
+        )
+        
+        # Tipologie negli ultimi 5 anni, dalla più frequente
+        anni = sorted({anno for conteggi in stats['tipologie_anni'].values() for anno in conteggi})[-5:]
+        if anni:
+            response += "🔥 **TIPOLOGIE PER ANNO** (" + " · ".join(str(a) for a in anni) + ")\n"
+            tipologie = sorted(
+                stats['tipologie_anni'].items(),
+                key=lambda voce: -sum(voce[1].get(a, 0) for a in anni)
+            )
+            for tipo, conteggi in tipologie[:10]:
+                response += f"• {tipo}: " + " · ".join(str(conteggi.get(a, 0)) for a in anni) + "\n"
+        
+        await update.message.reply_text(tronca_telegram(response))
+
+    # 📅 CONFRONTO ANNI (ADMIN)
+    async def show_year_comparison(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Anno in corso contro il precedente, dai rollup annuali (in cache fino al prossimo intervento)"""
+        oggi = datetime.now().date()
+        confronto = await viste_interventi.get(('confronto_anni', oggi), db.run, confronto_anni, oggi.year, oggi)
+        anno, precedente = confronto['anno'], confronto['precedente']
+        
+        def delta(attuale, prima):
+            variazione = f"{attuale - prima:+d}"
+            if prima:
+                variazione += f", {(attuale - prima) * 100 / prima:+.0f}%"
+            return f"{attuale} vs {prima} ({variazione})"
+        
+        media = confronto['media_minuti']
+        response = (
+            f"📅 **CONFRONTO {anno} / {precedente}**\n\n"
+            f"🔢 Totale anno: {delta(confronto['totali'][anno], confronto['totali'][precedente])}\n"
+            f"📆 Al {confronto['giorno'].strftime('%d/%m')}: "
+            f"{delta(confronto['alla_data'][anno], confronto['alla_data'][precedente])}\n"
+            f"⏱️ Durata media: {media[anno]:.0f} min vs {media[precedente]:.0f} min\n\n"
+        )
+        
+        for titolo, righe in (('🔥 **TIPOLOGIE**', confronto['tipologie']), ('🚒 **MEZZI**', confronto['mezzi'])):
+            if not righe:
+                continue
+            response += titolo + "\n"
+            for chiave, conteggi in righe[:10]:
+                response += f"• {chiave}: {delta(conteggi[anno], conteggi[precedente])}\n"
+            response += "\n"
+        
+        await update.message.reply_text(tronca_telegram(response))
+
+    # 📍 LUOGHI RICORRENTI (ADMIN)
+    async def show_hotspots(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Indirizzi normalizzati con più interventi (in cache fino al prossimo intervento)"""
+        luoghi = await viste_interventi.get('luoghi_ricorrenti', db.run, luoghi_ricorrenti)
+        
+        if not luoghi:
+            await update.message.reply_text("📍 Nessun indirizzo con più di un intervento.")
+            return
+        
+        response = "📍 **LUOGHI RICORRENTI**\n\n"
+        for i, (indirizzo, count, ultima_uscita) in enumerate(luoghi, 1):
+            ultima = datetime.strptime(ultima_uscita, '%Y-%m-%d %H:%M').strftime('%d/%m/%Y') if ultima_uscita else '-'
+            response += f"{i}. {indirizzo.title()}: {count} interventi (ultimo {ultima})\n"
+        
+        await update.message.reply_text(tronca_telegram(response))
+
+    # ⏱️ DURATE INTERVENTI (ADMIN)
+    async def show_durations(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Ore fuori per anno, tipologia, mezzo e vigile, con le durate anomale"""
+        durate = await db.run(analisi_durate)
+        
+        def ore(minuti):
+            return f"{(minuti or 0) / 60:.1f} h"
+        
+        response = (
+            f"⏱️ **DURATE INTERVENTI**\n\n"
+            f"🔢 Interventi: {durate['totale']}\n"
+            f"❓ Durata mancante: {durate['mancanti']}\n"
+            f"⚠️ Rientro prima dell'uscita: {durate['negative']}\n\n"
+        )
+        
+        sezioni = [
+            ('📅 **PER ANNO**', durate['per_anno'], None),
+            ('🔥 **PER TIPOLOGIA**', durate['per_tipologia'], 10),
+            ('🚒 **PER MEZZO**', durate['per_mezzo'], 10),
+            ('👨‍🚒 **PER VIGILE (primi 10)**', durate['per_vigile'], 10),
+        ]
+        for titolo, righe, limite in sezioni:
+            if not righe:
+                continue
+            response += titolo + "\n"
+            for chiave, count, minuti, media in righe[:limite]:
+                response += f"• {chiave}: {ore(minuti)} in {count} interventi (media {ore(media)})\n"
+            response += "\n"
+        
+        if durate['anomalie']:
+            response += "⚠️ **DA CORREGGERE**\n"
+            for report_number, year, exit_time, minuti in durate['anomalie']:
+                problema = 'durata mancante' if minuti is None else f'rientro {-minuti} min prima'
+                response += f"• {report_number}/{year} ({exit_time or 'N/A'}): {problema}\n"
+        
+        await update.message.reply_text(tronca_telegram(response))
+
     # 🔥 GESTIONE INTERVENTI CON TIPOLOGIA MIGLIORATA
     async def start_new_intervention(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Pulsanti per progressivo o nuovo
@@ -443,14 +612,10 @@ class VigiliBot:
         
         if update.message.text == '🔄 Progressivo':
             # Recupera ultimi 4 interventi
-            conn = sqlite3.connect(DATABASE_NAME)
-            c = conn.cursor()
-            c.execute('''
+            ultimi_interventi = await db.fetchall('''
                 SELECT report_number, year FROM interventions 
                 ORDER BY created_at DESC LIMIT 4
             ''')
-            ultimi_interventi = c.fetchall()
-            conn.close()
             
             if ultimi_interventi:
                 keyboard = []
@@ -503,11 +668,27 @@ class VigiliBot:
         return NEW_INTERVENTION_EXIT_TIME
 
     async def new_intervention_exit_time(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if parse_timestamp(update.message.text) is None:
+            await update.message.reply_text("❌ Data non valida. Usa il formato GG/MM/AAAA HH:MM:")
+            return NEW_INTERVENTION_EXIT_TIME
+        
         context.user_data['exit_time'] = update.message.text
         await update.message.reply_text("Inserisci data e ora di rientro (formato: GG/MM/AAAA HH:MM):")
         return NEW_INTERVENTION_RETURN_TIME
 
     async def new_intervention_return_time(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        rientro = parse_timestamp(update.message.text)
+        if rientro is None:
+            await update.message.reply_text("❌ Data non valida. Usa il formato GG/MM/AAAA HH:MM:")
+            return NEW_INTERVENTION_RETURN_TIME
+        
+        if rientro < parse_timestamp(context.user_data['exit_time']):
+            await update.message.reply_text(
+                f"❌ Il rientro è precedente all'uscita ({context.user_data['exit_time']}). "
+                "Inserisci di nuovo data e ora di rientro:"
+            )
+            return NEW_INTERVENTION_RETURN_TIME
+        
         context.user_data['return_time'] = update.message.text
         await update.message.reply_text("Inserisci l'indirizzo dell'intervento:")
         return NEW_INTERVENTION_ADDRESS
@@ -547,14 +728,10 @@ class VigiliBot:
             context.user_data['intervention_type'] = update.message.text
         
         # Continua con selezione caposquadra
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('SELECT * FROM personnel WHERE is_active = TRUE')
-        personnel = c.fetchall()
-        conn.close()
+        personnel = (await anagrafiche.get()).personale
         
         if personnel:
-            keyboard = [[f"👨‍🚒 {p[1]}"] for p in personnel]
+            keyboard = [[f"👨‍🚒 {p.full_name}"] for p in personnel]
             keyboard.append(['Annulla'])
             await update.message.reply_text(
                 "👨‍🚒 **SELEZIONA IL CAPOSQUADRA**",
@@ -565,6 +742,24 @@ class VigiliBot:
             await update.message.reply_text("Inserisci il nome del caposquadra:")
             return NEW_INTERVENTION_SQUAD_LEADER
 
+    async def resolve_person(self, update: Update, testo):
+        """Nome digitato -> nome del ruolino (corregge i refusi); None se ha chiesto una conferma"""
+        if testo.startswith(TIENI_NOMI):
+            return testo[len(TIENI_NOMI):].strip()
+        
+        corrispondenza = await anagrafiche.risolvi_nome(testo)
+        if corrispondenza.nome:
+            return corrispondenza.nome
+        
+        keyboard = [[nome] for nome in corrispondenza.candidati]
+        keyboard += [[f"{TIENI_NOMI}{testo.strip()}"], ['Annulla']]
+        await update.message.reply_text(
+            f"❓ \"{testo}\" non è nel ruolino. "
+            + ("Intendevi uno di questi?" if corrispondenza.candidati else "Nessun vigile simile: tienilo o riscrivilo."),
+            reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        )
+        return None
+
     async def new_intervention_squad_leader(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if update.message.text == 'Annulla':
             return await self.cancel(update, context)
@@ -574,35 +769,20 @@ class VigiliBot:
         if '👨‍🚒' in squad_leader_text:
             squad_leader_name = squad_leader_text.replace('👨‍🚒 ', '').strip()
         else:
-            squad_leader_name = squad_leader_text
+            squad_leader_name = await self.resolve_person(update, squad_leader_text)
+            if squad_leader_name is None:
+                return NEW_INTERVENTION_SQUAD_LEADER
         
         context.user_data['squad_leader'] = squad_leader_name
         
         # Recupera solo il personale con patente adatta per autista
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('''
-            SELECT full_name, license_grade 
-            FROM personnel 
-            WHERE is_active = TRUE 
-            AND license_grade IN ('IIIE', 'III', 'II', 'I')
-            ORDER BY 
-                CASE license_grade 
-                    WHEN 'IIIE' THEN 1
-                    WHEN 'III' THEN 2 
-                    WHEN 'II' THEN 3
-                    WHEN 'I' THEN 4
-                    ELSE 5
-                END,
-                full_name
-        ''')
-        drivers = c.fetchall()
-        conn.close()
+        # Già ordinati per patente (IIIE → I) e nome
+        drivers = (await anagrafiche.get()).autisti
         
         if drivers:
             keyboard = []
             for driver in drivers:
-                keyboard.append([f"🚗 {driver[0]} ({driver[1]})"])
+                keyboard.append([f"🚗 {driver.full_name} ({driver.license_grade})"])
             keyboard.append(['Annulla'])
             
             await update.message.reply_text(
@@ -626,26 +806,24 @@ class VigiliBot:
         if '🚗' in driver_text and '(' in driver_text:
             driver_name = driver_text.split('🚗 ')[1].split(' (')[0].strip()
         else:
-            driver_name = driver_text
+            driver_name = await self.resolve_person(update, driver_text)
+            if driver_name is None:
+                return NEW_INTERVENTION_DRIVER
         
         context.user_data['driver'] = driver_name
         
         # Mostra tutti i vigili per selezione partecipanti
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('SELECT full_name FROM personnel WHERE is_active = TRUE ORDER BY full_name')
-        all_personnel = c.fetchall()
-        conn.close()
+        all_personnel = (await anagrafiche.get()).per_nome
         
         if all_personnel:
             # Crea tastiera con checkbox
             keyboard = []
             for person in all_personnel:
-                keyboard.append([f"☐ {person[0]}"])
+                keyboard.append([f"☐ {person.full_name}"])
             keyboard.append(['✅ Conferma Partecipanti'])
             keyboard.append(['Annulla'])
             
-            context.user_data['available_personnel'] = [p[0] for p in all_personnel]
+            context.user_data['available_personnel'] = [p.full_name for p in all_personnel]
             context.user_data['selected_participants'] = []
             
             await update.message.reply_text(
@@ -676,14 +854,10 @@ class VigiliBot:
             context.user_data['participants'] = participants
             
             # Mostra mezzi disponibili
-            conn = sqlite3.connect(DATABASE_NAME)
-            c = conn.cursor()
-            c.execute('SELECT license_plate, model FROM vehicles WHERE is_active = TRUE')
-            vehicles = c.fetchall()
-            conn.close()
+            vehicles = (await anagrafiche.get()).mezzi
             
             if vehicles:
-                keyboard = [[f"🚒 {v[0]} - {v[1]}"] for v in vehicles]
+                keyboard = [[f"🚒 {v.license_plate} - {v.model}"] for v in vehicles]
                 keyboard.append(['Annulla'])
                 await update.message.reply_text(
                     "🚒 **SELEZIONA MEZZI UTILIZZATI**",
@@ -743,18 +917,37 @@ class VigiliBot:
             return NEW_INTERVENTION_PARTICIPANTS
         
         else:
-            # Inserimento manuale
-            participants = [p.strip() for p in update.message.text.split(',')]
+            # Inserimento manuale: nomi riconosciuti anche con refusi, conferma se dubbi
+            testo = update.message.text
+            if testo.startswith((TIENI_NOMI, USA_NOMI)):
+                participants = [p.strip() for p in testo.split(': ', 1)[1].split(',') if p.strip()]
+            else:
+                scritti = [p.strip() for p in testo.split(',') if p.strip()]
+                participants, dubbi = [], []
+                for nome in scritti:
+                    corrispondenza = await anagrafiche.risolvi_nome(nome)
+                    if corrispondenza.nome:
+                        participants.append(corrispondenza.nome)
+                    else:
+                        dubbi.append((nome, corrispondenza.candidati))
+                        participants.append(corrispondenza.candidati[0] if corrispondenza.candidati else nome)
+                if dubbi:
+                    elenco_dubbi = "\n".join(
+                        f"• \"{nome}\": {' / '.join(candidati) or 'nessun vigile simile'}" for nome, candidati in dubbi
+                    )
+                    keyboard = [[f"{USA_NOMI}{', '.join(participants)}"], [f"{TIENI_NOMI}{', '.join(scritti)}"], ['Annulla']]
+                    await update.message.reply_text(
+                        f"❓ **NOMI NON NEL RUOLINO**\n\n{elenco_dubbi}\n\n"
+                        "Usa la proposta, tieni i nomi come scritti o reinvia l'elenco corretto:",
+                        reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+                    )
+                    return NEW_INTERVENTION_PARTICIPANTS
             context.user_data['participants'] = participants
             
-            conn = sqlite3.connect(DATABASE_NAME)
-            c = conn.cursor()
-            c.execute('SELECT license_plate, model FROM vehicles WHERE is_active = TRUE')
-            vehicles = c.fetchall()
-            conn.close()
+            vehicles = (await anagrafiche.get()).mezzi
             
             if vehicles:
-                vehicle_list = "\n".join([f"🚒 {v[0]} - {v[1]}" for v in vehicles])
+                vehicle_list = "\n".join([f"🚒 {v.license_plate} - {v.model}" for v in vehicles])
                 await update.message.reply_text(
                     f"Mezzi disponibili:\n{vehicle_list}\n\n"
                     "Inserisci i mezzi utilizzati (separati da virgola, formato: TARGA1, TARGA2):"
@@ -777,30 +970,19 @@ class VigiliBot:
         
         # Salva l'intervento CON TIPOLOGIA
         user = update.effective_user
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO interventions 
-            (report_number, year, exit_time, return_time, address, intervention_type,
-             squad_leader, driver, participants, vehicles_used, created_by)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            context.user_data['report_number'],
-            context.user_data['year'],
-            context.user_data['exit_time'],
-            context.user_data['return_time'],
-            context.user_data['address'],
-            context.user_data.get('intervention_type', 'Incendio'),
-            context.user_data['squad_leader'],
-            context.user_data['driver'],
-            json.dumps(context.user_data['participants']),
-            json.dumps(vehicles),
-            user.id
-        ))
-        conn.commit()
-        conn.close()
+        is_admin = await self.is_admin(user.id)
+        try:
+            await db.write(salva_intervento, context.user_data, context.user_data['participants'], vehicles, user.id)
+            viste_interventi.invalida()
+            ricerche_inline.invalida()
+        except sqlite3.IntegrityError:
+            await update.message.reply_text(
+                f"❌ Il rapporto {context.user_data['report_number']}/{context.user_data['year']} "
+                f"è già registrato. Intervento non salvato.",
+                reply_markup=self.get_main_keyboard(is_admin)
+            )
+            return ConversationHandler.END
         
-        is_admin = self.is_admin(user.id)
         await update.message.reply_text(
             "✅ **INTERVENTO REGISTRATO CON SUCCESSO!**\n\n"
             f"📋 Rapporto: {context.user_data['report_number']}/{context.user_data['year']}\n"
@@ -812,109 +994,120 @@ class VigiliBot:
 
     # 🔥 VISUALIZZAZIONE INTERVENTI
     async def show_last_interventions(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('''
-            SELECT report_number, year, exit_time, return_time, address, 
-                   intervention_type, squad_leader, driver, vehicles_used
-            FROM interventions 
-            ORDER BY created_at DESC 
-            LIMIT 10
-        ''')
-        interventions = c.fetchall()
-        conn.close()
-        
-        if not interventions:
-            await update.message.reply_text("Nessun intervento registrato.")
-            return
-        
-        response = "📊 **ULTIMI 10 INTERVENTI**\n\n"
-        for i, interv in enumerate(interventions, 1):
-            response += (
-                f"**{i}. Rapporto {interv[0]}/{interv[1]}**\n"
-                f"🔥 {interv[5]}\n"
-                f"📍 {interv[4]}\n"
-                f"🚨 Uscita: {interv[2]}\n"
-                f"✅ Rientro: {interv[3]}\n"
-                f"👨‍🚒 Caposquadra: {interv[6]}\n"
-                f"🚗 Autista: {interv[7]}\n"
-                f"🚒 Mezzi: {', '.join(json.loads(interv[8]))}\n\n"
+        """Prima pagina degli ultimi interventi, sfogliabile con ◀️/▶️"""
+        response, markup = await self.last_interventions_page()
+        await update.message.reply_text(response, reply_markup=markup)
+
+    async def last_interventions_page(self, cursore=None, indietro=False, pagina=1):
+        """Testo e pulsanti di una pagina: tanti interventi quanti ne stanno in un messaggio (max 10)"""
+        righe = await db.run(pagina_interventi, cursore, indietro, MAX_INTERVENTI_PAGINA + 1)
+        if not righe:
+            return "Nessun intervento registrato.", None
+        
+        intestazione = f"📊 **ULTIMI INTERVENTI** (pagina {pagina})\n\n"
+        spazio = MAX_MESSAGGIO - lunghezza_telegram(intestazione)
+        # In avanti si riempie dalla più recente, indietro dalla più vicina al cursore
+        mostrate, blocchi = [], []
+        for interv in righe[:MAX_INTERVENTI_PAGINA]:
+            blocco = (
+                f"**Rapporto {interv[2]}/{interv[3]}**\n"
+                f"🔥 {interv[7]}\n"
+                f"📍 {interv[6][:300]}\n"
+                f"🚨 Uscita: {interv[4]}\n"
+                f"✅ Rientro: {interv[5]}\n"
+                f"👨‍🚒 Caposquadra: {interv[8]}\n"
+                f"🚗 Autista: {interv[9]}\n"
+                f"🚒 Mezzi: {elenco(interv[11], interv[10])}\n\n"
             )
+            if blocchi and lunghezza_telegram(blocco) > spazio:
+                break
+            spazio -= lunghezza_telegram(blocco)
+            mostrate.append(interv)
+            blocchi.append(blocco)
+        altre = len(righe) > len(mostrate)
+        if indietro:
+            mostrate.reverse()
+            blocchi.reverse()
+            if not altre:
+                # Tornati ai più recenti: le pagine indietro non ricalcano per forza quelle in avanti
+                pagina = 1
+                intestazione = f"📊 **ULTIMI INTERVENTI** (pagina {pagina})\n\n"
+        precedente, successiva = (altre, True) if indietro else (cursore is not None, altre)
+        
+        pulsanti = []
+        if precedente:
+            pulsanti.append(InlineKeyboardButton(
+                "◀️ Più recenti", callback_data=f"ult:p:{pagina - 1}:{mostrate[0][0]}:{mostrate[0][1]}"
+            ))
+        if successiva:
+            pulsanti.append(InlineKeyboardButton(
+                "Meno recenti ▶️", callback_data=f"ult:n:{pagina + 1}:{mostrate[-1][0]}:{mostrate[-1][1]}"
+            ))
+        return intestazione + ''.join(blocchi), InlineKeyboardMarkup([pulsanti]) if pulsanti else None
+
+    async def last_interventions_callback(self, query, context: ContextTypes.DEFAULT_TYPE):
+        """◀️/▶️ degli ultimi interventi: modifica lo stesso messaggio"""
+        if not await autorizzazioni.is_authorized(query.from_user.id):
+            await query.edit_message_text("❌ Non hai i permessi per questa azione.")
+            return
         
-        await update.message.reply_text(response)
+        # ult:<n|p>:<pagina>:<id>:<created_at> (created_at contiene ':')
+        _, verso, pagina, intervention_id, created_at = query.data.split(':', 4)
+        response, markup = await self.last_interventions_page(
+            (created_at, int(intervention_id)), verso == 'p', int(pagina)
+        )
+        await query.edit_message_text(response, reply_markup=markup)
 
     # 🔥 STATISTICHE AVANZATE CON TIPOLOGIA
     async def show_statistics(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        
-        # Statistiche base
-        c.execute('SELECT COUNT(*) FROM interventions')
-        total_interventions = c.fetchone()[0]
-        
-        c.execute('SELECT MIN(exit_time), MAX(exit_time) FROM interventions')
-        date_range = c.fetchone()
-        
-        c.execute('SELECT COUNT(DISTINCT year) FROM interventions')
-        years_count = c.fetchone()[0]
-        
-        c.execute('SELECT DISTINCT year FROM interventions ORDER BY year')
-        years = [str(row[0]) for row in c.fetchall()]
-        
-        # Statistiche per tipologia (NUOVE)
-        c.execute('''
-            SELECT intervention_type, COUNT(*) as count 
-            FROM interventions 
-            GROUP BY intervention_type 
-            ORDER BY count DESC
-        ''')
-        type_stats = c.fetchall()
-        
-        # Statistiche mezzi più utilizzati
-        c.execute('''
-            SELECT vehicles_used, COUNT(*) as count
-            FROM interventions
-            GROUP BY vehicles_used
-            ORDER BY count DESC
-            LIMIT 5
-        ''')
-        vehicle_stats = c.fetchall()
-        
-        conn.close()
+        # Letture sulle tabelle aggregate, tutte dallo stesso snapshot (db.run apre una transazione)
+        stats = await db.run(leggi_statistiche)
+        total_interventions = stats['totale']
         
         response = (
             f"📈 **STATISTICHE INTERVENTI**\n\n"
             f"🔢 Totale interventi: {total_interventions}\n"
-            f"📅 Anni registrati: {years_count} ({', '.join(years)})\n"
-            f"🚨 Primo intervento: {date_range[0] if date_range[0] else 'N/A'}\n"
-            f"✅ Ultimo intervento: {date_range[1] if date_range[1] else 'N/A'}\n\n"
+            f"📅 Anni registrati: {len(stats['anni'])} ({', '.join(stats['anni'])})\n"
+            f"🚨 Primo intervento: {stats['primo'] or 'N/A'}\n"
+            f"✅ Ultimo intervento: {stats['ultimo'] or 'N/A'}\n\n"
         )
         
         # Aggiungi statistiche tipologie
-        if type_stats and total_interventions > 0:
+        if stats['per_tipologia'] and total_interventions > 0:
             response += "🔥 **TIPOLOGIE INTERVENTI**\n"
-            for typ, count in type_stats:
+            for typ, count in stats['per_tipologia']:
                 percentage = (count / total_interventions) * 100
                 response += f"• {typ}: {count} ({percentage:.1f}%)\n"
             response += "\n"
         
         # Aggiungi statistiche mezzi
-        if vehicle_stats:
+        if stats['per_mezzo']:
             response += "🚒 **MEZZI PIÙ UTILIZZATI**\n"
-            for vehicles, count in vehicle_stats:
-                vehicle_list = ', '.join(json.loads(vehicles))
-                response += f"• {vehicle_list}: {count} interventi\n"
+            for targa, count, minuti, ultimo in stats['per_mezzo']:
+                response += f"• {targa}: {count} interventi, {minuti / 60:.1f} h fuori, ultimo {ultimo or 'N/A'}\n"
+            response += "\n"
+        
+        # Aggiungi andamento mensile dell'ultimo anno
+        if stats['per_mese']:
+            response += f"📆 **{stats['anno_mesi']} PER MESE**\n"
+            response += " · ".join(f"{MESI[mese - 1]} {count}" for mese, count in stats['per_mese'])
         
         await update.message.reply_text(response)
 
+    async def rebuild_statistics(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Comando /ricalcola_statistiche: ricostruisce gli aggregati da zero (admin)"""
+        if not await self.is_admin(update.effective_user.id):
+            await update.message.reply_text("❌ Solo gli amministratori possono ricalcolare le statistiche.")
+            return
+        
+        durata = await db.write(ricostruisci_statistiche)
+        viste_interventi.invalida()
+        await update.message.reply_text(f"✅ Statistiche ricalcolate in {durata * 1000:.0f} ms")
+
     # 🔥 MODIFICA VIGILE CON SELEZIONE INTERATTIVA
     async def modifica_vigile_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Avvia modifica informazioni vigile"""
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('SELECT id, full_name FROM personnel WHERE is_active = TRUE ORDER BY full_name')
-        vigili = c.fetchall()
-        conn.close()
+        vigili = await db.fetchall('SELECT id, full_name FROM personnel WHERE is_active = TRUE ORDER BY full_name')
         
         keyboard = [[f"👤 {vigile[1]}"] for vigile in vigili]
         keyboard.append(['🔙 Indietro'])
@@ -933,15 +1126,11 @@ class VigiliBot:
         context.user_data['vigile_modifica'] = vigile_nome
         
         # Recupera info attuali del vigile
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('''
+        info_vigile = await db.fetchone('''
             SELECT qualification, license_grade, has_nautical_license, is_saf, is_tpss,
                    squadra_notturna, squadra_serale, squadra_domenicale
             FROM personnel WHERE full_name = ?
         ''', (vigile_nome,))
-        info_vigile = c.fetchone()
-        conn.close()
         
         qualifica, patente, nautica, saf, tpss, sq_notte, sq_sera, sq_dom = info_vigile
         
@@ -1018,9 +1207,6 @@ class VigiliBot:
         campo = context.user_data['campo_modifica']
         nuovo_valore = update.message.text
         
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        
         # Mappa campi ai nomi colonna
         mappa_campi = {
             '🎓 Qualifica': 'qualification',
@@ -1032,22 +1218,20 @@ class VigiliBot:
         
         if campo in mappa_campi:
             colonna = mappa_campi[campo]
-            c.execute(f'UPDATE personnel SET {colonna} = ? WHERE full_name = ?', (nuovo_valore, vigile_nome))
+            await db.execute(f'UPDATE personnel SET {colonna} = ? WHERE full_name = ?', (nuovo_valore, vigile_nome))
         elif campo == '🚢 Nautica':
             nautica = nuovo_valore == '✅ Attiva'
-            c.execute('UPDATE personnel SET has_nautical_license = ? WHERE full_name = ?', (nautica, vigile_nome))
+            await db.execute('UPDATE personnel SET has_nautical_license = ? WHERE full_name = ?', (nautica, vigile_nome))
         elif campo == '🛡️ SAF/TPSS':
             if nuovo_valore in ['✅ SAF', '❌ SAF']:
                 saf = nuovo_valore == '✅ SAF'
-                c.execute('UPDATE personnel SET is_saf = ? WHERE full_name = ?', (saf, vigile_nome))
+                await db.execute('UPDATE personnel SET is_saf = ? WHERE full_name = ?', (saf, vigile_nome))
             else:
                 tpss = nuovo_valore == '✅ TPSS'
-                c.execute('UPDATE personnel SET is_tpss = ? WHERE full_name = ?', (tpss, vigile_nome))
-        
-        conn.commit()
-        conn.close()
+                await db.execute('UPDATE personnel SET is_tpss = ? WHERE full_name = ?', (tpss, vigile_nome))
+        anagrafiche.invalida()
         
-        is_admin = self.is_admin(update.effective_user.id)
+        is_admin = await self.is_admin(update.effective_user.id)
         await update.message.reply_text(
             f"✅ **{campo} aggiornato per {vigile_nome}!**",
             reply_markup=self.get_main_keyboard(is_admin)
@@ -1071,51 +1255,218 @@ class VigiliBot:
         report_num = context.user_data['search_report_num']
         year = update.message.text
         
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('''
-            SELECT report_number, year, exit_time, return_time, address, 
-                   intervention_type, squad_leader, driver, vehicles_used, participants
+        intervention = await db.fetchone(f'''
+            SELECT {SCHEDA_SQL}
             FROM interventions 
             WHERE report_number = ? AND year = ?
         ''', (report_num, year))
         
-        intervention = c.fetchone()
-        conn.close()
-        
         user = update.effective_user
-        is_admin = self.is_admin(user.id)
+        is_admin = await self.is_admin(user.id)
         
         if intervention:
-            response = (
-                f"🔍 **RAPPORTO TROVATO**\n\n"
-                f"📋 Rapporto: {intervention[0]}/{intervention[1]}\n"
-                f"🔥 Tipologia: {intervention[5]}\n"
-                f"📍 Indirizzo: {intervention[4]}\n"
-                f"🚨 Uscita: {intervention[2]}\n"
-                f"✅ Rientro: {intervention[3]}\n"
-                f"👨‍🚒 Caposquadra: {intervention[6]}\n"
-                f"🚗 Autista: {intervention[7]}\n"
-                f"🚒 Mezzi: {', '.join(json.loads(intervention[8]))}\n"
-            )
-            
-            if is_admin:
-                response += f"👥 Partecipanti: {', '.join(json.loads(intervention[9]))}\n"
-            
-            await update.message.reply_text(response)
+            await update.message.reply_text("🔍 **RAPPORTO TROVATO**\n\n" + self.format_intervention(intervention, is_admin))
         else:
             await update.message.reply_text("❌ Rapporto non trovato.")
         
         return ConversationHandler.END
 
+    def format_intervention(self, intervention, partecipanti=False):
+        """Scheda di un intervento (riga con le colonne di SCHEDA_SQL)"""
+        response = (
+            f"📋 Rapporto: {intervention[0]}/{intervention[1]}\n"
+            f"🔥 Tipologia: {intervention[5]}\n"
+            f"📍 Indirizzo: {intervention[4]}\n"
+            f"🚨 Uscita: {intervention[2]}\n"
+            f"✅ Rientro: {intervention[3]}\n"
+            f"👨‍🚒 Caposquadra: {intervention[6]}\n"
+            f"🚗 Autista: {intervention[7]}\n"
+            f"🚒 Mezzi: {elenco(intervention[10], intervention[8])}\n"
+        )
+        if partecipanti:
+            response += f"👥 Partecipanti: {elenco(intervention[11], intervention[9])}\n"
+        return response
+
+    async def inline_search(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Modalità inline: @bot 123/2025 o parte di un indirizzo, da qualsiasi chat"""
+        query = update.inline_query
+        testo = ' '.join(query.query.split())
+        autorizzato, is_admin = await autorizzazioni.stato(query.from_user.id)
+        if not (autorizzato or is_admin) or len(testo) < 2:
+            await query.answer([], cache_time=5, is_personal=True)
+            return
+        
+        # Una query per tasto premuto: i testi già cercati arrivano dalla cache
+        righe = await ricerche_inline.get(testo.casefold(), db.run, cerca_inline, testo)
+        risultati = [
+            InlineQueryResultArticle(
+                id=str(riga[0]),
+                title=f"📋 {riga[1]}/{riga[2]} - {riga[6]}",
+                description=f"🚨 {riga[3]} · 📍 {riga[5]}",
+                input_message_content=InputTextMessageContent(self.format_intervention(riga[1:]))
+            )
+            for riga in righe
+        ]
+        # Risultati personali: un utente non autorizzato non deve riceverli dalla cache di Telegram
+        await query.answer(risultati, cache_time=30, is_personal=True)
+
+    async def free_text_search(self, update: Update, context: ContextTypes.DEFAULT_TYPE, is_admin):
+        """Interventi più pertinenti per il testo (indice FTS5; i partecipanti solo per gli admin)"""
+        testo = update.message.text
+        
+        if testo == '🔙 Indietro':
+            context.user_data['awaiting_ricerca_testo'] = False
+            await update.message.reply_text(
+                "Ricerca terminata.",
+                reply_markup=self.get_main_keyboard(is_admin)
+            )
+            return
+        
+        risultati = await db.run(cerca_interventi, testo, is_admin)
+        
+        if not risultati:
+            await update.message.reply_text(f"❌ Nessun intervento trovato per \"{testo}\".")
+            return
+        
+        response = f"🔎 **RISULTATI PER \"{testo}\"**\n\n"
+        for report_number, year, exit_time, address, intervention_type in risultati:
+            response += f"📋 {report_number}/{year} - {exit_time}\n🔥 {intervention_type} · 📍 {address}\n\n"
+        response += "Scrivi un'altra ricerca o premi 🔙 Indietro."
+        
+        await update.message.reply_text(tronca_telegram(response))
+
+    # 🧰 RICERCA CON FILTRI
+    async def filter_search_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE, avviso=''):
+        """Riepilogo dei filtri impostati e scelta del prossimo"""
+        context.user_data['awaiting_filtri'] = 'menu'
+        filtri = context.user_data.setdefault('filtri', {})
+        keyboard = [
+            ['📅 Periodo', '🔥 Tipologia'],
+            ['🚒 Mezzo', '👨‍🚒 Vigile'],
+            ['🔎 Mostra Risultati', '🧹 Azzera Filtri'],
+            ['🔙 Indietro']
+        ]
+        await update.message.reply_text(
+            f"{avviso}🧰 **RICERCA CON FILTRI**\n\n"
+            f"📅 Periodo: {filtri.get('periodo', 'qualsiasi')}\n"
+            f"🔥 Tipologia: {filtri.get('tipologia', 'qualsiasi')}\n"
+            f"🚒 Mezzo: {filtri.get('mezzo', 'qualsiasi')}\n"
+            f"👨‍🚒 Vigile: {filtri.get('vigile', 'qualsiasi')}\n\n"
+            "Scegli un filtro da impostare oppure 🔎 Mostra Risultati.",
+            reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        )
+
+    async def filter_search_step(self, update: Update, context: ContextTypes.DEFAULT_TYPE, is_admin):
+        """Un passo della ricerca con filtri: scelta del filtro o suo valore"""
+        testo = update.message.text
+        passo = context.user_data['awaiting_filtri']
+        filtri = context.user_data.setdefault('filtri', {})
+        qualsiasi = ['❌ Qualsiasi']
+        
+        if passo == 'menu':
+            if testo == '🔙 Indietro':
+                context.user_data['awaiting_filtri'] = None
+                await update.message.reply_text(
+                    "Ricerca terminata.",
+                    reply_markup=self.get_main_keyboard(is_admin)
+                )
+            elif testo == '📅 Periodo':
+                context.user_data['awaiting_filtri'] = 'periodo'
+                rapidi = list(PERIODI_RAPIDI)
+                await update.message.reply_text(
+                    "📅 Scrivi il periodo: MM/AAAA, T1 AAAA, AAAA o un intervallo "
+                    "(es. 03/2026 - 06/2026, 01/03/2026 - 15/06/2026):",
+                    reply_markup=ReplyKeyboardMarkup(
+                        [rapidi[0:2], rapidi[2:4], rapidi[4:6], qualsiasi], resize_keyboard=True
+                    )
+                )
+            elif testo in ('🔥 Tipologia', '🚒 Mezzo', '👨‍🚒 Vigile'):
+                dati = await anagrafiche.get()
+                passo, valori = {
+                    '🔥 Tipologia': ('tipologia', TIPOLOGIE_INTERVENTO),
+                    '🚒 Mezzo': ('mezzo', [m.license_plate for m in dati.mezzi]),
+                    '👨‍🚒 Vigile': ('vigile', [v.full_name for v in dati.per_nome]),
+                }[testo]
+                context.user_data['awaiting_filtri'] = passo
+                keyboard = [list(valori[i:i + 2]) for i in range(0, len(valori), 2)] + [qualsiasi]
+                await update.message.reply_text(
+                    f"{testo}: scegli dall'elenco o scrivilo:",
+                    reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+                )
+            elif testo == '🧹 Azzera Filtri':
+                filtri.clear()
+                await self.filter_search_menu(update, context)
+            elif testo == '🔎 Mostra Risultati':
+                # I pulsanti di pagina usano i filtri di questa ricerca, anche se poi cambiano
+                context.user_data['filtri_risultati'] = dict(filtri)
+                response, markup = await self.filter_page(context.user_data['filtri_risultati'], is_admin)
+                await update.message.reply_text(response, reply_markup=markup)
+            else:
+                await self.filter_search_menu(update, context, "Scegli un'opzione dalla tastiera.\n\n")
+            return
+        
+        if testo == qualsiasi[0]:
+            for chiave in (('periodo', 'inizio', 'fine') if passo == 'periodo' else (passo,)):
+                filtri.pop(chiave, None)
+        elif passo == 'periodo':
+            intervallo = intervallo_date(testo)
+            if intervallo is None:
+                await update.message.reply_text("❌ Periodo non valido. Usa MM/AAAA, T1 AAAA, AAAA o GG/MM/AAAA - GG/MM/AAAA.")
+                return
+            filtri['inizio'], filtri['fine'] = intervallo
+            filtri['periodo'] = testo
+        else:
+            filtri[passo] = testo.strip()
+        await self.filter_search_menu(update, context)
+
+    async def filter_page(self, filtri, is_admin, cursore=None, indietro=False, pagina=1):
+        """Testo e pulsanti ◀️/▶️ di una pagina di risultati (keyset su data di uscita e id)"""
+        righe, precedente, successiva = await db.run(pagina_filtrata, filtri, is_admin, cursore, indietro)
+        if not righe:
+            return "❌ Nessun intervento corrisponde ai filtri.", None
+        
+        response = f"🧰 **RISULTATI** (pagina {pagina})\n\n"
+        for _, _, report_number, year, exit_time, address, intervention_type in righe:
+            response += f"📋 {report_number}/{year} - {exit_time}\n🔥 {intervention_type} · 📍 {address[:100]}\n\n"
+        
+        pulsanti = []
+        if precedente:
+            primo = righe[0]
+            pulsanti.append(InlineKeyboardButton("◀️ Precedenti", callback_data=f"flt:p:{pagina - 1}:{primo[0]}:{primo[1]}"))
+        if successiva:
+            ultimo = righe[-1]
+            pulsanti.append(InlineKeyboardButton("Successivi ▶️", callback_data=f"flt:n:{pagina + 1}:{ultimo[0]}:{ultimo[1]}"))
+        return response, InlineKeyboardMarkup([pulsanti]) if pulsanti else None
+
+    async def filter_page_callback(self, query, context: ContextTypes.DEFAULT_TYPE):
+        """◀️/▶️ della ricerca con filtri: modifica lo stesso messaggio"""
+        autorizzato, is_admin = await autorizzazioni.stato(query.from_user.id)
+        filtri = context.user_data.get('filtri_risultati')
+        if not autorizzato:
+            await query.edit_message_text("❌ Non hai i permessi per questa azione.")
+            return
+        if filtri is None:
+            await query.edit_message_text("⌛ Ricerca scaduta: ripetila da 🧰 Ricerca con Filtri.")
+            return
+        
+        # flt:<n|p>:<pagina>:<id>:<exit_at> (exit_at contiene ':')
+        _, verso, pagina, intervention_id, exit_at = query.data.split(':', 4)
+        response, markup = await self.filter_page(
+            filtri, is_admin, (exit_at, int(intervention_id)), verso == 'p', int(pagina)
+        )
+        await query.edit_message_text(response, reply_markup=markup)
+
     # 🔥 ESPORTAZIONE DATI
     async def export_data_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
-        if not self.is_admin(user.id):
+        if not await self.is_admin(user.id):
             await update.message.reply_text("❌ Solo gli admin possono esportare i dati.")
             return
         
-        available_years = self.get_available_years()
+        # Ogni ritorno al menu chiude la scelta della destinazione delle novità
+        context.user_data['awaiting_export'] = False
+        context.user_data['awaiting_delta_destinazione'] = False
+        available_years = await self.get_available_years()
         
         if not available_years:
             await update.message.reply_text("❌ Nessun dato disponibile per l'esportazione.")
@@ -1126,8 +1477,10 @@ class VigiliBot:
         for year in available_years:
             keyboard.append([f"📅 Esporta {year}"])
         
-        keyboard.append(['📊 Esporta Tutto'])
+        keyboard.append(['📊 Esporta Tutto', '🗜️ Esporta ZIP'])
+        keyboard.append(['🆕 Esporta Novità'])
         keyboard.append(['🔙 Indietro'])
+        context.user_data['awaiting_export'] = True
         
         await update.message.reply_text(
             "📊 **ESPORTAZIONE DATI**\n\n"
@@ -1139,14 +1492,16 @@ class VigiliBot:
     async def export_selected_year(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Gestisce la selezione dell'anno per l'esportazione"""
         user = update.effective_user
-        if not self.is_admin(user.id):
+        if not await self.is_admin(user.id):
             await update.message.reply_text("❌ Solo gli admin possono esportare i dati.")
+            context.user_data['awaiting_export'] = False
             return ConversationHandler.END
         
         message_text = update.message.text
         
         if message_text == '🔙 Indietro':
-            is_admin = self.is_admin(user.id)
+            context.user_data['awaiting_export'] = False
+            is_admin = await self.is_admin(user.id)
             await update.message.reply_text(
                 "Operazione annullata.",
                 reply_markup=self.get_main_keyboard(is_admin)
@@ -1156,6 +1511,12 @@ class VigiliBot:
         if message_text == '📊 Esporta Tutto':
             return await self.export_all_data(update, context)
         
+        if message_text == '🗜️ Esporta ZIP':
+            return await self.export_zip(update, context)
+        
+        if message_text == '🆕 Esporta Novità':
+            return await self.delta_export_menu(update, context)
+        
         # Estrai l'anno dal testo del pulsante
         if message_text.startswith('📅 Esporta '):
             selected_year = message_text.replace('📅 Esporta ', '').strip()
@@ -1165,78 +1526,45 @@ class VigiliBot:
         return EXPORT_SELECT_YEAR
 
     async def generate_year_export(self, update: Update, context: ContextTypes.DEFAULT_TYPE, year):
-        """Genera e invia il file CSV per l'anno specificato"""
+        """Invia il file CSV per l'anno specificato (dalla cache se i dati dell'anno non sono cambiati)"""
         try:
-            conn = sqlite3.connect(DATABASE_NAME)
-            c = conn.cursor()
-            c.execute('''
-                SELECT report_number, exit_time, return_time, address, intervention_type,
-                       squad_leader, driver, participants, vehicles_used
-                FROM interventions 
-                WHERE year = ? 
-                ORDER BY exit_time
-            ''', (year,))
-            
-            interventions = c.fetchall()
-            conn.close()
+            voce = await db.run(prepara_export_anno, int(year))
             
-            if not interventions:
+            if voce is None:
                 await update.message.reply_text(f"❌ Nessun intervento trovato per l'anno {year}")
                 return EXPORT_SELECT_YEAR
             
-            # Crea file CSV in memoria
-            output = io.StringIO()
-            writer = csv.writer(output)
-            
-            # Intestazione migliorata CON TIPOLOGIA
-            writer.writerow([
-                'Rapporto', 'Anno', 'Data Uscita', 'Ora Uscita', 
-                'Data Rientro', 'Ora Rientro', 'Indirizzo', 'Tipologia',
-                'Caposquadra', 'Autista', 'Vigili Partecipanti', 'Mezzi Utilizzati'
-            ])
-            
-            # Dati
-            for interv in interventions:
-                exit_parts = interv[1].split(' ') if interv[1] else ['', '']
-                return_parts = interv[2].split(' ') if interv[2] else ['', '']
-                
-                writer.writerow([
-                    interv[0],  # report_number
-                    year,
-                    exit_parts[0] if len(exit_parts) > 0 else '',
-                    exit_parts[1] if len(exit_parts) > 1 else '',
-                    return_parts[0] if len(return_parts) > 0 else '',
-                    return_parts[1] if len(return_parts) > 1 else '',
-                    interv[3],  # address
-                    interv[4],  # intervention_type (NUOVO)
-                    interv[5],  # squad_leader
-                    interv[6],  # driver
-                    ', '.join(json.loads(interv[7])),  # participants
-                    ', '.join(json.loads(interv[8]))   # vehicles_used
-                ])
-            
-            # Prepara file per download
-            output.seek(0)
-            csv_content = output.getvalue().encode('utf-8')
-            output.close()
+            caption = (
+                f"📊 **ESPORTazione INTERVENTI {year}**\n"
+                f"🔢 Totale interventi: {voce.riepilogo['totale']}\n"
+                f"📅 Primo intervento: {voce.riepilogo['prima_uscita']}\n"
+                f"🔄 Ultimo intervento: {voce.riepilogo['ultima_uscita']}\n"
+                f"💾 Formato: CSV (Excel compatibile)"
+            )
             
-            # Statistiche aggiuntive
-            total_interventions = len(interventions)
-            first_intervention = interventions[0][1] if interventions else "N/A"
-            last_intervention = interventions[-1][1] if interventions else "N/A"
+            # Già inviato a questa versione: Telegram riusa il file senza nuovo upload
+            if voce.file_id:
+                try:
+                    await update.message.reply_document(document=voce.file_id, caption=caption)
+                    return await self.export_data_menu(update, context)
+                except Exception as e:
+                    logger.warning(f"⚠️ file_id dell'export {year} non accettato, nuovo upload: {e}")
+                    if voce.percorso is None:
+                        voce = await db.run(prepara_export_anno, int(year), True)
             
-            # Invia file
-            await update.message.reply_document(
-                document=io.BytesIO(csv_content),
-                filename=f"interventi_{year}.csv",
-                caption=(
-                    f"📊 **ESPORTazione INTERVENTI {year}**\n"
-                    f"🔢 Totale interventi: {total_interventions}\n"
-                    f"📅 Primo intervento: {first_intervention}\n"
-                    f"🔄 Ultimo intervento: {last_intervention}\n"
-                    f"💾 Formato: CSV (Excel compatibile)"
+            # Invia file (se un export più recente l'ha appena cancellato, lo si riscrive)
+            try:
+                file_csv = open(voce.percorso, 'rb')
+            except FileNotFoundError:
+                voce = await db.run(prepara_export_anno, int(year), True)
+                file_csv = open(voce.percorso, 'rb')
+            with file_csv:
+                messaggio = await update.message.reply_document(
+                    document=file_csv,
+                    filename=f"interventi_{year}.csv",
+                    caption=caption
                 )
-            )
+            await db.write(salva_export, voce, messaggio.document.file_id)
             
             # Torna al menu esportazione
             return await self.export_data_menu(update, context)
@@ -1252,95 +1580,150 @@ class VigiliBot:
     async def export_all_data(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Esporta tutti i dati indipendentemente dall'anno"""
         try:
-            conn = sqlite3.connect(DATABASE_NAME)
-            c = conn.cursor()
-            c.execute('''
-                SELECT report_number, year, exit_time, return_time, address, intervention_type,
-                       squad_leader, driver, participants, vehicles_used
-                FROM interventions 
-                ORDER BY year DESC, exit_time
-            ''')
-            
-            interventions = c.fetchall()
-            conn.close()
+            file_csv, riepilogo = await db.run(esporta_csv)
             
-            if not interventions:
+            if file_csv is None:
                 await update.message.reply_text("❌ Nessun intervento trovato nel database")
                 return EXPORT_SELECT_YEAR
             
-            # Crea file CSV in memoria
-            output = io.StringIO()
-            writer = csv.writer(output)
-            
-            # Intestazione CON TIPOLOGIA
-            writer.writerow([
-                'Rapporto', 'Anno', 'Data Uscita', 'Ora Uscita', 
-                'Data Rientro', 'Ora Rientro', 'Indirizzo', 'Tipologia',
-                'Caposquadra', 'Autista', 'Vigili Partecipanti', 'Mezzi Utilizzati'
-            ])
+            years = sorted(riepilogo['anni'])
+            with file_csv:
+                await update.message.reply_document(
+                    document=file_csv,
+                    filename=f"interventi_completo_{datetime.now().strftime('%Y%m%d')}.csv",
+                    caption=(
+                        f"📊 **ESPORTazione COMPLETA**\n"
+                        f"🔢 Totale interventi: {riepilogo['totale']}\n"
+                        f"📅 Anni coperti: {len(years)} ({', '.join(map(str, years))})\n"
+                        f"💾 Formato: CSV (Excel compatibile)"
+                    )
+                )
             
-            # Dati
-            for interv in interventions:
-                exit_parts = interv[2].split(' ') if interv[2] else ['', '']
-                return_parts = interv[3].split(' ') if interv[3] else ['', '']
-                
-                writer.writerow([
-                    interv[0],  # report_number
-                    interv[1],  # year
-                    exit_parts[0] if len(exit_parts) > 0 else '',
-                    exit_parts[1] if len(exit_parts) > 1 else '',
-                    return_parts[0] if len(return_parts) > 0 else '',
-                    return_parts[1] if len(return_parts) > 1 else '',
-                    interv[4],  # address
-                    interv[5],  # intervention_type (NUOVO)
-                    interv[6],  # squad_leader
-                    interv[7],  # driver
-                    ', '.join(json.loads(interv[8])),  # participants
-                    ', '.join(json.loads(interv[9]))   # vehicles_used
-                ])
+            # Torna al menu esportazione
+            return await self.export_data_menu(update, context)
             
-            # Prepara file per download
-            output.seek(0)
-            csv_content = output.getvalue().encode('utf-8')
-            output.close()
+        except Exception as e:
+            logger.error(f"Errore durante l'esportazione completa: {str(e)}")
+            await update.message.reply_text(
+                f"❌ Errore durante l'esportazione: {str(e)}"
+            )
+            return EXPORT_SELECT_YEAR
+
+    async def export_zip(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Esporta un archivio ZIP con un CSV per anno, personale e mezzi"""
+        try:
+            file_zip, riepilogo = await db.run(esporta_zip)
             
-            # Statistiche
-            total_interventions = len(interventions)
-            years = set(interv[1] for interv in interventions)
+            if file_zip is None:
+                await update.message.reply_text("❌ Nessun intervento trovato nel database")
+                return EXPORT_SELECT_YEAR
             
-            await update.message.reply_document(
-                document=io.BytesIO(csv_content),
-                filename=f"interventi_completo_{datetime.now().strftime('%Y%m%d')}.csv",
-                caption=(
-                    f"📊 **ESPORTazione COMPLETA**\n"
-                    f"🔢 Totale interventi: {total_interventions}\n"
-                    f"📅 Anni coperti: {len(years)} ({', '.join(map(str, sorted(years)))})\n"
-                    f"💾 Formato: CSV (Excel compatibile)"
+            years = sorted(riepilogo['anni'])
+            with file_zip:
+                await update.message.reply_document(
+                    document=file_zip,
+                    filename=f"interventi_{datetime.now().strftime('%Y%m%d')}.zip",
+                    caption=(
+                        f"🗜️ **ESPORTAZIONE ZIP**\n"
+                        f"🔢 Totale interventi: {riepilogo['totale']}\n"
+                        f"📅 Anni: {len(years)} ({', '.join(map(str, years))}), un CSV per anno\n"
+                        f"👨‍🚒 Con personale.csv e mezzi.csv\n"
+                        f"💾 {riepilogo['dimensione_zip'] / 1024:.0f} KB (CSV: {riepilogo['dimensione_csv'] / 1024:.0f} KB)"
+                    )
                 )
-            )
             
             # Torna al menu esportazione
             return await self.export_data_menu(update, context)
             
         except Exception as e:
-            logger.error(f"Errore durante l'esportazione completa: {str(e)}")
+            logger.error(f"Errore durante l'esportazione ZIP: {str(e)}")
             await update.message.reply_text(
                 f"❌ Errore durante l'esportazione: {str(e)}"
             )
             return EXPORT_SELECT_YEAR
 
+    # 🆕 EXPORT DELLE NOVITÀ
+    async def delta_export_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Scelta della destinazione per l'export dei soli interventi nuovi"""
+        destinazioni = await db.run(destinazioni_delta)
+        
+        keyboard = [['👤 Le Mie Novità']]
+        keyboard += [[f"🎯 {nome}"] for nome, _ in destinazioni]
+        keyboard.append(['🔙 Indietro'])
+        context.user_data['awaiting_delta_destinazione'] = True
+        
+        elenco_destinazioni = "".join(f"🎯 {nome}: ultimo export {ultimo}\n" for nome, ultimo in destinazioni)
+        await update.message.reply_text(
+            "🆕 **ESPORTA NOVITÀ**\n\n"
+            "Solo gli interventi inseriti dopo l'ultimo export verso la stessa destinazione.\n\n"
+            f"{elenco_destinazioni}\n"
+            "Scegli una destinazione o scrivi il nome di una nuova (es. Provincia):",
+            reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        )
+        return EXPORT_DELTA_TARGET
+
+    async def delta_export_target(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Invia le novità per la destinazione scelta e ne sposta il watermark"""
+        user = update.effective_user
+        if not await self.is_admin(user.id):
+            await update.message.reply_text("❌ Solo gli admin possono esportare i dati.")
+            context.user_data['awaiting_delta_destinazione'] = False
+            return ConversationHandler.END
+        
+        message_text = update.message.text.strip()
+        if message_text == '🔙 Indietro':
+            return await self.export_data_menu(update, context)
+        
+        if message_text == '👤 Le Mie Novità':
+            destinazione, etichetta = f"admin:{user.id}", "te"
+        else:
+            destinazione = etichetta = message_text.removeprefix('🎯 ').strip()[:40]
+            # Il prefisso admin: è riservato ai watermark personali
+            if not destinazione or destinazione.startswith('admin:'):
+                await update.message.reply_text("❌ Nome destinazione non valido.")
+                return EXPORT_DELTA_TARGET
+        
+        try:
+            file_csv, riepilogo = await db.run(esporta_delta, destinazione)
+            
+            if file_csv is None:
+                dal = f" dall'export del {riepilogo['precedente']}" if riepilogo['precedente'] else ""
+                await update.message.reply_text(f"✅ Nessun nuovo intervento per {etichetta}{dal}.")
+                return await self.export_data_menu(update, context)
+            
+            anni = ', '.join(map(str, sorted(riepilogo['anni'])))
+            nome_file = '' if destinazione.startswith('admin:') else '_' + re.sub(r'\W+', '_', destinazione)
+            with file_csv:
+                await update.message.reply_document(
+                    document=file_csv,
+                    filename=f"interventi_novita{nome_file}_{datetime.now().strftime('%Y%m%d')}.csv",
+                    caption=(
+                        f"🆕 **NOVITÀ PER {etichetta.upper()}**\n"
+                        f"🔢 Nuovi interventi: {riepilogo['totale']} (anni {anni})\n"
+                        + (f"📅 Dall'export del {riepilogo['precedente']}\n" if riepilogo['precedente'] else "📅 Primo export: tutto l'archivio\n")
+                        + f"💾 Formato: CSV (Excel compatibile)"
+                    )
+                )
+            # Il watermark avanza solo a file consegnato
+            await db.write(avanza_watermark, destinazione, riepilogo, user.id)
+            
+            return await self.export_data_menu(update, context)
+            
+        except Exception as e:
+            logger.error(f"Errore durante l'esportazione delle novità: {str(e)}")
+            await update.message.reply_text(
+                f"❌ Errore durante l'esportazione: {str(e)}"
+            )
+            return EXPORT_DELTA_TARGET
+
     # 🔥 GESTIONE RICHIESTE ACCESSO (ADMIN)
     async def manage_requests(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
-        if not self.is_admin(user.id):
+        if not await self.is_admin(user.id):
             await update.message.reply_text("❌ Solo gli admin possono gestire le richieste.")
             return
         
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('SELECT * FROM access_requests WHERE status = "pending"')
-        requests = c.fetchall()
-        conn.close()
+        requests = await db.fetchall('SELECT * FROM access_requests WHERE status = "pending"')
         
         if not requests:
             await update.message.reply_text("Nessuna richiesta pendente.")
@@ -1365,28 +1748,32 @@ class VigiliBot:
         
         data = query.data
         user_id = query.from_user.id
+        
+        # Pagine della ricerca con filtri: per tutti gli utenti autorizzati
+        if data.startswith('flt:'):
+            await self.filter_page_callback(query, context)
+            return
+        if data.startswith('ult:'):
+            await self.last_interventions_callback(query, context)
+            return
 
-        if not self.is_admin(user_id):
+        if not await self.is_admin(user_id):
             await query.edit_message_text("❌ Non hai i permessi per questa azione.")
             return
         
         if data.startswith('approve_'):
             telegram_id = int(data.split('_')[1])
-            conn = sqlite3.connect(DATABASE_NAME)
-            c = conn.cursor()
-            c.execute('UPDATE access_requests SET status = "approved" WHERE telegram_id = ?', (telegram_id,))
-            c.execute('INSERT OR REPLACE INTO users (telegram_id, username, full_name, role, is_active) VALUES (?, ?, ?, ?, ?)', 
-                     (telegram_id, 'username', 'full_name', 'user', True))
-            conn.commit()
-            conn.close()
+            def approva(conn):
+                conn.execute('UPDATE access_requests SET status = "approved" WHERE telegram_id = ?', (telegram_id,))
+                conn.execute('INSERT OR REPLACE INTO users (telegram_id, username, full_name, role, is_active) VALUES (?, ?, ?, ?, ?)', 
+                             (telegram_id, 'username', 'full_name', 'user', True))
+            await db.write(approva)
+            autorizzazioni.invalida(telegram_id)
             await query.edit_message_text(f"✅ Utente approvato!")
         elif data.startswith('reject_'):
             telegram_id = int(data.split('_')[1])
-            conn = sqlite3.connect(DATABASE_NAME)
-            c = conn.cursor()
-            c.execute('UPDATE access_requests SET status = "rejected" WHERE telegram_id = ?', (telegram_id,))
-            conn.commit()
-            conn.close()
+            await db.execute('UPDATE access_requests SET status = "rejected" WHERE telegram_id = ?', (telegram_id,))
+            autorizzazioni.invalida(telegram_id)
             await query.edit_message_text(f"❌ Richiesta rifiutata.")
 
     # 🔥 GESTIONE PERSONALE (ADMIN) - AGGIUNGI NUOVO
@@ -1468,9 +1855,7 @@ class VigiliBot:
         context.user_data['tpss'] = update.message.text == 'Sì'
         
         # Salva il personale
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('''
+        await db.execute('''
             INSERT INTO personnel (full_name, qualification, license_grade, 
                                  has_nautical_license, is_saf, is_tpss)
             VALUES (?, ?, ?, ?, ?, ?)
@@ -1482,11 +1867,10 @@ class VigiliBot:
             context.user_data['saf'],
             context.user_data['tpss']
         ))
-        conn.commit()
-        conn.close()
+        anagrafiche.invalida()
         
         user = update.effective_user
-        is_admin = self.is_admin(user.id)
+        is_admin = await self.is_admin(user.id)
         await update.message.reply_text(
             "✅ Personale aggiunto con successo!",
             reply_markup=self.get_main_keyboard(is_admin)
@@ -1497,15 +1881,11 @@ class VigiliBot:
     async def manage_personnel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Menu per modificare lo stato del personale"""
         user = update.effective_user
-        if not self.is_admin(user.id):
+        if not await self.is_admin(user.id):
             await update.message.reply_text("❌ Solo gli admin possono gestire il personale.")
             return
         
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('SELECT id, full_name, qualification, license_grade FROM personnel WHERE is_active = TRUE ORDER BY full_name')
-        personnel = c.fetchall()
-        conn.close()
+        personnel = await db.fetchall('SELECT id, full_name, qualification, license_grade FROM personnel WHERE is_active = TRUE ORDER BY full_name')
         
         if not personnel:
             await update.message.reply_text("❌ Nessun personale registrato.")
@@ -1525,7 +1905,7 @@ class VigiliBot:
 
     async def manage_personnel_selected(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if update.message.text == '🔙 Indietro':
-            is_admin = self.is_admin(update.effective_user.id)
+            is_admin = await self.is_admin(update.effective_user.id)
             await update.message.reply_text(
                 "Operazione annullata.",
                 reply_markup=self.get_main_keyboard(is_admin)
@@ -1538,11 +1918,7 @@ class VigiliBot:
         context.user_data['editing_person'] = person_name
         
         # Recupera info attuali del vigile
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('SELECT qualification, license_grade, has_nautical_license, is_saf, is_tpss FROM personnel WHERE full_name = ?', (person_name,))
-        person_info = c.fetchone()
-        conn.close()
+        person_info = await db.fetchone('SELECT qualification, license_grade, has_nautical_license, is_saf, is_tpss FROM personnel WHERE full_name = ?', (person_name,))
         
         qualifica, patente, nautica, saf, tpss = person_info
         
@@ -1622,13 +1998,10 @@ class VigiliBot:
         person_name = context.user_data['editing_person']
         
         # Aggiorna nel database
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('UPDATE personnel SET license_grade = ? WHERE full_name = ?', (new_license, person_name))
-        conn.commit()
-        conn.close()
+        await db.execute('UPDATE personnel SET license_grade = ? WHERE full_name = ?', (new_license, person_name))
+        anagrafiche.invalida()
         
-        is_admin = self.is_admin(update.effective_user.id)
+        is_admin = await self.is_admin(update.effective_user.id)
         await update.message.reply_text(
             f"✅ **PATENTE AGGIORNATA!**\n\n"
             f"👤 {person_name}\n"
@@ -1645,13 +2018,10 @@ class VigiliBot:
         person_name = context.user_data['editing_person']
         
         # Aggiorna nel database
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('UPDATE personnel SET qualification = ? WHERE full_name = ?', (new_qualification, person_name))
-        conn.commit()
-        conn.close()
+        await db.execute('UPDATE personnel SET qualification = ? WHERE full_name = ?', (new_qualification, person_name))
+        anagrafiche.invalida()
         
-        is_admin = self.is_admin(update.effective_user.id)
+        is_admin = await self.is_admin(update.effective_user.id)
         await update.message.reply_text(
             f"✅ **QUALIFICA AGGIORNATA!**\n\n"
             f"👤 {person_name}\n"
@@ -1669,13 +2039,10 @@ class VigiliBot:
         has_nautical = action == '✅ Attiva Nautica'
         
         # Aggiorna nel database
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('UPDATE personnel SET has_nautical_license = ? WHERE full_name = ?', (has_nautical, person_name))
-        conn.commit()
-        conn.close()
+        await db.execute('UPDATE personnel SET has_nautical_license = ? WHERE full_name = ?', (has_nautical, person_name))
+        anagrafiche.invalida()
         
-        is_admin = self.is_admin(update.effective_user.id)
+        is_admin = await self.is_admin(update.effective_user.id)
         status = "ATTIVATA" if has_nautical else "DISATTIVATA"
         await update.message.reply_text(
             f"✅ **PATENTE NAUTICA {status}!**\n\n"
@@ -1692,24 +2059,19 @@ class VigiliBot:
         action = update.message.text
         person_name = context.user_data['editing_person']
         
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        
         if action in ['✅ SAF', '❌ SAF']:
             is_saf = action == '✅ SAF'
-            c.execute('UPDATE personnel SET is_saf = ? WHERE full_name = ?', (is_saf, person_name))
+            await db.execute('UPDATE personnel SET is_saf = ? WHERE full_name = ?', (is_saf, person_name))
             status = "ATTIVATO" if is_saf else "DISATTIVATO"
             qualifica = "SAF"
         else:
             is_tpss = action == '✅ TPSS'
-            c.execute('UPDATE personnel SET is_tpss = ? WHERE full_name = ?', (is_tpss, person_name))
+            await db.execute('UPDATE personnel SET is_tpss = ? WHERE full_name = ?', (is_tpss, person_name))
             status = "ATTIVATO" if is_tpss else "DISATTIVATO"
             qualifica = "TPSS"
+        anagrafiche.invalida()
         
-        conn.commit()
-        conn.close()
-        
-        is_admin = self.is_admin(update.effective_user.id)
+        is_admin = await self.is_admin(update.effective_user.id)
         await update.message.reply_text(
             f"✅ **{qualifica} {status}!**\n\n"
             f"👤 {person_name}\n"
@@ -1736,14 +2098,11 @@ class VigiliBot:
         license_plate = context.user_data['license_plate']
         
         # Salva il mezzo
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('INSERT OR IGNORE INTO vehicles (license_plate, model) VALUES (?, ?)', (license_plate, model))
-        conn.commit()
-        conn.close()
+        await db.execute('INSERT OR IGNORE INTO vehicles (license_plate, model) VALUES (?, ?)', (license_plate, model))
+        anagrafiche.invalida()
         
         user = update.effective_user
-        is_admin = self.is_admin(user.id)
+        is_admin = await self.is_admin(user.id)
         await update.message.reply_text(
             f"✅ Mezzo {license_plate} aggiunto con successo!",
             reply_markup=self.get_main_keyboard(is_admin)
@@ -1752,21 +2111,22 @@ class VigiliBot:
 
     # 🔥 HEALTH CHECK
     async def health_check(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        conn = sqlite3.connect(DATABASE_NAME)
-        c = conn.cursor()
-        c.execute('SELECT COUNT(*) FROM interventions')
-        total_interventions = c.fetchone()[0]
-        
-        c.execute('SELECT COUNT(*) FROM users WHERE is_active = TRUE')
-        total_users = c.fetchone()[0]
-        
-        c.execute('SELECT COUNT(*) FROM personnel WHERE is_active = TRUE')
-        total_personnel = c.fetchone()[0]
-        
-        c.execute('SELECT COUNT(DISTINCT year) FROM interventions')
-        years_count = c.fetchone()[0]
+        def conta(conn):
+            c = conn.cursor()
+            c.execute('SELECT COALESCE(SUM(interventions), 0) FROM stats_by_year')
+            total_interventions = c.fetchone()[0]
+            
+            c.execute('SELECT COUNT(*) FROM users WHERE is_active = TRUE')
+            total_users = c.fetchone()[0]
+            
+            c.execute('SELECT COUNT(*) FROM personnel WHERE is_active = TRUE')
+            total_personnel = c.fetchone()[0]
+            
+            c.execute('SELECT COUNT(*) FROM stats_by_year')
+            years_count = c.fetchone()[0]
+            return total_interventions, total_users, total_personnel, years_count
         
-        conn.close()
+        total_interventions, total_users, total_personnel, years_count = await db.run(conta)
         
         health_info = (
             f"🤖 **HEALTH CHECK VIGILI BOT**\n\n"
@@ -1786,7 +2146,7 @@ class VigiliBot:
 
     async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
-        is_admin = self.is_admin(user.id)
+        is_admin = await self.is_admin(user.id)
         await update.message.reply_text(
             "Operazione annullata.",
             reply_markup=self.get_main_keyboard(is_admin)
@@ -1800,8 +2160,10 @@ class VigiliBot:
         # Handler base
         self.application.add_handler(CommandHandler("start", self.start))
         self.application.add_handler(CommandHandler("health", self.health_check))
+        self.application.add_handler(CommandHandler("ricalcola_statistiche", self.rebuild_statistics))
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
         self.application.add_handler(CallbackQueryHandler(self.handle_callback))
+        self.application.add_handler(InlineQueryHandler(self.inline_search))
 
         # Conversazione nuovo intervento CON TIPOLOGIA MIGLIORATA
         intervention_conv = ConversationHandler(
@@ -1861,6 +2223,7 @@ class VigiliBot:
             entry_points=[MessageHandler(filters.Regex('^📁 Esporta Dati$'), self.export_data_menu)],
             states={
                 EXPORT_SELECT_YEAR: [MessageHandler(filters.TEXT, self.export_selected_year)],
+                EXPORT_DELTA_TARGET: [MessageHandler(filters.TEXT, self.delta_export_target)],
             },
             fallbacks=[CommandHandler('cancel', self.cancel)]
         )
@@ -1909,10 +2272,39 @@ class VigiliBot:
 
         print(f"✅ {len(self.application.handlers)} gruppi di handler configurati")
 
+    async def post_init(self, application):
+        """Avvia il monitor dell'event loop e la normalizzazione degli indirizzi dopo l'inizializzazione"""
+        application.create_task(monitor_event_loop_lag())
+        application.create_task(self.completa_indirizzi())
+
+    async def completa_indirizzi(self):
+        """Normalizza a lotti gli indirizzi ancora senza address_key (dopo migrazione o ripristino)"""
+        totale = 0
+        while True:
+            # Un lotto per scrittura: gli inserimenti degli utenti passano tra un lotto e l'altro
+            elaborati = await db.write(completa_indirizzi)
+            if not elaborati:
+                break
+            totale += elaborati
+        if totale:
+            viste_interventi.invalida()
+            logger.info(f"✅ Indirizzi normalizzati per {totale} interventi")
+
+    async def post_shutdown(self, application):
+        """Completa le scritture in coda e chiude il pool di connessioni allo spegnimento"""
+        await db.stop_writer()
+        db.close()
+
     def run(self):
     
         """Avvia il bot CORRETTO"""
-        self.application = Application.builder().token(self.token).build()
+        self.application = (
+            Application.builder()
+            .token(self.token)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
     
     # ✅ IMPOSTA HANDLER PRIMA del run_polling
         self.setup_handlers()
@@ -1974,6 +2366,8 @@ def main():
     # 3. RIPRISTINO DATABASE
     if not enhanced_restore_on_startup():
         print("📝 Inizializzazione database nuovo...")
+    # I CSV in cache sono del database di prima: dopo un ripristino le versioni non corrispondono
+    svuota_cache_export(db.database)
     
     # 4. CONFIGURA ADMIN E AVVIA BOT
     bot = VigiliBot(BOT_TOKEN)
@@ -0,0 +1,232 @@
+# cache.py
+"""Cache in memoria condivise dal processo del bot."""
+import re
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict, namedtuple
+
+from database import db
+
+# Ordine di preferenza degli autisti per grado di patente
+GRADI_AUTISTA = ('IIIE', 'III', 'II', 'I')
+
+Vigile = namedtuple('Vigile', 'id full_name qualification license_grade has_nautical_license is_saf is_tpss')
+Mezzo = namedtuple('Mezzo', 'id license_plate model')
+Anagrafiche = namedtuple('Anagrafiche', 'versione personale per_nome autisti mezzi')
+# Esito di IndiceNomi.risolvi: `nome` se la corrispondenza è certa, altrimenti i `candidati`
+Corrispondenza = namedtuple('Corrispondenza', 'nome candidati')
+
+
+class CacheAutorizzazioni:
+    """Stato utente attivo/admin per telegram_id, con TTL e cache negativa.
+
+    Un messaggio di testo costava tre o quattro connessioni (users + admins,
+    ripetuti da cancel, export, ...): ora la prima lettura popola la voce e le
+    successive fino alla scadenza non toccano il database.
+    """
+
+    def __init__(self, ttl=300, ttl_negativo=60):
+        self.ttl = ttl  # secondi, utenti autorizzati
+        self.ttl_negativo = ttl_negativo  # secondi, ID non autorizzati
+        self._voci = {}
+
+    @staticmethod
+    def _leggi(conn, user_id):
+        autorizzato = conn.execute(
+            'SELECT 1 FROM users WHERE telegram_id = ? AND is_active = TRUE', (user_id,)
+        ).fetchone() is not None
+        admin = conn.execute(
+            'SELECT 1 FROM admins WHERE telegram_id = ?', (user_id,)
+        ).fetchone() is not None
+        return autorizzato, admin
+
+    async def stato(self, user_id):
+        """Restituisce (autorizzato, admin) per l'utente"""
+        voce = self._voci.get(user_id)
+        if voce is not None and voce[2] > time.monotonic():
+            return voce[0], voce[1]
+        autorizzato, admin = await db.run(self._leggi, user_id)
+        ttl = self.ttl if autorizzato or admin else self.ttl_negativo
+        self._voci[user_id] = (autorizzato, admin, time.monotonic() + ttl)
+        return autorizzato, admin
+
+    async def is_authorized(self, user_id):
+        return (await self.stato(user_id))[0]
+
+    async def is_admin(self, user_id):
+        return (await self.stato(user_id))[1]
+
+    def invalida(self, user_id=None):
+        """Dimentica un utente (o tutti se user_id è None)"""
+        if user_id is None:
+            self._voci.clear()
+        else:
+            self._voci.pop(user_id, None)
+
+
+class CacheAnagrafiche:
+    """Personale e mezzi attivi per il wizard interventi, con viste già ordinate.
+
+    Ogni modifica all'anagrafica chiama `invalida()`, che incrementa la versione:
+    la lettura successiva ricarica tutto con una sola transazione. Una fotografia
+    caricata mentre la versione cambia viene scartata alla lettura seguente.
+    A ogni ricarica `nomi` (IndiceNomi del personale attivo) riceve solo le differenze.
+    """
+
+    def __init__(self):
+        self.versione = 0
+        self._dati = None
+        self.nomi = IndiceNomi()
+
+    @staticmethod
+    def _leggi(conn, versione):
+        personale = [Vigile(*row) for row in conn.execute('''
+            SELECT id, full_name, qualification, license_grade, has_nautical_license, is_saf, is_tpss
+            FROM personnel WHERE is_active = TRUE ORDER BY id
+        ''')]
+        mezzi = [Mezzo(*row) for row in conn.execute(
+            'SELECT id, license_plate, model FROM vehicles WHERE is_active = TRUE ORDER BY id'
+        )]
+        per_nome = sorted(personale, key=lambda v: v.full_name)
+        autisti = sorted(
+            (v for v in personale if v.license_grade in GRADI_AUTISTA),
+            key=lambda v: (GRADI_AUTISTA.index(v.license_grade), v.full_name)
+        )
+        return Anagrafiche(versione, personale, per_nome, autisti, mezzi)
+
+    async def get(self):
+        """Restituisce la fotografia corrente (ricaricandola se invalidata)"""
+        dati = self._dati
+        if dati is None or dati.versione != self.versione:
+            dati = await db.run(self._leggi, self.versione)
+            self._dati = dati
+            self.nomi.aggiorna(v.full_name for v in dati.personale)
+        return dati
+
+    async def risolvi_nome(self, testo):
+        """Corrispondenza del nome digitato con il personale attivo (vedi IndiceNomi.risolvi)"""
+        await self.get()
+        return self.nomi.risolvi(testo)
+
+    def invalida(self):
+        self.versione += 1
+
+
+class IndiceNomi:
+    """Indice a trigrammi dei nomi del personale per riconoscere i nomi digitati a mano.
+
+    I trigrammi sono per parola ("rossi mario" trova "Mario Rossi"); la
+    somiglianza è il coefficiente di Dice sui trigrammi. `aggiorna()` riceve
+    l'elenco completo ma indicizza solo i nomi aggiunti o tolti.
+    """
+
+    SOGLIA_CERTA = 0.6  # sopra questa soglia (e con distacco) il nome è accettato
+    DISTACCO = 0.15  # vantaggio minimo sul secondo candidato
+    SOGLIA_CANDIDATI = 0.3  # sotto questa soglia non è nemmeno proposto
+
+    def __init__(self):
+        self._nomi = {}  # nome -> (forma normalizzata, trigrammi)
+        self._per_trigramma = defaultdict(set)
+        self._per_forma = {}
+
+    @staticmethod
+    def normalizza(nome):
+        nome = unicodedata.normalize('NFKD', nome or '')
+        nome = ''.join(c for c in nome if not unicodedata.combining(c)).lower()
+        return ' '.join(re.sub(r'[^\w]+', ' ', nome).split())
+
+    @staticmethod
+    def trigrammi(forma):
+        return {
+            parola[i:i + 3]
+            for parola in (f"  {p} " for p in forma.split())
+            for i in range(len(parola) - 2)
+        }
+
+    def aggiorna(self, nomi):
+        """Allinea l'indice all'elenco dei nomi; restituisce (aggiunti, rimossi)"""
+        nomi = set(nomi)
+        rimossi = self._nomi.keys() - nomi
+        aggiunti = nomi - self._nomi.keys()
+        for nome in rimossi:
+            forma, trigrammi = self._nomi.pop(nome)
+            for trigramma in trigrammi:
+                self._per_trigramma[trigramma].discard(nome)
+                if not self._per_trigramma[trigramma]:
+                    del self._per_trigramma[trigramma]
+            if self._per_forma.get(forma) == nome:
+                del self._per_forma[forma]
+        for nome in aggiunti:
+            forma = self.normalizza(nome)
+            trigrammi = self.trigrammi(forma)
+            self._nomi[nome] = (forma, trigrammi)
+            self._per_forma.setdefault(forma, nome)
+            for trigramma in trigrammi:
+                self._per_trigramma[trigramma].add(nome)
+        return len(aggiunti), len(rimossi)
+
+    def cerca(self, testo, limite=3):
+        """Nomi più simili al testo: [(nome, somiglianza)] dal più simile"""
+        trigrammi = self.trigrammi(self.normalizza(testo))
+        if not trigrammi:
+            return []
+        comuni = defaultdict(int)
+        for trigramma in trigrammi:
+            for nome in self._per_trigramma.get(trigramma, ()):
+                comuni[nome] += 1
+        punteggi = sorted(
+            ((nome, 2 * n / (len(trigrammi) + len(self._nomi[nome][1]))) for nome, n in comuni.items()),
+            key=lambda voce: (-voce[1], voce[0])
+        )
+        return [voce for voce in punteggi[:limite] if voce[1] >= self.SOGLIA_CANDIDATI]
+
+    def risolvi(self, testo):
+        """Nome del personale per il testo digitato, o i candidati se serve una conferma"""
+        esatto = self._per_forma.get(self.normalizza(testo))
+        if esatto:
+            return Corrispondenza(esatto, [])
+        candidati = self.cerca(testo)
+        if candidati and candidati[0][1] >= self.SOGLIA_CERTA and (
+            len(candidati) == 1 or candidati[0][1] - candidati[1][1] >= self.DISTACCO
+        ):
+            return Corrispondenza(candidati[0][0], [])
+        return Corrispondenza(None, [nome for nome, _ in candidati])
+
+
+class CacheVersionata:
+    """Viste calcolate sugli interventi, valide fino al prossimo inserimento.
+
+    `get(chiave, calcola)` riusa il valore finché la versione non cambia;
+    `invalida()` va chiamata dopo ogni scrittura sugli interventi.
+    Con `limite` tiene solo le chiavi usate più di recente (LRU).
+    """
+
+    def __init__(self, limite=None):
+        self.versione = 0
+        self.limite = limite
+        self._valori = OrderedDict()
+
+    async def get(self, chiave, calcola, *args):
+        """Restituisce il valore in cache o lo calcola con `await calcola(*args)`"""
+        voce = self._valori.get(chiave)
+        if voce is not None and voce[0] == self.versione:
+            self._valori.move_to_end(chiave)
+            return voce[1]
+        versione = self.versione
+        valore = await calcola(*args)
+        self._valori[chiave] = (versione, valore)
+        self._valori.move_to_end(chiave)
+        if self.limite is not None and len(self._valori) > self.limite:
+            self._valori.popitem(last=False)
+        return valore
+
+    def invalida(self):
+        self.versione += 1
+        self._valori.clear()
+
+
+autorizzazioni = CacheAutorizzazioni()
+anagrafiche = CacheAnagrafiche()
+viste_interventi = CacheVersionata()
+# Ricerche inline: una chiave per ogni testo digitato, quindi a numero limitato
+ricerche_inline = CacheVersionata(limite=1000)
@@ -0,0 +1,261 @@
+# database.py
+import asyncio
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+DATABASE_NAME = 'vigili.db'
+
+# Profilo connessione applicato a ogni connessione aperta dal bot.
+# Ogni valore è sovrascrivibile da variabile d'ambiente (es. SQLITE_SYNCHRONOUS=FULL)
+CONNECTION_PROFILE = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', '-8000')),  # negativo = KiB
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', str(64 * 1024 * 1024))),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', '5000')),  # millisecondi
+    'temp_store': os.environ.get('SQLITE_TEMP_STORE', 'MEMORY'),
+}
+
+logger = logging.getLogger(__name__)
+
+
+def apply_profile(conn, profile=None):
+    """Applica i PRAGMA del profilo a una connessione"""
+    profile = profile or CONNECTION_PROFILE
+    for pragma, value in profile.items():
+        conn.execute(f'PRAGMA {pragma} = {value}')
+    return conn
+
+
+def connect(database=DATABASE_NAME, profile=None, **kwargs):
+    """Apre una connessione SQLite con il profilo del bot"""
+    profile = profile or CONNECTION_PROFILE
+    conn = sqlite3.connect(database, timeout=profile['busy_timeout'] / 1000, **kwargs)
+    return apply_profile(conn, profile)
+
+
+class DatabasePool:
+    """Pool di connessioni SQLite persistenti usate da un thread executor.
+
+    Gli handler async fanno `await db.fetchall(...)`: la query gira su un
+    thread del pool e l'event loop resta libero per gli altri utenti.
+    Le scritture passano da `await db.write(...)`: un unico task scrittore le
+    raccoglie da una coda e le committa a piccoli gruppi su una sola connessione.
+    """
+
+    def __init__(self, database=DATABASE_NAME, size=4, profile=None, max_batch=32):
+        self.database = database
+        self.size = size
+        self.profile = profile or CONNECTION_PROFILE
+        self._connections = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='db')
+        self._timing_hooks = []
+        self.slow_query_threshold = 0.2  # secondi
+        self.max_batch = max_batch
+        self._write_queue = None
+        self._writer_task = None
+        self._writer_conn = None
+
+    # 🔧 CONNESSIONI
+    def _connect(self):
+        return connect(self.database, self.profile, check_same_thread=False)
+
+    def _acquire(self):
+        try:
+            return self._connections.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            return self._connect()
+        return self._connections.get()
+
+    def _release(self, conn):
+        self._connections.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Presta una connessione del pool (uso sincrono: init, backup, script)"""
+        conn = self._acquire()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._release(conn)
+
+    def close(self):
+        """Chiude tutte le connessioni e l'executor (aggiornando le statistiche del planner)"""
+        self._executor.shutdown(wait=True)
+        if self._writer_conn is not None:
+            self._writer_conn.close()
+            self._writer_conn = None
+        while True:
+            try:
+                conn = self._connections.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.execute('PRAGMA optimize')
+            except sqlite3.Error as e:
+                logger.error(f"Errore PRAGMA optimize: {str(e)}")
+            conn.close()
+        self._created = 0
+
+    # ⏱️ HOOK DI TEMPORIZZAZIONE
+    def add_timing_hook(self, hook):
+        """Registra hook(label, wait_seconds, run_seconds) chiamato dopo ogni query"""
+        self._timing_hooks.append(hook)
+
+    def remove_timing_hook(self, hook):
+        if hook in self._timing_hooks:
+            self._timing_hooks.remove(hook)
+
+    def _notify(self, label, wait_time, run_time):
+        for hook in self._timing_hooks:
+            try:
+                hook(label, wait_time, run_time)
+            except Exception as e:
+                logger.error(f"Errore timing hook: {str(e)}")
+        if run_time > self.slow_query_threshold:
+            logger.warning(f"🐢 Query lenta ({run_time * 1000:.0f} ms): {label}")
+
+    # ⚙️ ESECUZIONE SU THREAD
+    def _run_sync(self, func, args, label, submitted_at):
+        started_at = time.perf_counter()
+        with self.connection() as conn:
+            # sqlite3 non apre transazioni per le SELECT: senza BEGIN ogni lettura
+            # avrebbe il suo snapshot. Così tutte le query di func vedono lo stesso
+            conn.execute('BEGIN')
+            result = func(conn, *args)
+        finished_at = time.perf_counter()
+        self._notify(label, started_at - submitted_at, finished_at - started_at)
+        return result
+
+    async def run(self, func, *args, label=None):
+        """Esegue func(conn, *args) su un thread del pool, in una transazione"""
+        loop = asyncio.get_running_loop()
+        label = label or getattr(func, '__name__', 'query')
+        return await loop.run_in_executor(
+            self._executor, self._run_sync, func, args, label, time.perf_counter()
+        )
+
+    async def fetchone(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone(), label=sql)
+
+    async def fetchall(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall(), label=sql)
+
+    async def execute(self, sql, params=()):
+        """Esegue una scrittura (tramite lo scrittore) e restituisce (lastrowid, rowcount)"""
+        def _execute(conn):
+            c = conn.execute(sql, params)
+            return c.lastrowid, c.rowcount
+        return await self.write(_execute, label=sql)
+
+    # ✍️ SCRITTORE UNICO CON COMMIT DI GRUPPO
+    async def write(self, func, *args, label=None):
+        """Accoda func(conn, *args) allo scrittore e attende il suo risultato.
+
+        Le eccezioni di func (es. sqlite3.IntegrityError per UNIQUE) vengono
+        rilanciate al chiamante senza annullare le altre scritture del gruppo.
+        """
+        loop = asyncio.get_running_loop()
+        if self._writer_task is None or self._writer_task.done():
+            self._write_queue = asyncio.Queue()
+            self._writer_task = loop.create_task(self._writer_loop())
+        future = loop.create_future()
+        label = label or getattr(func, '__name__', 'scrittura')
+        await self._write_queue.put((func, args, label, future, time.perf_counter()))
+        return await future
+
+    async def stop_writer(self):
+        """Completa le scritture in coda e ferma il task scrittore"""
+        if self._writer_task is None or self._writer_task.done():
+            return
+        await self._write_queue.put(None)
+        await self._writer_task
+
+    async def _writer_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._write_queue.get()
+            if item is None:
+                return
+            batch = [item]
+            # Raccoglie le scritture già in coda (senza attendere) fino a max_batch
+            stop = False
+            while len(batch) < self.max_batch and not self._write_queue.empty():
+                item = self._write_queue.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                results = await loop.run_in_executor(self._executor, self._write_batch_sync, batch)
+            except Exception as e:
+                # Errore del COMMIT stesso: fallisce tutto il gruppo
+                results = [(False, e)] * len(batch)
+            for (_, _, _, future, _), (ok, value) in zip(batch, results):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+            if stop:
+                return
+
+    def _write_batch_sync(self, batch):
+        if self._writer_conn is None:
+            self._writer_conn = self._connect()
+        conn = self._writer_conn
+        started_at = time.perf_counter()
+        results = []
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for i, (func, args, label, _, _) in enumerate(batch):
+                # Un savepoint per operazione: un errore annulla solo quella
+                conn.execute(f'SAVEPOINT w{i}')
+                try:
+                    results.append((True, func(conn, *args)))
+                    conn.execute(f'RELEASE w{i}')
+                except Exception as e:
+                    conn.execute(f'ROLLBACK TO w{i}')
+                    conn.execute(f'RELEASE w{i}')
+                    results.append((False, e))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finished_at = time.perf_counter()
+        label = batch[0][2] if len(batch) == 1 else f"scrittura di gruppo ({len(batch)} operazioni)"
+        self._notify(label, started_at - batch[0][4], finished_at - started_at)
+        return results
+
+
+async def monitor_event_loop_lag(interval=1.0, threshold=0.1):
+    """Misura quanto l'event loop resta bloccato (ritardo rispetto allo sleep atteso)"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = loop.time() - start - interval
+        if lag > threshold:
+            logger.warning(f"⏱️ Event loop bloccato per {lag * 1000:.0f} ms")
+
+
+db = DatabasePool()
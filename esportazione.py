@@ -0,0 +1,410 @@
+# esportazione.py
+"""Esportazione CSV degli interventi, in streaming.
+
+Le righe passano dal cursore al writer CSV e da lì, a blocchi già codificati
+in UTF-8, in un file temporaneo "spooled": resta in memoria finché è piccolo,
+poi finisce su disco. Nessuna fase tiene l'intero archivio in memoria.
+L'esportazione completa concatena gli anni, ognuno letto in ordine
+dall'indice (year, exit_at): nessun ordinamento su tutto l'archivio.
+
+L'export di un anno resta in cache finché i suoi dati non cambiano:
+`export_versions` è un contatore per anno incrementato dai trigger della
+migrazione 13 a ogni modifica di righe esportate; `export_cache` ricorda, per
+anno e versione, il riepilogo e il file_id Telegram del CSV già inviato, che
+resta anche su disco.
+Il contatore sta nel database ma i CSV no: ogni database ha la sua
+sottocartella, svuotata all'avvio (dopo un ripristino da backup il contatore
+torna indietro e una versione già vista può avere altri dati).
+
+Il pacchetto ZIP riusa quei CSV per anno: ognuno viene compresso in un
+thread (zlib rilascia il GIL) mentre si prepara l'anno successivo, e le parti
+già compresse vengono scritte una dopo l'altra nell'archivio.
+
+L'export delle novità ricorda per ogni destinazione (un admin o un nome come
+"Provincia") l'ultimo id esportato: legge solo gli id successivi, un
+intervallo sulla chiave primaria che non dipende dalla dimensione dell'archivio.
+"""
+import csv
+import glob
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from tempfile import SpooledTemporaryFile
+
+from interventi import MEZZI_SQL, PARTECIPANTI_SQL, elenco
+
+logger = logging.getLogger(__name__)
+
+INTESTAZIONE_PERSONALE = [
+    'Nome', 'Qualifica', 'Patente', 'Patente Nautica', 'SAF', 'TPSS',
+    'Squadra Notturna', 'Squadra Serale', 'Squadra Domenicale', 'Attivo'
+]
+INTESTAZIONE_MEZZI = ['Targa', 'Modello', 'Attivo']
+INTESTAZIONE_CSV = [
+    'Rapporto', 'Anno', 'Data Uscita', 'Ora Uscita',
+    'Data Rientro', 'Ora Rientro', 'Indirizzo', 'Tipologia',
+    'Caposquadra', 'Autista', 'Vigili Partecipanti', 'Mezzi Utilizzati'
+]
+COLONNE_EXPORT = f'''report_number, year, exit_time, return_time, address, intervention_type,
+    squad_leader, driver, participants, vehicles_used, {PARTECIPANTI_SQL}, {MEZZI_SQL}'''
+
+# Oltre questa dimensione il file temporaneo passa su disco
+SOGLIA_MEMORIA = 2 * 1024 * 1024
+# Testo CSV accumulato prima di codificarlo e scriverlo nel file
+BLOCCO = 64 * 1024
+
+# CSV degli anni già esportati (file_id a parte, è la copia di riserva)
+CARTELLA_CACHE = os.environ.get('EXPORT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'vigili_export'))
+
+# Export di un anno pronto da inviare: file_id se già caricato su Telegram, percorso del CSV su disco
+VoceExport = namedtuple('VoceExport', 'anno versione file_id percorso riepilogo')
+
+# Thread di compressione e livello deflate del pacchetto ZIP
+LAVORATORI_ZIP = min(4, os.cpu_count() or 1)
+LIVELLO_ZIP = 6
+# Parte dell'archivio già compressa (deflate grezzo) in un file temporaneo
+ParteZip = namedtuple('ParteZip', 'nome crc dimensione compressa file')
+
+def _data_ora(testo):
+    """'03/02/2025 10:00' -> ('03/02/2025', '10:00')"""
+    parti = testo.split(' ') if testo else []
+    return (parti[0] if parti else '', parti[1] if len(parti) > 1 else '')
+
+
+def riga_csv(riga):
+    """Riga con le colonne di COLONNE_EXPORT -> riga del CSV"""
+    return [
+        riga[0],  # report_number
+        riga[1],  # year
+        *_data_ora(riga[2]),
+        *_data_ora(riga[3]),
+        riga[4],  # address
+        riga[5],  # intervention_type
+        riga[6],  # squad_leader
+        riga[7],  # driver
+        elenco(riga[10], riga[8]),  # participants
+        elenco(riga[11], riga[9]),  # vehicles_used
+    ]
+
+
+def scrivi_csv(conn, destinazione, anni):
+    """Scrive nel file binario `destinazione` il CSV degli `anni` indicati, nell'ordine dato (vedi scrivi_righe)"""
+    return scrivi_righe(destinazione, (
+        conn.execute(f'''
+            SELECT {COLONNE_EXPORT}
+            FROM interventions
+            WHERE year = ?
+            ORDER BY exit_at, id
+        ''', (anno,))
+        for anno in anni
+    ))
+
+
+def scrivi_righe(destinazione, gruppi):
+    """Scrive nel file binario `destinazione` il CSV dei `gruppi` di righe (colonne di COLONNE_EXPORT).
+
+    Restituisce il riepilogo {'totale', 'anni', 'prima_uscita', 'ultima_uscita'}.
+    """
+    riepilogo = {'totale': 0, 'anni': [], 'prima_uscita': None, 'ultima_uscita': None}
+    testo = io.StringIO()
+    writer = csv.writer(testo)
+    writer.writerow(INTESTAZIONE_CSV)
+
+    for righe in gruppi:
+        for riga in righe:
+            writer.writerow(riga_csv(riga))
+            if riepilogo['prima_uscita'] is None:
+                riepilogo['prima_uscita'] = riga[2]
+            riepilogo['ultima_uscita'] = riga[2]
+            riepilogo['totale'] += 1
+            if riga[1] not in riepilogo['anni']:
+                riepilogo['anni'].append(riga[1])
+            if testo.tell() >= BLOCCO:
+                destinazione.write(testo.getvalue().encode('utf-8'))
+                testo.seek(0)
+                testo.truncate()
+    destinazione.write(testo.getvalue().encode('utf-8'))
+    return riepilogo
+
+
+def anni_esportabili(conn):
+    """Anni con interventi, dal più recente"""
+    # Dagli aggregati (una riga per anno) invece che dall'indice degli interventi
+    return [row[0] for row in conn.execute(
+        'SELECT year FROM stats_by_year WHERE interventions > 0 ORDER BY year DESC'
+    )]
+
+
+def esporta_csv(conn, anno=None):
+    """CSV di un anno (o di tutti, dal più recente) in un file temporaneo riavvolto.
+
+    Restituisce (file, riepilogo); file è None se non ci sono interventi.
+    Il chiamante chiude il file dopo l'invio.
+    """
+    anni = anni_esportabili(conn) if anno is None else [anno]
+
+    file_csv = SpooledTemporaryFile(max_size=SOGLIA_MEMORIA)
+    try:
+        riepilogo = scrivi_csv(conn, file_csv, anni)
+    except Exception:
+        file_csv.close()
+        raise
+    if not riepilogo['totale']:
+        file_csv.close()
+        return None, riepilogo
+    dimensione = file_csv.tell()
+    file_csv.seek(0)
+    logger.info(f"✅ CSV esportato: {riepilogo['totale']} interventi, {dimensione / 1024:.0f} KB")
+    return file_csv, riepilogo
+
+
+# 🗄️ CACHE DEGLI EXPORT PER ANNO
+def _cartella_database(percorso_db):
+    """Sottocartella della cache per un file di database (più database possono condividere EXPORT_CACHE_DIR)"""
+    chiave = hashlib.sha1(os.path.abspath(percorso_db).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(CARTELLA_CACHE, chiave)
+
+
+def _percorso_export(cartella, anno, versione):
+    """CSV dell'anno alla versione data nella cartella della cache (il riepilogo accanto, in .json)"""
+    return os.path.join(cartella, f'interventi_{anno}_v{versione}.csv')
+
+
+def svuota_cache_export(percorso_db):
+    """Cancella i CSV in cache del database: da chiamare all'avvio, dopo l'eventuale ripristino"""
+    shutil.rmtree(_cartella_database(percorso_db), ignore_errors=True)
+
+
+def prepara_export_anno(conn, anno, rigenera=False):
+    """Export dell'anno alla versione corrente: VoceExport, None se l'anno non ha interventi.
+
+    Se l'anno è già stato inviato a questa versione restituisce il file_id (e
+    il CSV su disco, se c'è ancora); altrimenti il CSV della cartella della
+    cache, scritto ora se manca. Con `rigenera` il file_id non basta
+    (rifiutato da Telegram, o serve il CSV stesso): il CSV su disco c'è sempre.
+    Un export concorrente a una versione successiva può cancellarlo prima che
+    il chiamante lo apra: in quel caso va richiesto di nuovo con `rigenera`.
+    """
+    # Versione e righe dallo stesso snapshot (db.run apre una transazione): il CSV è della versione letta
+    riga = conn.execute('SELECT version FROM export_versions WHERE year = ?', (anno,)).fetchone()
+    versione = riga[0] if riga else 0
+    cartella = _cartella_database(conn.execute('PRAGMA database_list').fetchone()[2])
+    percorso = _percorso_export(cartella, anno, versione)
+    percorso_riepilogo = percorso[:-len('.csv')] + '.json'
+
+    voce = conn.execute(
+        'SELECT file_id, riepilogo FROM export_cache WHERE year = ? AND version = ?', (anno, versione)
+    ).fetchone()
+    su_disco = os.path.exists(percorso)
+    if voce is not None and not rigenera:
+        return VoceExport(anno, versione, voce[0], percorso if su_disco else None, json.loads(voce[1]))
+    # Il riepilogo è scritto prima del CSV: se c'è il CSV c'è anche lui
+    if su_disco:
+        try:
+            with open(percorso_riepilogo, encoding='utf-8') as file_riepilogo:
+                return VoceExport(anno, versione, None, percorso, json.load(file_riepilogo))
+        except FileNotFoundError:
+            pass  # appena cancellato da un export più recente: lo si riscrive
+
+    os.makedirs(cartella, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=cartella, suffix='.tmp', delete=False) as file_csv:
+        try:
+            riepilogo = scrivi_csv(conn, file_csv, [anno])
+        except Exception:
+            os.remove(file_csv.name)
+            raise
+    if not riepilogo['totale']:
+        os.remove(file_csv.name)
+        return None
+    with open(percorso_riepilogo, 'w', encoding='utf-8') as file_riepilogo:
+        json.dump(riepilogo, file_riepilogo)
+    os.replace(file_csv.name, percorso)
+    # Le versioni precedenti dello stesso anno non servono più (le successive, scritte
+    # da un export concorrente con uno snapshot più recente, restano)
+    for vecchio in glob.glob(os.path.join(cartella, f'interventi_{anno}_v*.*')):
+        versione_file = os.path.splitext(os.path.basename(vecchio))[0].rsplit('_v', 1)[1]
+        if versione_file.isdigit() and int(versione_file) < versione:
+            try:
+                os.remove(vecchio)
+            except FileNotFoundError:
+                pass  # già cancellato da un altro export
+    logger.info(f"✅ Export {anno} (versione {versione}) scritto in cache: {riepilogo['totale']} interventi")
+    return VoceExport(anno, versione, None, percorso, riepilogo)
+
+
+def salva_export(conn, voce, file_id):
+    """Ricorda il file_id Telegram dell'export appena inviato"""
+    conn.execute('''
+        INSERT INTO export_cache (year, version, file_id, riepilogo) VALUES (?, ?, ?, ?)
+        ON CONFLICT (year) DO UPDATE SET
+            version = excluded.version, file_id = excluded.file_id,
+            riepilogo = excluded.riepilogo, created_at = CURRENT_TIMESTAMP
+    ''', (voce.anno, voce.versione, file_id, json.dumps(voce.riepilogo)))
+
+
+# 🗜️ PACCHETTO ZIP
+def _csv_anagrafica(conn, intestazione, sql):
+    testo = io.StringIO()
+    writer = csv.writer(testo)
+    writer.writerow(intestazione)
+    writer.writerows(conn.execute(sql))
+    return testo.getvalue().encode('utf-8')
+
+
+def _comprimi(nome, sorgente):
+    """Deflate grezzo del file `sorgente` (poi chiuso) in un file temporaneo -> ParteZip"""
+    compressore = zlib.compressobj(LIVELLO_ZIP, zlib.DEFLATED, -15)
+    compresso = tempfile.TemporaryFile()
+    crc = dimensione = 0
+    with sorgente:
+        while blocco := sorgente.read(1024 * 1024):
+            crc = zlib.crc32(blocco, crc)
+            dimensione += len(blocco)
+            compresso.write(compressore.compress(blocco))
+    compresso.write(compressore.flush())
+    return ParteZip(nome, crc, dimensione, compresso.tell(), compresso)
+
+
+def scrivi_zip(destinazione, parti):
+    """Archivio ZIP dalle parti già compresse (nomi UTF-8, senza ZIP64: ogni parte sotto i 4 GiB)"""
+    ora = datetime.now()
+    ora_dos = (ora.hour << 11) | (ora.minute << 5) | (ora.second // 2)
+    data_dos = ((ora.year - 1980) << 9) | (ora.month << 5) | ora.day
+    centrale = []
+    for parte in parti:
+        nome = parte.nome.encode('utf-8')
+        campi = (0x0800, zlib.DEFLATED, ora_dos, data_dos, parte.crc, parte.compressa, parte.dimensione, len(nome))
+        centrale.append(struct.pack('<4s6H3L5H2L', b'PK\x01\x02', 20, 20, *campi, 0, 0, 0, 0, 0, destinazione.tell()) + nome)
+        destinazione.write(struct.pack('<4s5H3L2H', b'PK\x03\x04', 20, *campi, 0) + nome)
+        with parte.file:
+            parte.file.seek(0)
+            shutil.copyfileobj(parte.file, destinazione)
+    inizio = destinazione.tell()
+    for voce in centrale:
+        destinazione.write(voce)
+    destinazione.write(struct.pack(
+        '<4s4H2LH', b'PK\x05\x06', 0, 0, len(parti), len(parti), destinazione.tell() - inizio, inizio, 0
+    ))
+
+
+def esporta_zip(conn):
+    """Pacchetto ZIP (un CSV per anno, personale, mezzi) in un file temporaneo riavvolto.
+
+    Restituisce (file, riepilogo) con riepilogo {'totale', 'anni',
+    'dimensione_csv', 'dimensione_zip'}; file è None se non ci sono interventi.
+    """
+    riepilogo = {'totale': 0, 'anni': [], 'dimensione_csv': 0, 'dimensione_zip': 0}
+    with ThreadPoolExecutor(max_workers=LAVORATORI_ZIP) as lavoratori:
+        futuri = []
+        for anno in anni_esportabili(conn):
+            # CSV dell'anno dalla cache su disco (o appena scritto), compresso mentre si passa al successivo
+            voce = prepara_export_anno(conn, anno, rigenera=True)
+            if voce is None:
+                continue
+            riepilogo['totale'] += voce.riepilogo['totale']
+            riepilogo['anni'].append(anno)
+            try:
+                sorgente = open(voce.percorso, 'rb')
+            except FileNotFoundError:
+                # Cancellato da un export concorrente di una versione successiva: lo si riscrive
+                sorgente = open(prepara_export_anno(conn, anno, rigenera=True).percorso, 'rb')
+            futuri.append(lavoratori.submit(_comprimi, f'interventi_{anno}.csv', sorgente))
+        if not futuri:
+            return None, riepilogo
+
+        personale = _csv_anagrafica(conn, INTESTAZIONE_PERSONALE, '''
+            SELECT full_name, qualification, license_grade,
+                   CASE WHEN has_nautical_license THEN 'Sì' ELSE 'No' END,
+                   CASE WHEN is_saf THEN 'Sì' ELSE 'No' END,
+                   CASE WHEN is_tpss THEN 'Sì' ELSE 'No' END,
+                   squadra_notturna, squadra_serale, squadra_domenicale,
+                   CASE WHEN is_active THEN 'Sì' ELSE 'No' END
+            FROM personnel ORDER BY full_name
+        ''')
+        mezzi = _csv_anagrafica(conn, INTESTAZIONE_MEZZI, '''
+            SELECT license_plate, model, CASE WHEN is_active THEN 'Sì' ELSE 'No' END
+            FROM vehicles ORDER BY license_plate
+        ''')
+        futuri.append(lavoratori.submit(_comprimi, 'personale.csv', io.BytesIO(personale)))
+        futuri.append(lavoratori.submit(_comprimi, 'mezzi.csv', io.BytesIO(mezzi)))
+        parti = [futuro.result() for futuro in futuri]
+
+    file_zip = SpooledTemporaryFile(max_size=SOGLIA_MEMORIA)
+    scrivi_zip(file_zip, parti)
+    riepilogo['dimensione_csv'] = sum(parte.dimensione for parte in parti)
+    riepilogo['dimensione_zip'] = file_zip.tell()
+    file_zip.seek(0)
+    logger.info(
+        f"✅ ZIP esportato: {riepilogo['totale']} interventi, {len(riepilogo['anni'])} anni, "
+        f"{riepilogo['dimensione_csv'] / 1024:.0f} KB -> {riepilogo['dimensione_zip'] / 1024:.0f} KB"
+    )
+    return file_zip, riepilogo
+
+
+# 🆕 EXPORT DELLE NOVITÀ
+def destinazioni_delta(conn):
+    """Destinazioni con nome già usate: (nome, ultimo export)"""
+    return conn.execute('''
+        SELECT target, exported_at FROM export_watermarks
+        WHERE target NOT LIKE 'admin:%'
+        ORDER BY target
+    ''').fetchall()
+
+
+def esporta_delta(conn, destinazione):
+    """CSV degli interventi inseriti dopo l'ultimo export verso `destinazione`: (file, riepilogo).
+
+    Il riepilogo ha in più 'dal_id', 'fino_a_id', 'ultimo_inserimento' e
+    'precedente' (data dell'export precedente); file è None se non c'è nulla
+    di nuovo. Il watermark avanza solo con avanza_watermark, dopo l'invio.
+    """
+    riga = conn.execute(
+        'SELECT last_id, exported_at FROM export_watermarks WHERE target = ?', (destinazione,)
+    ).fetchone()
+    dal_id, precedente = riga if riga else (0, None)
+    # Estremo fissato prima di leggere: gli interventi inseriti durante l'export vanno nel prossimo
+    ultimo = conn.execute(
+        'SELECT id, created_at FROM interventions WHERE id = (SELECT MAX(id) FROM interventions)'
+    ).fetchone()
+    fino_a_id, ultimo_inserimento = ultimo if ultimo else (0, None)
+    delta = {'dal_id': dal_id, 'fino_a_id': fino_a_id, 'ultimo_inserimento': ultimo_inserimento, 'precedente': precedente}
+    if fino_a_id <= dal_id:
+        return None, delta
+
+    file_csv = SpooledTemporaryFile(max_size=SOGLIA_MEMORIA)
+    try:
+        righe = conn.execute(f'''
+            SELECT {COLONNE_EXPORT}
+            FROM interventions
+            WHERE id > ? AND id <= ?
+            ORDER BY id
+        ''', (dal_id, fino_a_id))
+        riepilogo = {**scrivi_righe(file_csv, [righe]), **delta}
+    except Exception:
+        file_csv.close()
+        raise
+    file_csv.seek(0)
+    logger.info(f"✅ Novità per {destinazione}: {riepilogo['totale']} interventi (id {dal_id + 1}-{fino_a_id})")
+    return file_csv, riepilogo
+
+
+def avanza_watermark(conn, destinazione, riepilogo, admin_id):
+    """Registra l'export delle novità appena inviato (il watermark non torna mai indietro)"""
+    conn.execute('''
+        INSERT INTO export_watermarks (target, last_id, last_created_at, interventions, exported_by)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (target) DO UPDATE SET
+            last_id = excluded.last_id, last_created_at = excluded.last_created_at,
+            interventions = excluded.interventions, exported_by = excluded.exported_by,
+            exported_at = CURRENT_TIMESTAMP
+        WHERE excluded.last_id > export_watermarks.last_id
+    ''', (destinazione, riepilogo['fino_a_id'], riepilogo['ultimo_inserimento'], riepilogo['totale'], admin_id))
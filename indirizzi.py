@@ -0,0 +1,105 @@
+# indirizzi.py
+"""Indirizzi normalizzati degli interventi e report dei luoghi ricorrenti.
+
+`address` resta il testo digitato; `address_key` è la sua forma normalizzata
+('via roma 12, erba'), calcolata una volta all'inserimento e indicizzata:
+i raggruppamenti per luogo leggono solo l'indice, senza ricalcolare nulla.
+"""
+import re
+import unicodedata
+
+# Abbreviazioni del tipo di strada, riconosciute solo a inizio indirizzo
+TIPI_STRADA = [
+    (re.compile(r'^p\.?\s*z+a\b\.?'), 'piazza'),
+    (re.compile(r'^v\.?\s*le\b\.?'), 'viale'),
+    (re.compile(r'^v\.?\s*lo\b\.?'), 'vicolo'),
+    (re.compile(r'^c\.?\s*so\b\.?'), 'corso'),
+    (re.compile(r'^l\.?\s*go\b\.?'), 'largo'),
+    (re.compile(r'^s\.?\s*p\b\.?'), 'strada provinciale'),
+    (re.compile(r'^s\.?\s*s\b\.?'), 'strada statale'),
+    (re.compile(r'^str\b\.?'), 'strada'),
+    (re.compile(r'^loc\b\.?'), 'localita'),
+    (re.compile(r'^fraz\b\.?'), 'frazione'),
+    (re.compile(r'^v\b\.?'), 'via'),
+]
+# "n. 12", "n° 12", "nr 12", "civ. 12" -> "12"; "snc" (senza numero civico) sparisce
+PREFISSO_CIVICO = re.compile(r'\b(?:n|nr|num|civ|civico)\s*[.°º]?\s*(?=\d)')
+SENZA_CIVICO = re.compile(r'\bsnc\b')
+# "12/a", "12 a", "12-a" in fondo -> "12a"
+CIVICO_BARRATO = re.compile(r'(\d+)\s*[/\-]?\s*([a-z])$')
+# Comune: CAP e sigla di provincia ("22036 Erba (CO)", "Erba CO") non fanno parte del nome
+CAP = re.compile(r'\b\d{5}\b')
+PROVINCIA = re.compile(r'\(\s*[a-z]{2}\s*\)|\s[a-z]{2}$')
+SEPARATORI = re.compile(r'\s*,\s*|\s+-\s+')
+# Comune scritto dopo il civico senza virgola ("via dante 5 erba"): il civico è un numero
+# dopo almeno due parole, così in "via 4 novembre erba" il 4 resta nel nome della via
+COMUNE_DOPO_CIVICO = re.compile(
+    r'^([^\d\s]+\s+\S.*?)\s+((?:(?:n|nr|num|civ|civico)\s*[.°º]?\s*)?\d{1,4}(?:\s*/\s*[a-z]|[a-z])?)'
+    r'\s+(?=.*[a-z]{2})(\D*(?:\b\d{5}\b\D*)?)$'
+)
+NON_ALFANUMERICI = re.compile(r'[^\w/]+')
+
+
+def _pulisci(testo):
+    return NON_ALFANUMERICI.sub(' ', testo).strip()
+
+
+def normalizza_indirizzo(testo):
+    """Forma canonica di un indirizzo: 'V. Roma n.12/A, Erba (CO)' -> 'via roma 12a, erba'"""
+    if not testo:
+        return ''
+    testo = unicodedata.normalize('NFKD', testo)
+    testo = ''.join(c for c in testo if not unicodedata.combining(c)).lower().strip()
+
+    segmenti = [s for s in SEPARATORI.split(testo) if s.strip()]
+    if not segmenti:
+        return ''
+    via, altri = segmenti[0], segmenti[1:]
+    if not altri:
+        senza_virgola = COMUNE_DOPO_CIVICO.match(via)
+        if senza_virgola:
+            via, altri = f'{senza_virgola[1]} {senza_virgola[2]}', [senza_virgola[3]]
+    # Civico scritto dopo una virgola ("via roma, 12") appartiene alla via
+    while altri and re.match(r'^(?:n|nr|civ)?\s*[.°º]?\s*\d{1,4}\b(?!\d)', altri[0]) and not CAP.match(altri[0]):
+        via += ' ' + altri.pop(0)
+
+    for modello, tipo in TIPI_STRADA:
+        if modello.match(via):
+            via = modello.sub(tipo, via, count=1)
+            break
+    via = SENZA_CIVICO.sub(' ', PREFISSO_CIVICO.sub(' ', via))
+    via = CIVICO_BARRATO.sub(r'\1\2', _pulisci(via))
+    via = ' '.join(via.split())
+
+    comune = ''
+    for segmento in reversed(altri):
+        segmento = _pulisci(PROVINCIA.sub('', CAP.sub('', segmento)))
+        if segmento:
+            comune = ' '.join(segmento.split())
+            break
+    return f"{via}, {comune}" if comune and via else via or comune
+
+
+def completa_indirizzi(conn, lotto=500):
+    """Normalizza un lotto di interventi senza address_key; restituisce quanti ne ha elaborati"""
+    righe = conn.execute(
+        'SELECT id, address FROM interventions WHERE address_key IS NULL LIMIT ?', (lotto,)
+    ).fetchall()
+    conn.executemany(
+        'UPDATE interventions SET address_key = ? WHERE id = ?',
+        [(normalizza_indirizzo(address), intervention_id) for intervention_id, address in righe]
+    )
+    return len(righe)
+
+
+def luoghi_ricorrenti(conn, limite=15):
+    """Luoghi con più interventi: (indirizzo normalizzato, interventi, ultima uscita ISO)"""
+    return conn.execute('''
+        SELECT address_key, COUNT(*), MAX(exit_at)
+        FROM interventions
+        WHERE address_key > ''
+        GROUP BY address_key
+        HAVING COUNT(*) > 1
+        ORDER BY COUNT(*) DESC, address_key
+        LIMIT ?
+    ''', (limite,)).fetchall()
@@ -0,0 +1,144 @@
+# interventi.py
+"""Accesso ai dati degli interventi: partecipanti e mezzi in tabelle di collegamento.
+
+Le colonne JSON `participants` e `vehicles_used` restano scritte per compatibilità
+con backup e versioni precedenti; le letture usano le tabelle di collegamento e
+ripiegano sul JSON per le righe non ancora collegate.
+"""
+import json
+import re
+from datetime import datetime
+
+from indirizzi import normalizza_indirizzo
+from statistiche import aggiorna_statistiche
+
+# Data/ora come digitata dagli utenti: GG/MM/AAAA HH:MM (tollera . - come separatori e ora assente)
+FORMATO_DATA_ORA = re.compile(
+    r'^\s*(\d{1,2})[/.\-](\d{1,2})[/.\-](\d{2,4})(?:[\sT,]+(\d{1,2})[:.](\d{2}))?\s*$'
+)
+
+# Sottoquery correlate da usare nelle SELECT su `interventions` (elenchi ordinati, separati da virgola)
+PARTECIPANTI_SQL = '''(SELECT group_concat(full_name, ', ') FROM (
+    SELECT full_name FROM intervention_participants
+    WHERE intervention_id = interventions.id ORDER BY position))'''
+MEZZI_SQL = '''(SELECT group_concat(license_plate, ', ') FROM (
+    SELECT license_plate FROM intervention_vehicles
+    WHERE intervention_id = interventions.id ORDER BY position))'''
+# Colonne della scheda completa di un intervento (🔍 Cerca Rapporto, ricerca inline)
+SCHEDA_SQL = f'''report_number, year, exit_time, return_time, address,
+    intervention_type, squad_leader, driver, vehicles_used, participants,
+    {MEZZI_SQL}, {PARTECIPANTI_SQL}'''
+
+
+def elenco(valore_collegato, valore_json):
+    """Lettura doppia: elenco dalle tabelle di collegamento, altrimenti dal JSON"""
+    if valore_collegato is not None:
+        return valore_collegato
+    if not valore_json:
+        return ''
+    return ', '.join(json.loads(valore_json))
+
+
+def parse_timestamp(testo):
+    """Converte 'GG/MM/AAAA HH:MM' in ISO-8601 ('AAAA-MM-GG HH:MM'), None se non valido"""
+    if not testo:
+        return None
+    match = FORMATO_DATA_ORA.match(testo)
+    if not match:
+        return None
+    giorno, mese, anno, ora, minuti = match.groups()
+    anno = int(anno)
+    if anno < 100:
+        anno += 2000
+    try:
+        momento = datetime(anno, int(mese), int(giorno), int(ora or 0), int(minuti or 0))
+    except ValueError:
+        return None
+    return momento.strftime('%Y-%m-%d %H:%M')
+
+
+def collega_intervento(conn, intervention_id, participants, vehicles):
+    """Scrive partecipanti e mezzi di un intervento nelle tabelle di collegamento"""
+    conn.executemany('''
+        INSERT INTO intervention_participants (intervention_id, position, personnel_id, full_name)
+        VALUES (?, ?, (SELECT id FROM personnel WHERE full_name = ? LIMIT 1), ?)
+    ''', [(intervention_id, i, nome, nome) for i, nome in enumerate(participants)])
+    conn.executemany('''
+        INSERT INTO intervention_vehicles (intervention_id, position, vehicle_id, license_plate)
+        VALUES (?, ?, (SELECT id FROM vehicles WHERE license_plate = ? LIMIT 1), ?)
+    ''', [(intervention_id, i, targa, targa) for i, targa in enumerate(vehicles)])
+
+
+def salva_intervento(conn, dati, participants, vehicles, created_by):
+    """Inserisce un intervento e i suoi collegamenti nella stessa transazione"""
+    c = conn.execute('''
+        INSERT INTO interventions
+        (report_number, year, exit_time, return_time, exit_at, return_at, address, address_key,
+         intervention_type, squad_leader, driver, participants, vehicles_used, created_by)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        dati['report_number'],
+        dati['year'],
+        dati['exit_time'],
+        dati['return_time'],
+        parse_timestamp(dati['exit_time']),
+        parse_timestamp(dati['return_time']),
+        dati['address'],
+        normalizza_indirizzo(dati['address']),
+        dati.get('intervention_type', 'Incendio'),
+        dati['squad_leader'],
+        dati['driver'],
+        json.dumps(participants),
+        json.dumps(vehicles),
+        created_by
+    ))
+    intervention_id = c.lastrowid
+    collega_intervento(conn, intervention_id, participants, vehicles)
+    aggiorna_statistiche(conn, intervention_id)
+    return intervention_id
+
+
+def pagina_interventi(conn, cursore=None, indietro=False, limite=10):
+    """Interventi per data di inserimento decrescente, con keyset su (created_at, id).
+
+    `cursore` è (created_at, id) della riga da cui proseguire; con `indietro`
+    le righe sono le successive in ordine crescente (la più vicina al cursore
+    per prima). Restituisce fino a `limite` righe:
+    (id, created_at, report_number, year, exit_time, return_time, address,
+     intervention_type, squad_leader, driver, vehicles_used, mezzi collegati).
+    """
+    confronto, verso = ('>', '') if indietro else ('<', ' DESC')
+    condizione, parametri = '', []
+    if cursore is not None:
+        # Due ricerche esatte sull'indice (stesso istante con id oltre il cursore, poi
+        # istanti oltre): con (created_at, id) < (?, ?) SQLite cerca solo su created_at
+        # e scorre tutti gli interventi inseriti nello stesso secondo (es. importazioni)
+        condizione = f'''WHERE id IN (
+            SELECT id FROM (SELECT id FROM interventions WHERE created_at = ? AND id {confronto} ?
+                            ORDER BY id{verso} LIMIT ?)
+            UNION ALL
+            SELECT id FROM (SELECT id FROM interventions WHERE created_at {confronto} ?
+                            ORDER BY created_at{verso}, id{verso} LIMIT ?)
+        )'''
+        created_at, intervention_id = cursore
+        parametri = [created_at, intervention_id, limite, created_at, limite]
+    return conn.execute(f'''
+        SELECT id, created_at, report_number, year, exit_time, return_time, address,
+               intervention_type, squad_leader, driver, vehicles_used, {MEZZI_SQL}
+        FROM interventions
+        {condizione}
+        ORDER BY created_at{verso}, id{verso}
+        LIMIT ?
+    ''', parametri + [limite]).fetchall()
+
+
+def ricollega_anagrafiche(conn):
+    """Riallinea personnel_id/vehicle_id per nome e targa (dopo modifiche all'anagrafica)"""
+    conn.execute('''
+        UPDATE intervention_participants
+        SET personnel_id = (SELECT id FROM personnel WHERE full_name = intervention_participants.full_name LIMIT 1)
+    ''')
+    conn.execute('''
+        UPDATE intervention_vehicles
+        SET vehicle_id = (SELECT id FROM vehicles WHERE license_plate = intervention_vehicles.license_plate LIMIT 1)
+    ''')
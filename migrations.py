@@ -0,0 +1,578 @@
+# migrations.py
+"""Migrazioni dello schema, versionate con PRAGMA user_version.
+
+Ogni migrazione è una funzione che riceve la connessione; la versione è la sua
+posizione (1-based) nella lista MIGRAZIONI. Aggiungere sempre in fondo, mai
+modificare o riordinare migrazioni già rilasciate.
+
+Una migrazione rilasciata gira anche su database fermi a versioni vecchie, con
+le sole tabelle delle migrazioni precedenti. Per questo tutto il suo SQL
+(tabelle, indici, trigger, popolamenti e ricalcoli) sta qui, com'era al
+rilascio: nessuna migrazione chiama funzioni di altri moduli che scrivono o
+leggono tabelle (es. ricostruisci_statistiche, che oggi riempie anche tabelle
+create dopo). Il codice applicativo non le chiama a sua volta: le funzioni di
+ricalcolo degli altri moduli possono cambiare con lo schema corrente.
+Unica eccezione, funzioni Python sui soli valori registrate in SQLite
+(parse_timestamp nella migrazione 3): non dipendono dallo schema.
+tests/test_migrazioni.py aggiorna un database da ogni versione rilasciata.
+"""
+import json
+import logging
+import time
+
+from interventi import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+def schema_iniziale(conn):
+    """Tabelle di base (IF NOT EXISTS: i database ripristinati le hanno già)"""
+    c = conn.cursor()
+    
+    # Tabella interventi CON TIPOLOGIA
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS interventions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            report_number TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            exit_time TEXT NOT NULL,
+            return_time TEXT,
+            address TEXT NOT NULL,
+            intervention_type TEXT DEFAULT 'Incendio',
+            squad_leader TEXT NOT NULL,
+            driver TEXT NOT NULL,
+            participants TEXT NOT NULL,
+            vehicles_used TEXT NOT NULL,
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(report_number, year)
+        )
+    ''')
+
+    # Tabella utenti
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE,
+            username TEXT,
+            full_name TEXT,
+            role TEXT DEFAULT 'user',
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Tabella richieste accesso
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS access_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE,
+            username TEXT,
+            full_name TEXT,
+            requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'pending'
+        )
+    ''')
+
+    # Tabella personale
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS personnel (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            full_name TEXT NOT NULL,
+            qualification TEXT,
+            license_grade TEXT,
+            has_nautical_license BOOLEAN DEFAULT FALSE,
+            is_saf BOOLEAN DEFAULT FALSE,
+            is_tpss BOOLEAN DEFAULT FALSE,
+            squadra_notturna TEXT,
+            squadra_serale TEXT,
+            squadra_domenicale TEXT,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Tabella mezzi
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS vehicles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            license_plate TEXT UNIQUE NOT NULL,
+            model TEXT NOT NULL,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Tabella admin
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS admins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def tabelle_collegamento(conn):
+    """Partecipanti e mezzi in tabelle di collegamento, migrati dalle colonne JSON"""
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS intervention_participants (
+            intervention_id INTEGER NOT NULL REFERENCES interventions(id),
+            position INTEGER NOT NULL,
+            personnel_id INTEGER,
+            full_name TEXT NOT NULL,
+            PRIMARY KEY (intervention_id, position)
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_participants_personnel ON intervention_participants(personnel_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_participants_name ON intervention_participants(full_name)')
+    
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS intervention_vehicles (
+            intervention_id INTEGER NOT NULL REFERENCES interventions(id),
+            position INTEGER NOT NULL,
+            vehicle_id INTEGER,
+            license_plate TEXT NOT NULL,
+            PRIMARY KEY (intervention_id, position)
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_vehicles_vehicle ON intervention_vehicles(vehicle_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_vehicles_plate ON intervention_vehicles(license_plate)')
+    
+    _migra_json_a_collegamenti(conn)
+
+
+def _migra_json_a_collegamenti(conn):
+    """Popola le tabelle di collegamento per gli interventi che ne sono privi (copia privata della v2)"""
+    rows = conn.execute('''
+        SELECT id, participants, vehicles_used FROM interventions
+        WHERE id NOT IN (SELECT intervention_id FROM intervention_participants)
+          AND id NOT IN (SELECT intervention_id FROM intervention_vehicles)
+    ''').fetchall()
+    for intervention_id, participants, vehicles_used in rows:
+        try:
+            participants = json.loads(participants or '[]')
+            vehicles = json.loads(vehicles_used or '[]')
+        except ValueError:
+            logger.warning(f"⚠️ JSON non valido nell'intervento {intervention_id}, lasciato in lettura JSON")
+            continue
+        conn.executemany('''
+            INSERT INTO intervention_participants (intervention_id, position, personnel_id, full_name)
+            VALUES (?, ?, (SELECT id FROM personnel WHERE full_name = ? LIMIT 1), ?)
+        ''', [(intervention_id, i, nome, nome) for i, nome in enumerate(participants)])
+        conn.executemany('''
+            INSERT INTO intervention_vehicles (intervention_id, position, vehicle_id, license_plate)
+            VALUES (?, ?, (SELECT id FROM vehicles WHERE license_plate = ? LIMIT 1), ?)
+        ''', [(intervention_id, i, targa, targa) for i, targa in enumerate(vehicles)])
+    if rows:
+        logger.info(f"✅ Migrati {len(rows)} interventi nelle tabelle di collegamento")
+    return len(rows)
+
+
+def timestamp_iso(conn):
+    """Colonne exit_at/return_at ISO-8601 indicizzate, popolate dalle righe esistenti"""
+    colonne = {row[1] for row in conn.execute('PRAGMA table_info(interventions)')}
+    for colonna in ('exit_at', 'return_at'):
+        if colonna not in colonne:
+            conn.execute(f'ALTER TABLE interventions ADD COLUMN {colonna} TEXT')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_interventions_exit_at ON interventions(exit_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_interventions_year_exit_at ON interventions(year, exit_at)')
+    
+    conn.create_function('parse_timestamp', 1, parse_timestamp, deterministic=True)
+    c = conn.execute('''
+        UPDATE interventions
+        SET exit_at = parse_timestamp(exit_time), return_at = parse_timestamp(return_time)
+        WHERE exit_at IS NULL AND parse_timestamp(exit_time) IS NOT NULL
+    ''')
+    if c.rowcount > 0:
+        logger.info(f"✅ Timestamp ISO calcolati per {c.rowcount} interventi")
+
+
+def indici_query(conn):
+    """Indici per le query degli handler (verificati con python benchmark.py piani)"""
+    c = conn.cursor()
+    # Ultimi interventi / progressivo: ORDER BY created_at DESC LIMIT n
+    c.execute('CREATE INDEX IF NOT EXISTS idx_interventions_created_at ON interventions(created_at)')
+    # Statistiche per tipologia: GROUP BY su indice coprente
+    c.execute('CREATE INDEX IF NOT EXISTS idx_interventions_type ON interventions(intervention_type)')
+    # Anagrafica: filtri su is_active ordinati per nome e ricerche per nome
+    c.execute('CREATE INDEX IF NOT EXISTS idx_personnel_active_name ON personnel(is_active, full_name)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_personnel_name ON personnel(full_name)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_vehicles_active ON vehicles(is_active, license_plate)')
+    # Conteggio utenti attivi (health check)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_users_active ON users(is_active)')
+    # Richieste di accesso pendenti
+    c.execute('CREATE INDEX IF NOT EXISTS idx_access_requests_status ON access_requests(status)')
+    # WHERE year = ? usa idx_interventions_year_exit_at (migrazione 3)
+    c.execute('ANALYZE')
+
+
+def statistiche_aggregate(conn):
+    """Tabelle aggregate per le statistiche (per anno, tipologia, mezzo e mese)"""
+    c = conn.cursor()
+    # Schema e ricalcolo come rilasciati con la v5 (stats_by_vehicle senza minuti: migrazione 6)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS stats_by_year (
+            year INTEGER PRIMARY KEY,
+            interventions INTEGER NOT NULL DEFAULT 0,
+            first_exit_at TEXT,
+            first_exit_time TEXT,
+            last_exit_at TEXT,
+            last_exit_time TEXT
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS stats_by_type (
+            intervention_type TEXT PRIMARY KEY,
+            interventions INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS stats_by_vehicle (
+            license_plate TEXT PRIMARY KEY,
+            interventions INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS stats_by_month (
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            interventions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (year, month)
+        )
+    ''')
+    _ricalcola_aggregati_v5(conn, '''
+        INSERT INTO stats_by_vehicle (license_plate, interventions)
+        SELECT license_plate, COUNT(DISTINCT intervention_id) FROM intervention_vehicles GROUP BY license_plate
+    ''')
+
+
+def utilizzo_mezzi(conn):
+    """Ore fuori e ultimo utilizzo per mezzo negli aggregati"""
+    colonne = {row[1] for row in conn.execute('PRAGMA table_info(stats_by_vehicle)')}
+    for colonna, tipo in (('minutes_out', 'INTEGER NOT NULL DEFAULT 0'),
+                          ('last_exit_at', 'TEXT'), ('last_exit_time', 'TEXT')):
+        if colonna not in colonne:
+            conn.execute(f'ALTER TABLE stats_by_vehicle ADD COLUMN {colonna} {tipo}')
+    # Ricalcolo come rilasciato con la v6: solo le quattro tabelle della v5
+    _ricalcola_aggregati_v5(conn, '''
+        INSERT INTO stats_by_vehicle (license_plate, interventions, minutes_out, last_exit_at, last_exit_time)
+        SELECT license_plate, COUNT(*), SUM(minuti), max(exit_at), exit_time
+        FROM (
+            SELECT DISTINCT v.license_plate, v.intervention_id, i.exit_at,
+                   CASE WHEN i.exit_at IS NOT NULL THEN i.exit_time END AS exit_time,
+                   max(COALESCE(CAST(round((julianday(return_at) - julianday(exit_at)) * 1440) AS INTEGER), 0), 0) AS minuti
+            FROM intervention_vehicles v JOIN interventions i ON i.id = v.intervention_id
+        )
+        GROUP BY license_plate
+    ''')
+
+
+def _ricalcola_aggregati_v5(conn, sql_mezzi):
+    """Ricalcola stats_by_year/type/vehicle/month (copia privata delle migrazioni 5 e 6)"""
+    c = conn.cursor()
+    for tabella in ('stats_by_year', 'stats_by_type', 'stats_by_vehicle', 'stats_by_month'):
+        c.execute(f'DELETE FROM {tabella}')
+    c.execute('''
+        INSERT INTO stats_by_year (year, interventions)
+        SELECT year, COUNT(*) FROM interventions GROUP BY year
+    ''')
+    c.execute('''
+        UPDATE stats_by_year SET
+            first_exit_at = (SELECT exit_at FROM interventions
+                             WHERE year = stats_by_year.year AND exit_at IS NOT NULL ORDER BY exit_at LIMIT 1),
+            first_exit_time = (SELECT exit_time FROM interventions
+                               WHERE year = stats_by_year.year AND exit_at IS NOT NULL ORDER BY exit_at LIMIT 1),
+            last_exit_at = (SELECT exit_at FROM interventions
+                            WHERE year = stats_by_year.year AND exit_at IS NOT NULL ORDER BY exit_at DESC LIMIT 1),
+            last_exit_time = (SELECT exit_time FROM interventions
+                              WHERE year = stats_by_year.year AND exit_at IS NOT NULL ORDER BY exit_at DESC LIMIT 1)
+    ''')
+    c.execute('''
+        INSERT INTO stats_by_type (intervention_type, interventions)
+        SELECT intervention_type, COUNT(*) FROM interventions GROUP BY intervention_type
+    ''')
+    c.execute(sql_mezzi)
+    c.execute('''
+        INSERT INTO stats_by_month (year, month, interventions)
+        SELECT CAST(substr(exit_at, 1, 4) AS INTEGER), CAST(substr(exit_at, 6, 2) AS INTEGER), COUNT(*)
+        FROM interventions WHERE exit_at IS NOT NULL
+        GROUP BY substr(exit_at, 1, 7)
+    ''')
+
+
+def indice_ruoli(conn):
+    """Indice coprente (exit_at, caposquadra, autista) per il report carico vigili"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_interventions_exit_at_roles ON interventions(exit_at, squad_leader, driver)')
+    # Stesso prefisso: il vecchio indice su exit_at diventa superfluo
+    conn.execute('DROP INDEX IF EXISTS idx_interventions_exit_at')
+    conn.execute('ANALYZE interventions')
+
+
+def durate_interventi(conn):
+    """Aggregati delle durate (anno, tipologia, mezzo, vigile) e indice parziale sulle anomalie"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_durations (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            interventions INTEGER NOT NULL DEFAULT 0,
+            minutes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (kind, key, year)
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_interventions_anomalie ON interventions(year, id)
+        WHERE (exit_at IS NULL OR return_at IS NULL OR return_at < exit_at)
+    ''')
+    # Ricalcolo come rilasciato con la v8
+    conn.execute('DELETE FROM stats_durations')
+    conn.execute('''
+        WITH durate AS (
+            SELECT id, year, intervention_type, squad_leader, driver,
+                   CAST(round((julianday(return_at) - julianday(exit_at)) * 1440) AS INTEGER) AS minuti
+            FROM interventions
+        )
+        INSERT INTO stats_durations (kind, key, year, interventions, minutes)
+        SELECT kind, key, year, COUNT(*), SUM(minuti) FROM (
+            SELECT 'anno' AS kind, '' AS key, year, id, minuti FROM durate WHERE minuti >= 0
+            UNION
+            SELECT 'tipologia', intervention_type, year, id, minuti FROM durate WHERE minuti >= 0
+            UNION
+            SELECT 'mezzo', v.license_plate, d.year, d.id, d.minuti
+            FROM durate d JOIN intervention_vehicles v ON v.intervention_id = d.id WHERE d.minuti >= 0
+            UNION
+            SELECT 'vigile', squad_leader, year, id, minuti FROM durate WHERE minuti >= 0
+            UNION
+            SELECT 'vigile', driver, year, id, minuti FROM durate WHERE minuti >= 0
+            UNION
+            SELECT 'vigile', p.full_name, d.year, d.id, d.minuti
+            FROM durate d JOIN intervention_participants p ON p.intervention_id = d.id WHERE d.minuti >= 0
+        )
+        WHERE key IS NOT NULL AND NOT (kind = 'vigile' AND key = '')
+        GROUP BY kind, key, year
+        ON CONFLICT (kind, key, year) DO UPDATE SET
+            interventions = interventions + excluded.interventions,
+            minutes = minutes + excluded.minutes
+    ''')
+
+
+def indice_tipologia_data(conn):
+    """Indice (tipologia, exit_at) per le statistiche avanzate, al posto di quello sulla sola tipologia"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_interventions_type_exit_at ON interventions(intervention_type, exit_at)')
+    conn.execute('DROP INDEX IF EXISTS idx_interventions_type')
+    conn.execute('ANALYZE interventions')
+
+
+def rollup_annuali(conn):
+    """Tipologie e mezzi per anno per il confronto tra anni"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_by_year_group (
+            year INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            interventions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (year, kind, key)
+        )
+    ''')
+    # Ricalcolo come rilasciato con la v10
+    conn.execute('DELETE FROM stats_by_year_group')
+    conn.execute('''
+        INSERT INTO stats_by_year_group (year, kind, key, interventions)
+        SELECT year, kind, key, COUNT(*) FROM (
+            SELECT i.year, 'tipologia' AS kind, i.intervention_type AS key, i.id FROM interventions i
+            UNION
+            SELECT i.year, 'mezzo', v.license_plate, i.id
+            FROM interventions i JOIN intervention_vehicles v ON v.intervention_id = i.id
+        )
+        WHERE key IS NOT NULL
+        GROUP BY year, kind, key
+        ON CONFLICT (year, kind, key) DO UPDATE SET interventions = interventions + excluded.interventions
+    ''')
+
+
+def indirizzi_normalizzati(conn):
+    """Indirizzo normalizzato indicizzato (popolato a lotti all'avvio del bot)"""
+    colonne = {row[1] for row in conn.execute('PRAGMA table_info(interventions)')}
+    if 'address_key' not in colonne:
+        conn.execute('ALTER TABLE interventions ADD COLUMN address_key TEXT')
+    # (address_key, exit_at): conteggio e ultimo intervento per luogo dal solo indice
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_interventions_address_key
+        ON interventions(address_key, exit_at)
+    ''')
+
+
+def ricerca_testo(conn):
+    """Indice FTS5 per la ricerca libera (indirizzo, tipologia, caposquadra, autista, partecipanti)"""
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS interventions_fts USING fts5(
+            address, intervention_type, squad_leader, driver, participants,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    ''')
+    # Partecipanti da JSON a testo ("["Mario Rossi", ...]" -> "Mario Rossi ...")
+    nuova_riga = '''NEW.address, NEW.intervention_type, NEW.squad_leader, NEW.driver,
+                CASE WHEN json_valid(NEW.participants)
+                THEN (SELECT group_concat(value, ' ') FROM json_each(NEW.participants))
+                ELSE NEW.participants END'''
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS interventions_fts_insert AFTER INSERT ON interventions BEGIN
+            INSERT INTO interventions_fts (rowid, address, intervention_type, squad_leader, driver, participants)
+            VALUES (NEW.id, {nuova_riga});
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS interventions_fts_delete AFTER DELETE ON interventions BEGIN
+            DELETE FROM interventions_fts WHERE rowid = OLD.id;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS interventions_fts_update
+        AFTER UPDATE OF address, intervention_type, squad_leader, driver, participants ON interventions BEGIN
+            DELETE FROM interventions_fts WHERE rowid = OLD.id;
+            INSERT INTO interventions_fts (rowid, address, intervention_type, squad_leader, driver, participants)
+            VALUES (NEW.id, {nuova_riga});
+        END
+    ''')
+
+    conn.execute('DELETE FROM interventions_fts')
+    c = conn.execute('''
+        INSERT INTO interventions_fts (rowid, address, intervention_type, squad_leader, driver, participants)
+        SELECT id, address, intervention_type, squad_leader, driver,
+               CASE WHEN json_valid(interventions.participants)
+               THEN (SELECT group_concat(value, ' ') FROM json_each(interventions.participants))
+               ELSE interventions.participants END
+        FROM interventions
+    ''')
+    conn.execute("INSERT INTO interventions_fts (interventions_fts) VALUES ('optimize')")
+    logger.info(f"✅ Indice di ricerca creato per {c.rowcount} interventi")
+
+
+def cache_esportazioni(conn):
+    """Versione dei dati per anno (trigger) e cache degli export CSV già inviati"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS export_versions (
+            year INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS export_cache (
+            year INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL,
+            file_id TEXT NOT NULL,
+            riepilogo TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Tabelle e colonne che finivano nel CSV al rilascio della v13: (anno della riga nuova, della vecchia, colonne)
+    sorgenti = {
+        'interventions': ('NEW.year', 'OLD.year', 'report_number, year, exit_time, return_time, address, '
+                          'intervention_type, squad_leader, driver, participants, vehicles_used'),
+        'intervention_participants': ('(SELECT year FROM interventions WHERE id = NEW.intervention_id)',
+                                      '(SELECT year FROM interventions WHERE id = OLD.intervention_id)',
+                                      'full_name, position'),
+        'intervention_vehicles': ('(SELECT year FROM interventions WHERE id = NEW.intervention_id)',
+                                  '(SELECT year FROM interventions WHERE id = OLD.intervention_id)',
+                                  'license_plate, position'),
+    }
+    incrementa = '''INSERT INTO export_versions (year, version) VALUES ({anno}, 1)
+                    ON CONFLICT (year) DO UPDATE SET version = version + 1;'''
+    for tabella, (anno_nuovo, anno_vecchio, colonne_csv) in sorgenti.items():
+        nuovo, vecchio = incrementa.format(anno=anno_nuovo), incrementa.format(anno=anno_vecchio)
+        for evento, corpo in (
+            ('INSERT', nuovo),
+            ('DELETE', vecchio),
+            # Un cambio d'anno invalida sia l'anno di partenza sia quello di arrivo
+            (f'UPDATE OF {colonne_csv}', f'{vecchio}\n                    {nuovo}'),
+        ):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {tabella}_export_{evento.split()[0].lower()}
+                AFTER {evento} ON {tabella} BEGIN
+                    {corpo}
+                END
+            ''')
+
+
+def watermark_esportazioni(conn):
+    """Ultimo intervento esportato per destinazione (export delle novità)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS export_watermarks (
+            target TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL DEFAULT 0,
+            last_created_at TEXT,
+            interventions INTEGER NOT NULL DEFAULT 0,
+            exported_by INTEGER,
+            exported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def indirizzi_senza_virgola(conn):
+    """Indirizzi normalizzati senza comune da ricalcolare ("via dante 5 erba" ora ha il comune)"""
+    # Solo le chiavi senza virgola cambiano: completa_indirizzi le ricalcola a lotti all'avvio
+    conn.execute("UPDATE interventions SET address_key = NULL WHERE address_key NOT LIKE '%,%'")
+
+
+def indice_uscite_senza_ora(conn):
+    """Indice parziale sulle uscite digitate senza ora (escluse dall'istogramma orario)"""
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_interventions_senza_ora ON interventions(exit_at)
+        WHERE exit_at IS NOT NULL AND trim(exit_time) NOT GLOB '*[^0-9/.-]*'
+    ''')
+
+
+MIGRAZIONI = [
+    schema_iniziale,
+    tabelle_collegamento,
+    timestamp_iso,
+    indici_query,
+    statistiche_aggregate,
+    utilizzo_mezzi,
+    indice_ruoli,
+    durate_interventi,
+    indice_tipologia_data,
+    rollup_annuali,
+    indirizzi_normalizzati,
+    ricerca_testo,
+    cache_esportazioni,
+    watermark_esportazioni,
+    indirizzi_senza_virgola,
+    indice_uscite_senza_ora,
+]
+
+VERSIONE_SCHEMA = len(MIGRAZIONI)
+
+
+def versione_corrente(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def applica_migrazioni(conn):
+    """Applica le migrazioni mancanti in un'unica transazione e restituisce la versione"""
+    versione = versione_corrente(conn)
+    if versione >= VERSIONE_SCHEMA:
+        return versione
+    
+    inizio = time.perf_counter()
+    conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Riletta dentro la transazione: un altro processo potrebbe averla già aggiornata
+        versione = versione_corrente(conn)
+        for numero, migrazione in enumerate(MIGRAZIONI[versione:], start=versione + 1):
+            logger.info(f"🔧 Migrazione {numero}: {migrazione.__doc__}")
+            migrazione(conn)
+        conn.execute(f'PRAGMA user_version = {VERSIONE_SCHEMA}')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    logger.info(
+        f"✅ Schema aggiornato da v{versione} a v{VERSIONE_SCHEMA} "
+        f"in {(time.perf_counter() - inizio) * 1000:.0f} ms"
+    )
+    return VERSIONE_SCHEMA
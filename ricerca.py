@@ -0,0 +1,179 @@
+# ricerca.py
+"""Ricerca sugli interventi: testo libero con un indice FTS5 e filtri combinati.
+
+`interventions_fts` ha come rowid l'id dell'intervento ed è tenuto allineato
+dai trigger su `interventions` (migrazione 12): nessun codice applicativo lo
+scrive. I partecipanti vengono dalla colonna JSON, sempre scritta all'inserimento.
+
+La ricerca inline (`@bot 123/2025`) risponde a ogni tasto: i numeri di
+rapporto vanno sull'indice UNIQUE(report_number, year), il resto sull'FTS.
+
+La ricerca con filtri compila periodo, tipologia, mezzo e vigile in una sola
+query parametrica e pagina per (exit_at, id): nessun OFFSET, anche le pagine
+lontane costano una lettura di indice.
+"""
+import re
+from datetime import datetime, timedelta
+
+from interventi import SCHEDA_SQL
+from statistiche import finestra_periodo
+
+# Colonne indicizzate, nell'ordine dei pesi di bm25
+COLONNE_RICERCA = ('address', 'intervention_type', 'squad_leader', 'driver', 'participants')
+PESI_RICERCA = (3.0, 2.0, 1.0, 1.0, 1.0)
+PESI_SQL = ', '.join(map(str, PESI_RICERCA))
+# I non admin non vedono i partecipanti: non possono nemmeno cercarli
+COLONNE_PUBBLICHE = '{address intervention_type squad_leader driver}'
+
+# Colonne restituite da cerca_interventi per gli elenchi di risultati
+COLONNE_ELENCO = 'report_number, year, exit_time, address, intervention_type'
+COLONNE_INLINE = f'interventions.id, {SCHEDA_SQL}'
+
+PAROLE = re.compile(r'\w+')
+# "123/2025", "123/20" (anno ancora da completare) o solo "123"
+NUMERO_RAPPORTO = re.compile(r'^\s*(\d+)\s*(?:/\s*(\d{0,4}))?\s*$')
+
+
+def query_fts(testo):
+    """Testo libero -> query FTS5: tutte le parole obbligatorie, l'ultima anche come prefisso ('' se vuoto)"""
+    parole = [f'"{parola}"' for parola in PAROLE.findall(testo)]
+    # Prefisso solo sull'ultima parola (si sta ancora scrivendo): sulle altre costerebbe molto di più
+    if parole and not parole[-1].strip('"').isdigit():
+        parole[-1] += '*'
+    return ' '.join(parole)
+
+
+def cerca_interventi(conn, testo, partecipanti=False, limite=10, colonne=COLONNE_ELENCO):
+    """Interventi più pertinenti per il testo su tutto l'archivio, righe con le `colonne`
+    indicate (di default report_number, year, exit_time, address, intervention_type).
+
+    bm25 (pesato con PESI_RICERCA tramite `rank`) è calcolato su tutte le
+    corrispondenze e l'ordinamento tiene solo le migliori `limite`; a parità
+    di punteggio vincono le più recenti. Costo lineare nelle corrispondenze:
+    circa 130 ms per una parola presente in un intervento su dieci su 100k.
+    """
+    query = query_fts(testo)
+    if not query:
+        return []
+    if not partecipanti:
+        query = f'{COLONNE_PUBBLICHE} : ({query})'
+    return conn.execute(f'''
+        SELECT {colonne}
+        FROM (
+            SELECT rowid, rank
+            FROM interventions_fts
+            WHERE interventions_fts MATCH ? AND rank MATCH 'bm25({PESI_SQL})'
+            ORDER BY rank, rowid DESC
+            LIMIT ?
+        ) f
+        JOIN interventions ON interventions.id = f.rowid
+        ORDER BY f.rank, f.rowid DESC
+    ''', (query, limite)).fetchall()
+
+
+def cerca_inline(conn, testo, limite=10):
+    """Ricerca della modalità inline: (id, colonne di SCHEDA_SQL).
+
+    "123/2025" e "123" cercano il numero di rapporto (un numero senza
+    rapporti cade sul testo libero, può essere un civico). I partecipanti
+    restano fuori: il risultato può finire in qualsiasi chat.
+    """
+    numero = NUMERO_RAPPORTO.match(testo)
+    if numero:
+        report_number, anno = numero.groups()
+        righe = conn.execute(f'''
+            SELECT {COLONNE_INLINE}
+            FROM interventions
+            WHERE report_number = ? AND CAST(year AS TEXT) LIKE ?
+            ORDER BY year DESC
+            LIMIT ?
+        ''', (report_number, f"{anno or ''}%", limite)).fetchall()
+        if righe or anno is not None:
+            return righe
+    return cerca_interventi(conn, testo, limite=limite, colonne=COLONNE_INLINE)
+
+
+# 🧰 RICERCA CON FILTRI
+def intervallo_date(testo):
+    """'03/2026 - 06/2026', '01/03/2026 - 15/06/2026', 'T1 2026', '2026', ... -> (inizio, fine esclusa) ISO, None se non valido"""
+    parti = [p.strip() for p in re.split(r'\s+-\s+|\s*→\s*', testo or '') if p.strip()]
+    if not 1 <= len(parti) <= 2:
+        return None
+    finestre = []
+    for parte in parti:
+        finestra = finestra_periodo(parte)
+        if finestra is None:
+            try:
+                giorno = datetime.strptime(parte, '%d/%m/%Y')
+            except ValueError:
+                return None
+            finestra = (giorno.strftime('%Y-%m-%d'), (giorno + timedelta(days=1)).strftime('%Y-%m-%d'))
+        finestre.append(finestra)
+    inizio, fine = finestre[0][0], finestre[-1][1]
+    return (inizio, fine) if inizio < fine else None
+
+
+def compila_filtri(filtri, partecipanti=False):
+    """Filtri {'inizio', 'fine', 'tipologia', 'mezzo', 'vigile'} -> (condizioni WHERE, parametri).
+
+    Gli interventi senza exit_at (data non interpretabile) non hanno posto
+    nell'ordinamento per data e restano fuori. Mezzo e vigile sono EXISTS
+    correlati: la query scorre l'indice per data e si ferma a pagina piena.
+    """
+    condizioni, parametri = ['exit_at IS NOT NULL'], []
+    if filtri.get('inizio'):
+        condizioni.append('exit_at >= ?')
+        parametri.append(filtri['inizio'])
+    if filtri.get('fine'):
+        condizioni.append('exit_at < ?')
+        parametri.append(filtri['fine'])
+    if filtri.get('tipologia'):
+        condizioni.append('intervention_type = ?')
+        parametri.append(filtri['tipologia'])
+    if filtri.get('mezzo'):
+        condizioni.append(
+            'EXISTS (SELECT 1 FROM intervention_vehicles v WHERE v.intervention_id = interventions.id AND v.license_plate = ?)'
+        )
+        parametri.append(filtri['mezzo'])
+    if filtri.get('vigile'):
+        if partecipanti:
+            condizioni.append(
+                '(squad_leader = ? OR driver = ? OR EXISTS (SELECT 1 FROM intervention_participants p '
+                'WHERE p.intervention_id = interventions.id AND p.full_name = ?))'
+            )
+            parametri += [filtri['vigile']] * 3
+        else:
+            condizioni.append('(squad_leader = ? OR driver = ?)')
+            parametri += [filtri['vigile']] * 2
+    return ' AND '.join(condizioni), parametri
+
+
+def pagina_filtrata(conn, filtri, partecipanti=False, cursore=None, indietro=False, limite=8):
+    """Una pagina di interventi filtrati, dal più recente, con keyset su (exit_at, id).
+
+    `cursore` è (exit_at, id) dell'ultima riga della pagina corrente (avanti)
+    o della prima (indietro). Restituisce (righe, precedente, successiva);
+    le righe sono (id, exit_at, report_number, year, exit_time, address, intervention_type).
+    """
+    if cursore is not None:
+        # Il cursore sta già nel periodo e ne sostituisce l'estremo: con due limiti
+        # sulla stessa colonna SQLite potrebbe partire dall'estremo invece che dal cursore
+        filtri = {k: v for k, v in filtri.items() if k != ('inizio' if indietro else 'fine')}
+    condizioni, parametri = compila_filtri(filtri, partecipanti)
+    if cursore is not None:
+        condizioni += ' AND (exit_at, id) > (?, ?)' if indietro else ' AND (exit_at, id) < (?, ?)'
+        parametri += list(cursore)
+    ordine = 'exit_at, id' if indietro else 'exit_at DESC, id DESC'
+    righe = conn.execute(f'''
+        SELECT id, exit_at, report_number, year, exit_time, address, intervention_type
+        FROM interventions
+        WHERE {condizioni}
+        ORDER BY {ordine}
+        LIMIT ?
+    ''', parametri + [limite + 1]).fetchall()
+
+    altre = len(righe) > limite
+    righe = righe[:limite]
+    if indietro:
+        return righe[::-1], altre, True
+    return righe, cursore is not None, altre
@@ -0,0 +1,466 @@
+# statistiche.py
+"""Aggregati materializzati delle statistiche interventi.
+
+Le tabelle stats_* vengono aggiornate nella stessa transazione di ogni
+inserimento (`aggiorna_statistiche`), così 📈 Statistiche legge poche righe
+qualunque sia la dimensione dello storico. `ricostruisci_statistiche` le
+ricalcola da zero (comando /ricalcola_statistiche). Le tabelle vengono
+create dalle migrazioni 5, 6, 8 e 10 (vedi migrations.py).
+"""
+import logging
+import re
+import time
+from datetime import date, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Durata in minuti di un intervento (NULL se manca uno dei due orari)
+DURATA_MINUTI_SQL = "CAST(round((julianday(return_at) - julianday(exit_at)) * 1440) AS INTEGER)"
+
+# strftime('%w'): 0 = domenica
+GIORNI = ['Dom', 'Lun', 'Mar', 'Mer', 'Gio', 'Ven', 'Sab']
+
+MESI = ['Gen', 'Feb', 'Mar', 'Apr', 'Mag', 'Giu', 'Lug', 'Ago', 'Set', 'Ott', 'Nov', 'Dic']
+
+
+def aggiorna_statistiche(conn, intervention_id):
+    """Somma un intervento appena inserito agli aggregati (stessa transazione)"""
+    c = conn.cursor()
+    c.execute('''
+        INSERT INTO stats_by_year (year, interventions, first_exit_at, first_exit_time, last_exit_at, last_exit_time)
+        SELECT year, 1, exit_at, exit_time, exit_at, exit_time FROM interventions WHERE id = ?
+        ON CONFLICT (year) DO UPDATE SET
+            interventions = interventions + 1,
+            first_exit_at = CASE WHEN first_exit_at IS NULL OR excluded.first_exit_at < first_exit_at
+                                 THEN excluded.first_exit_at ELSE first_exit_at END,
+            first_exit_time = CASE WHEN first_exit_at IS NULL OR excluded.first_exit_at < first_exit_at
+                                   THEN excluded.first_exit_time ELSE first_exit_time END,
+            last_exit_at = CASE WHEN last_exit_at IS NULL OR excluded.last_exit_at >= last_exit_at
+                                THEN excluded.last_exit_at ELSE last_exit_at END,
+            last_exit_time = CASE WHEN last_exit_at IS NULL OR excluded.last_exit_at >= last_exit_at
+                                  THEN excluded.last_exit_time ELSE last_exit_time END
+    ''', (intervention_id,))
+    c.execute('''
+        INSERT INTO stats_by_type (intervention_type, interventions)
+        SELECT intervention_type, 1 FROM interventions WHERE id = ?
+        ON CONFLICT (intervention_type) DO UPDATE SET interventions = interventions + 1
+    ''', (intervention_id,))
+    c.execute(f'''
+        INSERT INTO stats_by_vehicle (license_plate, interventions, minutes_out, last_exit_at, last_exit_time)
+        SELECT DISTINCT v.license_plate, 1, max(COALESCE({DURATA_MINUTI_SQL}, 0), 0),
+               i.exit_at, CASE WHEN i.exit_at IS NOT NULL THEN i.exit_time END
+        FROM intervention_vehicles v JOIN interventions i ON i.id = v.intervention_id
+        WHERE v.intervention_id = ?
+        ON CONFLICT (license_plate) DO UPDATE SET
+            interventions = interventions + 1,
+            minutes_out = minutes_out + excluded.minutes_out,
+            last_exit_at = CASE WHEN last_exit_at IS NULL OR excluded.last_exit_at >= last_exit_at
+                                THEN excluded.last_exit_at ELSE last_exit_at END,
+            last_exit_time = CASE WHEN last_exit_at IS NULL OR excluded.last_exit_at >= last_exit_at
+                                  THEN excluded.last_exit_time ELSE last_exit_time END
+    ''', (intervention_id,))
+    c.execute('''
+        INSERT INTO stats_by_month (year, month, interventions)
+        SELECT CAST(substr(exit_at, 1, 4) AS INTEGER), CAST(substr(exit_at, 6, 2) AS INTEGER), 1
+        FROM interventions WHERE id = ? AND exit_at IS NOT NULL
+        ON CONFLICT (year, month) DO UPDATE SET interventions = interventions + 1
+    ''', (intervention_id,))
+    aggiorna_durate(conn, intervention_id)
+    aggiorna_rollup(conn, intervention_id)
+
+
+def ricostruisci_statistiche(conn):
+    """Ricalcola tutti gli aggregati dalle tabelle interventi"""
+    inizio = time.perf_counter()
+    c = conn.cursor()
+    for tabella in ('stats_by_year', 'stats_by_type', 'stats_by_vehicle', 'stats_by_month'):
+        c.execute(f'DELETE FROM {tabella}')
+
+    c.execute('''
+        INSERT INTO stats_by_year (year, interventions)
+        SELECT year, COUNT(*) FROM interventions GROUP BY year
+    ''')
+    # Primo/ultimo per anno con idx_interventions_year_exit_at
+    c.execute('''
+        UPDATE stats_by_year SET
+            first_exit_at = (SELECT exit_at FROM interventions
+                             WHERE year = stats_by_year.year AND exit_at IS NOT NULL ORDER BY exit_at LIMIT 1),
+            first_exit_time = (SELECT exit_time FROM interventions
+                               WHERE year = stats_by_year.year AND exit_at IS NOT NULL ORDER BY exit_at LIMIT 1),
+            last_exit_at = (SELECT exit_at FROM interventions
+                            WHERE year = stats_by_year.year AND exit_at IS NOT NULL ORDER BY exit_at DESC LIMIT 1),
+            last_exit_time = (SELECT exit_time FROM interventions
+                              WHERE year = stats_by_year.year AND exit_at IS NOT NULL ORDER BY exit_at DESC LIMIT 1)
+    ''')
+    c.execute('''
+        INSERT INTO stats_by_type (intervention_type, interventions)
+        SELECT intervention_type, COUNT(*) FROM interventions GROUP BY intervention_type
+    ''')
+    # Un solo passaggio su collegamenti + interventi: conteggi, minuti fuori e ultimo utilizzo
+    # (max() aggregato: exit_time viene dalla riga con l'exit_at massimo)
+    c.execute(f'''
+        INSERT INTO stats_by_vehicle (license_plate, interventions, minutes_out, last_exit_at, last_exit_time)
+        SELECT license_plate, COUNT(*), SUM(minuti), max(exit_at), exit_time
+        FROM (
+            SELECT DISTINCT v.license_plate, v.intervention_id, i.exit_at,
+                   CASE WHEN i.exit_at IS NOT NULL THEN i.exit_time END AS exit_time,
+                   max(COALESCE({DURATA_MINUTI_SQL}, 0), 0) AS minuti
+            FROM intervention_vehicles v JOIN interventions i ON i.id = v.intervention_id
+        )
+        GROUP BY license_plate
+    ''')
+    c.execute('''
+        INSERT INTO stats_by_month (year, month, interventions)
+        SELECT CAST(substr(exit_at, 1, 4) AS INTEGER), CAST(substr(exit_at, 6, 2) AS INTEGER), COUNT(*)
+        FROM interventions WHERE exit_at IS NOT NULL
+        GROUP BY substr(exit_at, 1, 7)
+    ''')
+    ricostruisci_durate(conn)
+    ricostruisci_rollup(conn)
+    durata = time.perf_counter() - inizio
+    logger.info(f"✅ Statistiche ricalcolate in {durata * 1000:.0f} ms")
+    return durata
+
+
+def leggi_statistiche(conn):
+    """Legge gli aggregati per 📈 Statistiche (costo indipendente dal numero di interventi)"""
+    c = conn.cursor()
+    c.execute('SELECT year, interventions FROM stats_by_year ORDER BY year')
+    per_anno = c.fetchall()
+
+    c.execute('SELECT first_exit_time FROM stats_by_year WHERE first_exit_at IS NOT NULL ORDER BY first_exit_at LIMIT 1')
+    primo = c.fetchone()
+    c.execute('SELECT last_exit_time FROM stats_by_year WHERE last_exit_at IS NOT NULL ORDER BY last_exit_at DESC LIMIT 1')
+    ultimo = c.fetchone()
+
+    c.execute('SELECT intervention_type, interventions FROM stats_by_type ORDER BY interventions DESC')
+    per_tipologia = c.fetchall()
+
+    c.execute('''
+        SELECT license_plate, interventions, minutes_out, last_exit_time
+        FROM stats_by_vehicle ORDER BY interventions DESC LIMIT 5
+    ''')
+    per_mezzo = c.fetchall()
+
+    # Mesi dell'ultimo anno con interventi datati
+    c.execute('''
+        SELECT month, interventions FROM stats_by_month
+        WHERE year = (SELECT MAX(year) FROM stats_by_month) ORDER BY month
+    ''')
+    per_mese = c.fetchall()
+    c.execute('SELECT MAX(year) FROM stats_by_month')
+    anno_mesi = c.fetchone()[0]
+
+    return {
+        'totale': sum(n for _, n in per_anno),
+        'anni': [str(anno) for anno, _ in per_anno],
+        'primo': primo[0] if primo else None,
+        'ultimo': ultimo[0] if ultimo else None,
+        'per_tipologia': per_tipologia,
+        'per_mezzo': per_mezzo,
+        'anno_mesi': anno_mesi,
+        'per_mese': per_mese,
+    }
+
+
+# 👥 CARICO PER VIGILE
+PERIODI_RAPIDI = {
+    '📅 Mese corrente': ('mese', 0), '📅 Mese precedente': ('mese', -1),
+    '📆 Trimestre corrente': ('trimestre', 0), '📆 Trimestre precedente': ('trimestre', -1),
+    '🗓️ Anno corrente': ('anno', 0), '🗓️ Anno precedente': ('anno', -1),
+}
+
+FORMATO_PERIODO = re.compile(r'^\s*(?:(\d{1,2})/|[TtQq]([1-4])[\s/]+)?(\d{4})\s*$')
+
+
+def _finestra(tipo, anno, numero):
+    """(inizio, fine, etichetta) di un mese/trimestre/anno, fine esclusa"""
+    if tipo == 'anno':
+        return f'{anno:04d}-01-01', f'{anno + 1:04d}-01-01', str(anno)
+    mesi = 1 if tipo == 'mese' else 3
+    primo = (numero - 1) * mesi + 1
+    dopo = primo + mesi
+    fine = f'{anno + 1:04d}-01-01' if dopo > 12 else f'{anno:04d}-{dopo:02d}-01'
+    etichetta = f'{MESI[numero - 1]} {anno}' if tipo == 'mese' else f'T{numero} {anno}'
+    return f'{anno:04d}-{primo:02d}-01', fine, etichetta
+
+
+def finestra_periodo(testo, oggi=None):
+    """Interpreta un periodo (pulsante rapido, 'MM/AAAA', 'T1 AAAA' o 'AAAA'); None se non valido"""
+    oggi = oggi or date.today()
+    if testo in PERIODI_RAPIDI:
+        tipo, scarto = PERIODI_RAPIDI[testo]
+        if tipo == 'anno':
+            return _finestra('anno', oggi.year + scarto, None)
+        mesi = 1 if tipo == 'mese' else 3
+        indice = oggi.year * (12 // mesi) + (oggi.month - 1) // mesi + scarto
+        return _finestra(tipo, indice // (12 // mesi), indice % (12 // mesi) + 1)
+    match = FORMATO_PERIODO.match(testo or '')
+    if not match:
+        return None
+    mese, trimestre, anno = match.groups()
+    if mese:
+        if not 1 <= int(mese) <= 12:
+            return None
+        return _finestra('mese', int(anno), int(mese))
+    if trimestre:
+        return _finestra('trimestre', int(anno), int(trimestre))
+    return _finestra('anno', int(anno), None)
+
+
+def carico_vigili(conn, inizio, fine):
+    """Interventi per vigile come caposquadra, autista e partecipante con exit_at in [inizio, fine)
+
+    Ogni ruolo viene aggregato sul suo indice prima dell'unione, così il GROUP BY
+    finale lavora su poche righe per vigile invece che su una per intervento.
+    """
+    return conn.execute('''
+        SELECT nome, SUM(caposquadra), SUM(autista), SUM(partecipante)
+        FROM (
+            SELECT squad_leader AS nome, COUNT(*) AS caposquadra, 0 AS autista, 0 AS partecipante
+            FROM interventions WHERE exit_at >= ? AND exit_at < ? GROUP BY squad_leader
+            UNION ALL
+            SELECT driver, 0, COUNT(*), 0
+            FROM interventions WHERE exit_at >= ? AND exit_at < ? GROUP BY driver
+            UNION ALL
+            SELECT p.full_name, 0, 0, COUNT(*)
+            FROM interventions i JOIN intervention_participants p ON p.intervention_id = i.id
+            WHERE i.exit_at >= ? AND i.exit_at < ? GROUP BY p.full_name
+        )
+        WHERE nome IS NOT NULL AND nome != ''
+        GROUP BY nome
+        ORDER BY SUM(caposquadra) + SUM(autista) + SUM(partecipante) DESC, nome
+    ''', (inizio, fine) * 3).fetchall()
+
+
+# ⏱️ DURATE INTERVENTI
+# Rientro mancante o precedente all'uscita: condizione del partial index idx_interventions_anomalie
+DURATA_ANOMALA_SQL = "(exit_at IS NULL OR return_at IS NULL OR return_at < exit_at)"
+
+GRUPPI_DURATA = ('anno', 'tipologia', 'mezzo', 'vigile')
+
+# Uscita digitata senza ora ("03/02/2025"): la data ha solo cifre e / . -, l'ora è dopo spazio, T o virgola.
+# Condizione del partial index idx_interventions_senza_ora
+SENZA_ORA_SQL = "exit_at IS NOT NULL AND trim(exit_time) NOT GLOB '*[^0-9/.-]*'"
+
+
+def cte_durate(filtro=''):
+    """CTE `durate`: interventi filtrati con durata valida (minuti >= 0), calcolata una volta sola"""
+    return f'''WITH durate AS (
+        SELECT id, year, intervention_type, squad_leader, driver, {DURATA_MINUTI_SQL} AS minuti
+        FROM interventions {filtro}
+    )'''
+
+
+def _inserisci_durate(conn, filtro, parametri):
+    """Somma a stats_durations le durate valide degli interventi filtrati, per ogni gruppo"""
+    # UNION (non ALL): un vigile con più ruoli e un mezzo ripetuto contano una volta per intervento
+    conn.execute(f'''{cte_durate(filtro)}
+        INSERT INTO stats_durations (kind, key, year, interventions, minutes)
+        SELECT kind, key, year, COUNT(*), SUM(minuti) FROM (
+            SELECT 'anno' AS kind, '' AS key, year, id, minuti FROM durate WHERE minuti >= 0
+            UNION
+            SELECT 'tipologia', intervention_type, year, id, minuti FROM durate WHERE minuti >= 0
+            UNION
+            SELECT 'mezzo', v.license_plate, d.year, d.id, d.minuti
+            FROM durate d JOIN intervention_vehicles v ON v.intervention_id = d.id WHERE d.minuti >= 0
+            UNION
+            SELECT 'vigile', squad_leader, year, id, minuti FROM durate WHERE minuti >= 0
+            UNION
+            SELECT 'vigile', driver, year, id, minuti FROM durate WHERE minuti >= 0
+            UNION
+            SELECT 'vigile', p.full_name, d.year, d.id, d.minuti
+            FROM durate d JOIN intervention_participants p ON p.intervention_id = d.id WHERE d.minuti >= 0
+        )
+        WHERE key IS NOT NULL AND NOT (kind = 'vigile' AND key = '')
+        GROUP BY kind, key, year
+        ON CONFLICT (kind, key, year) DO UPDATE SET
+            interventions = interventions + excluded.interventions,
+            minutes = minutes + excluded.minutes
+    ''', parametri)
+
+
+def aggiorna_durate(conn, intervention_id):
+    """Somma la durata di un intervento appena inserito agli aggregati"""
+    _inserisci_durate(conn, 'WHERE id = ?', (intervention_id,))
+
+
+def ricostruisci_durate(conn):
+    """Ricalcola stats_durations da tutto lo storico"""
+    conn.execute('DELETE FROM stats_durations')
+    _inserisci_durate(conn, '', ())
+
+
+def analisi_durate(conn, anno=None, max_anomalie=20):
+    """Ore fuori per anno, tipologia, mezzo e vigile e durate anomale (mancanti o negative).
+
+    I totali vengono da stats_durations; le anomalie dall'indice parziale, quindi il
+    costo non cresce con lo storico. Ogni gruppo è (chiave, interventi, minuti, media minuti).
+    """
+    filtro_anno, parametri = ('AND year = ?', (anno,)) if anno else ('', ())
+    c = conn.cursor()
+
+    if anno:
+        c.execute('SELECT COALESCE(SUM(interventions), 0) FROM stats_by_year WHERE year = ?', (anno,))
+    else:
+        c.execute('SELECT COALESCE(SUM(interventions), 0) FROM stats_by_year')
+    totale = c.fetchone()[0]
+
+    c.execute(f'''
+        SELECT COUNT(*) - COALESCE(SUM(return_at < exit_at), 0), COALESCE(SUM(return_at < exit_at), 0)
+        FROM interventions WHERE {DURATA_ANOMALA_SQL} {filtro_anno}
+    ''', parametri)
+    mancanti, negative = c.fetchone()
+
+    c.execute(f'''
+        SELECT report_number, year, exit_time, {DURATA_MINUTI_SQL} FROM interventions
+        WHERE {DURATA_ANOMALA_SQL} {filtro_anno}
+        ORDER BY year DESC, id DESC LIMIT ?
+    ''', parametri + (max_anomalie,))
+    anomalie = c.fetchall()
+
+    risultato = {'totale': totale, 'mancanti': mancanti, 'negative': negative, 'anomalie': anomalie}
+    for gruppo in GRUPPI_DURATA:
+        chiave = 'year' if gruppo == 'anno' else 'key'
+        c.execute(f'''
+            SELECT {chiave}, SUM(interventions), SUM(minutes), SUM(minutes) * 1.0 / SUM(interventions)
+            FROM stats_durations WHERE kind = ? {filtro_anno}
+            GROUP BY {chiave} ORDER BY {'year' if gruppo == 'anno' else 'SUM(minutes) DESC, key'}
+        ''', (gruppo,) + parametri)
+        risultato['per_' + gruppo] = c.fetchall()
+    return risultato
+
+
+# 📊 STATISTICHE AVANZATE
+def statistiche_avanzate(conn):
+    """Istogrammi per mese, giorno della settimana, ora e tipologia per anno (date da exit_at).
+
+    L'istogramma per ora esclude le uscite digitate senza ora, contate in 'senza_ora'.
+    """
+    c = conn.cursor()
+    c.execute('SELECT month, SUM(interventions) FROM stats_by_month GROUP BY month')
+    per_mese = dict(c.fetchall())
+
+    # Giorno e ora in un solo passaggio sull'indice coprente che inizia con exit_at
+    c.execute('''
+        SELECT CAST(strftime('%w', exit_at) AS INTEGER), CAST(substr(exit_at, 12, 2) AS INTEGER), COUNT(*)
+        FROM interventions WHERE exit_at IS NOT NULL
+        GROUP BY 1, 2
+    ''')
+    per_giorno, per_ora = {}, {}
+    for giorno, ora, count in c.fetchall():
+        per_giorno[giorno] = per_giorno.get(giorno, 0) + count
+        per_ora[ora] = per_ora.get(ora, 0) + count
+
+    # Le uscite senza ora hanno exit_at alle 00:00 (parse_timestamp): non contano nella fascia
+    # di mezzanotte. Contate dall'indice parziale, che contiene solo loro
+    c.execute(f'SELECT COUNT(*) FROM interventions WHERE {SENZA_ORA_SQL}')
+    senza_ora = c.fetchone()[0]
+    per_ora[0] = per_ora.get(0, 0) - senza_ora
+
+    # Tipologie per anno sull'indice (intervention_type, exit_at)
+    c.execute('''
+        SELECT intervention_type, CAST(substr(exit_at, 1, 4) AS INTEGER), COUNT(*)
+        FROM interventions WHERE exit_at IS NOT NULL
+        GROUP BY 1, 2
+    ''')
+    tipologie_anni = {}
+    for tipo, anno, count in c.fetchall():
+        tipologie_anni.setdefault(tipo, {})[anno] = count
+
+    return {
+        'per_mese': [per_mese.get(m, 0) for m in range(1, 13)],
+        'per_giorno': [per_giorno.get(g, 0) for g in range(7)],
+        'per_ora': [per_ora.get(h, 0) for h in range(24)],
+        'senza_ora': senza_ora,
+        'tipologie_anni': tipologie_anni,
+    }
+
+
+# 📅 CONFRONTO TRA ANNI
+def _inserisci_rollup(conn, filtro, parametri):
+    conn.execute(f'''
+        INSERT INTO stats_by_year_group (year, kind, key, interventions)
+        SELECT year, kind, key, COUNT(*) FROM (
+            SELECT i.year, 'tipologia' AS kind, i.intervention_type AS key, i.id FROM interventions i {filtro}
+            UNION
+            SELECT i.year, 'mezzo', v.license_plate, i.id
+            FROM interventions i JOIN intervention_vehicles v ON v.intervention_id = i.id {filtro}
+        )
+        WHERE key IS NOT NULL
+        GROUP BY year, kind, key
+        ON CONFLICT (year, kind, key) DO UPDATE SET interventions = interventions + excluded.interventions
+    ''', parametri * 2)
+
+
+def aggiorna_rollup(conn, intervention_id):
+    """Somma un intervento al rollup del suo anno (in pratica solo l'anno in corso cambia)"""
+    _inserisci_rollup(conn, 'WHERE i.id = ?', (intervention_id,))
+
+
+def ricostruisci_rollup(conn, anno=None):
+    """Ricalcola il rollup di un anno (o di tutti): gli anni chiusi non vanno più ricalcolati"""
+    if anno is None:
+        conn.execute('DELETE FROM stats_by_year_group')
+        _inserisci_rollup(conn, '', ())
+    else:
+        conn.execute('DELETE FROM stats_by_year_group WHERE year = ?', (anno,))
+        _inserisci_rollup(conn, 'WHERE i.year = ?', (anno,))
+
+
+def _stessa_data(giorno, anno):
+    """Giorno successivo a `giorno` spostato nell'anno `anno` (29/02 → 28/02), ISO"""
+    try:
+        stesso = giorno.replace(year=anno)
+    except ValueError:
+        stesso = giorno.replace(year=anno, day=28)
+    return (stesso + timedelta(days=1)).isoformat()
+
+
+def confronto_anni(conn, anno, oggi=None):
+    """Anno `anno` contro il precedente: totali, stessa data, tipologie, mezzi e durata media"""
+    oggi = oggi or date.today()
+    precedente = anno - 1
+    # Stessa data: oggi per l'anno in corso, fine anno per gli anni chiusi
+    giorno = oggi if oggi.year == anno else date(anno, 12, 31)
+    c = conn.cursor()
+
+    def per_anno(sql, *parametri):
+        valori = {}
+        for a in (anno, precedente):
+            row = c.execute(sql, (a,) + parametri).fetchone()
+            valori[a] = row[0] if row and row[0] else 0
+        return valori
+
+    totali = per_anno('SELECT interventions FROM stats_by_year WHERE year = ?')
+    # Conteggio fino alla stessa data sull'indice coprente (year, exit_at)
+    alla_data = {
+        a: c.execute(
+            'SELECT COUNT(*) FROM interventions WHERE year = ? AND exit_at < ?', (a, _stessa_data(giorno, a))
+        ).fetchone()[0]
+        for a in (anno, precedente)
+    }
+    media_minuti = per_anno('''
+        SELECT minutes * 1.0 / interventions FROM stats_durations WHERE kind = 'anno' AND key = '' AND year = ?
+    ''')
+
+    gruppi = {}
+    for kind in ('tipologia', 'mezzo'):
+        conteggi = {}
+        for a in (anno, precedente):
+            for key, count in c.execute(
+                'SELECT key, interventions FROM stats_by_year_group WHERE year = ? AND kind = ?', (a, kind)
+            ):
+                conteggi.setdefault(key, {anno: 0, precedente: 0})[a] = count
+        gruppi[kind] = sorted(conteggi.items(), key=lambda voce: (-voce[1][anno], -voce[1][precedente], voce[0]))
+
+    return {
+        'anno': anno,
+        'precedente': precedente,
+        'giorno': giorno,
+        'totali': totali,
+        'alla_data': alla_data,
+        'media_minuti': media_minuti,
+        'tipologie': gruppi['tipologia'],
+        'mezzi': gruppi['mezzo'],
+    }
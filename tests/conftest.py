@@ -0,0 +1,45 @@
+# tests/conftest.py
+import itertools
+import os
+import sys
+
+import pytest
+
+# I moduli del bot stanno nella radice del repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import connect
+from interventi import salva_intervento
+from migrations import applica_migrazioni
+
+
+@pytest.fixture
+def conn(tmp_path):
+    """Database vuoto alla versione corrente dello schema"""
+    conn = connect(str(tmp_path / 'vigili.db'))
+    applica_migrazioni(conn)
+    yield conn
+    conn.close()
+
+
+_numeri = itertools.count(1)
+
+
+def nuovo_intervento(conn, participants=('Rossi Mario',), vehicles=('AB123CD',), **campi):
+    """Inserisce e committa un intervento come il wizard (campi mancanti con valori di prova), restituisce l'id"""
+    dati = {
+        'report_number': str(next(_numeri)), 'year': 2025,
+        'exit_time': '03/02/2025 10:00', 'return_time': '03/02/2025 11:30',
+        'address': 'Via Milano 1, Erba', 'intervention_type': 'Incendio',
+        'squad_leader': 'Bianchi Luca', 'driver': 'Verdi Paolo',
+    }
+    dati.update(campi)
+    intervention_id = salva_intervento(conn, dati, list(participants), list(vehicles), created_by=1)
+    conn.commit()
+    return intervention_id
+
+
+@pytest.fixture
+def inserisci(conn):
+    """nuovo_intervento sul database del test"""
+    return lambda **campi: nuovo_intervento(conn, **campi)
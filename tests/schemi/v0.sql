@@ -0,0 +1,68 @@
+BEGIN TRANSACTION;
+CREATE TABLE access_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE,
+            username TEXT,
+            full_name TEXT,
+            requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'pending'
+        );
+CREATE TABLE admins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+CREATE TABLE interventions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            report_number TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            exit_time TEXT NOT NULL,
+            return_time TEXT,
+            address TEXT NOT NULL,
+            intervention_type TEXT DEFAULT 'Incendio',
+            squad_leader TEXT NOT NULL,
+            driver TEXT NOT NULL,
+            participants TEXT NOT NULL,
+            vehicles_used TEXT NOT NULL,
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(report_number, year)
+        );
+INSERT INTO "interventions" VALUES(1,'1',2023,'10/01/2023 08:00','10/01/2023 09:15','Via Dante 5, Erba','Incendio','Bianchi Luca','Verdi Paolo','["Rossi Mario"]','["AB123CD"]',NULL,'2024-03-01 12:00:00');
+INSERT INTO "interventions" VALUES(2,'2',2023,'28/06/2023 22:40','29/06/2023 01:10','Via Milano 1, Erba','Soccorso','Bianchi Luca','Verdi Paolo','["Neri Anna", "Rossi Mario"]','["AB123CD", "EF456GH"]',NULL,'2024-03-01 12:00:00');
+INSERT INTO "interventions" VALUES(3,'1',2024,'03/02/2024 10:00','03/02/2024 09:00','Piazza Mercato, Erba','Incendio','Bianchi Luca','Verdi Paolo','[]','["EF456GH"]',NULL,'2024-03-01 12:00:00');
+INSERT INTO "interventions" VALUES(4,'2',2024,'ieri sera','','Via Como 3, Erba','Allagamento','Bianchi Luca','Verdi Paolo','["Neri Anna"]','[]',NULL,'2024-03-01 12:00:00');
+CREATE TABLE personnel (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            full_name TEXT NOT NULL,
+            qualification TEXT,
+            license_grade TEXT,
+            has_nautical_license BOOLEAN DEFAULT FALSE,
+            is_saf BOOLEAN DEFAULT FALSE,
+            is_tpss BOOLEAN DEFAULT FALSE,
+            squadra_notturna TEXT,
+            squadra_serale TEXT,
+            squadra_domenicale TEXT,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+CREATE TABLE users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE,
+            username TEXT,
+            full_name TEXT,
+            role TEXT DEFAULT 'user',
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+CREATE TABLE vehicles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            license_plate TEXT UNIQUE NOT NULL,
+            model TEXT NOT NULL,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+DELETE FROM "sqlite_sequence";
+INSERT INTO "sqlite_sequence" VALUES('interventions',4);
+COMMIT;
+PRAGMA user_version = 0;
@@ -0,0 +1,281 @@
+BEGIN TRANSACTION;
+CREATE TABLE access_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE,
+            username TEXT,
+            full_name TEXT,
+            requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'pending'
+        );
+CREATE TABLE admins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+CREATE TABLE export_cache (
+            year INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL,
+            file_id TEXT NOT NULL,
+            riepilogo TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+CREATE TABLE export_versions (
+            year INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+CREATE TABLE export_watermarks (
+            target TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL DEFAULT 0,
+            last_created_at TEXT,
+            interventions INTEGER NOT NULL DEFAULT 0,
+            exported_by INTEGER,
+            exported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+CREATE TABLE intervention_participants (
+            intervention_id INTEGER NOT NULL REFERENCES interventions(id),
+            position INTEGER NOT NULL,
+            personnel_id INTEGER,
+            full_name TEXT NOT NULL,
+            PRIMARY KEY (intervention_id, position)
+        );
+INSERT INTO "intervention_participants" VALUES(1,0,NULL,'Rossi Mario');
+INSERT INTO "intervention_participants" VALUES(2,0,NULL,'Neri Anna');
+INSERT INTO "intervention_participants" VALUES(2,1,NULL,'Rossi Mario');
+INSERT INTO "intervention_participants" VALUES(4,0,NULL,'Neri Anna');
+CREATE TABLE intervention_vehicles (
+            intervention_id INTEGER NOT NULL REFERENCES interventions(id),
+            position INTEGER NOT NULL,
+            vehicle_id INTEGER,
+            license_plate TEXT NOT NULL,
+            PRIMARY KEY (intervention_id, position)
+        );
+INSERT INTO "intervention_vehicles" VALUES(1,0,NULL,'AB123CD');
+INSERT INTO "intervention_vehicles" VALUES(2,0,NULL,'AB123CD');
+INSERT INTO "intervention_vehicles" VALUES(2,1,NULL,'EF456GH');
+INSERT INTO "intervention_vehicles" VALUES(3,0,NULL,'EF456GH');
+CREATE TABLE interventions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            report_number TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            exit_time TEXT NOT NULL,
+            return_time TEXT,
+            address TEXT NOT NULL,
+            intervention_type TEXT DEFAULT 'Incendio',
+            squad_leader TEXT NOT NULL,
+            driver TEXT NOT NULL,
+            participants TEXT NOT NULL,
+            vehicles_used TEXT NOT NULL,
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, exit_at TEXT, return_at TEXT, address_key TEXT,
+            UNIQUE(report_number, year)
+        );
+INSERT INTO "interventions" VALUES(1,'1',2023,'10/01/2023 08:00','10/01/2023 09:15','Via Dante 5, Erba','Incendio','Bianchi Luca','Verdi Paolo','["Rossi Mario"]','["AB123CD"]',NULL,'2024-03-01 12:00:00','2023-01-10 08:00','2023-01-10 09:15',NULL);
+INSERT INTO "interventions" VALUES(2,'2',2023,'28/06/2023 22:40','29/06/2023 01:10','Via Milano 1, Erba','Soccorso','Bianchi Luca','Verdi Paolo','["Neri Anna", "Rossi Mario"]','["AB123CD", "EF456GH"]',NULL,'2024-03-01 12:00:00','2023-06-28 22:40','2023-06-29 01:10',NULL);
+INSERT INTO "interventions" VALUES(3,'1',2024,'03/02/2024 10:00','03/02/2024 09:00','Piazza Mercato, Erba','Incendio','Bianchi Luca','Verdi Paolo','[]','["EF456GH"]',NULL,'2024-03-01 12:00:00','2024-02-03 10:00','2024-02-03 09:00',NULL);
+INSERT INTO "interventions" VALUES(4,'2',2024,'ieri sera','','Via Como 3, Erba','Allagamento','Bianchi Luca','Verdi Paolo','["Neri Anna"]','[]',NULL,'2024-03-01 12:00:00',NULL,NULL,NULL);
+CREATE VIRTUAL TABLE interventions_fts USING fts5(
+            address, intervention_type, squad_leader, driver, participants,
+            tokenize = 'unicode61 remove_diacritics 2'
+        );
+INSERT INTO "interventions_fts" (rowid, address, intervention_type, squad_leader, driver, participants) VALUES(1, 'Via Dante 5, Erba', 'Incendio', 'Bianchi Luca', 'Verdi Paolo', 'Rossi Mario');
+INSERT INTO "interventions_fts" (rowid, address, intervention_type, squad_leader, driver, participants) VALUES(2, 'Via Milano 1, Erba', 'Soccorso', 'Bianchi Luca', 'Verdi Paolo', 'Neri Anna Rossi Mario');
+INSERT INTO "interventions_fts" (rowid, address, intervention_type, squad_leader, driver, participants) VALUES(3, 'Piazza Mercato, Erba', 'Incendio', 'Bianchi Luca', 'Verdi Paolo', NULL);
+INSERT INTO "interventions_fts" (rowid, address, intervention_type, squad_leader, driver, participants) VALUES(4, 'Via Como 3, Erba', 'Allagamento', 'Bianchi Luca', 'Verdi Paolo', 'Neri Anna');
+CREATE TABLE personnel (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            full_name TEXT NOT NULL,
+            qualification TEXT,
+            license_grade TEXT,
+            has_nautical_license BOOLEAN DEFAULT FALSE,
+            is_saf BOOLEAN DEFAULT FALSE,
+            is_tpss BOOLEAN DEFAULT FALSE,
+            squadra_notturna TEXT,
+            squadra_serale TEXT,
+            squadra_domenicale TEXT,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+ANALYZE "sqlite_master";
+INSERT INTO "sqlite_stat1" VALUES('intervention_vehicles','idx_vehicles_plate','4 2');
+INSERT INTO "sqlite_stat1" VALUES('intervention_vehicles','idx_vehicles_vehicle','4 4');
+INSERT INTO "sqlite_stat1" VALUES('intervention_vehicles','sqlite_autoindex_intervention_vehicles_1','4 2 1');
+INSERT INTO "sqlite_stat1" VALUES('intervention_participants','idx_participants_name','4 2');
+INSERT INTO "sqlite_stat1" VALUES('intervention_participants','idx_participants_personnel','4 4');
+INSERT INTO "sqlite_stat1" VALUES('intervention_participants','sqlite_autoindex_intervention_participants_1','4 2 1');
+INSERT INTO "sqlite_stat1" VALUES('interventions','idx_interventions_type_exit_at','4 2 1');
+INSERT INTO "sqlite_stat1" VALUES('interventions','idx_interventions_exit_at_roles','4 1 1 1');
+INSERT INTO "sqlite_stat1" VALUES('interventions','idx_interventions_anomalie','2 2 1');
+INSERT INTO "sqlite_stat1" VALUES('interventions','idx_interventions_created_at','4 4');
+INSERT INTO "sqlite_stat1" VALUES('interventions','idx_interventions_year_exit_at','4 2 1');
+INSERT INTO "sqlite_stat1" VALUES('interventions','sqlite_autoindex_interventions_1','4 2 1');
+CREATE TABLE stats_by_month (
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            interventions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (year, month)
+        );
+INSERT INTO "stats_by_month" VALUES(2023,1,1);
+INSERT INTO "stats_by_month" VALUES(2023,6,1);
+INSERT INTO "stats_by_month" VALUES(2024,2,1);
+CREATE TABLE stats_by_type (
+            intervention_type TEXT PRIMARY KEY,
+            interventions INTEGER NOT NULL DEFAULT 0
+        );
+INSERT INTO "stats_by_type" VALUES('Allagamento',1);
+INSERT INTO "stats_by_type" VALUES('Incendio',2);
+INSERT INTO "stats_by_type" VALUES('Soccorso',1);
+CREATE TABLE stats_by_vehicle (
+            license_plate TEXT PRIMARY KEY,
+            interventions INTEGER NOT NULL DEFAULT 0,
+            minutes_out INTEGER NOT NULL DEFAULT 0,
+            last_exit_at TEXT,
+            last_exit_time TEXT
+        );
+INSERT INTO "stats_by_vehicle" VALUES('AB123CD',2,225,'2023-06-28 22:40','28/06/2023 22:40');
+INSERT INTO "stats_by_vehicle" VALUES('EF456GH',2,150,'2024-02-03 10:00','03/02/2024 10:00');
+CREATE TABLE stats_by_year (
+            year INTEGER PRIMARY KEY,
+            interventions INTEGER NOT NULL DEFAULT 0,
+            first_exit_at TEXT,
+            first_exit_time TEXT,
+            last_exit_at TEXT,
+            last_exit_time TEXT
+        );
+INSERT INTO "stats_by_year" VALUES(2023,2,'2023-01-10 08:00','10/01/2023 08:00','2023-06-28 22:40','28/06/2023 22:40');
+INSERT INTO "stats_by_year" VALUES(2024,2,'2024-02-03 10:00','03/02/2024 10:00','2024-02-03 10:00','03/02/2024 10:00');
+CREATE TABLE stats_by_year_group (
+            year INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            interventions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (year, kind, key)
+        );
+INSERT INTO "stats_by_year_group" VALUES(2023,'mezzo','AB123CD',2);
+INSERT INTO "stats_by_year_group" VALUES(2023,'mezzo','EF456GH',1);
+INSERT INTO "stats_by_year_group" VALUES(2023,'tipologia','Incendio',1);
+INSERT INTO "stats_by_year_group" VALUES(2023,'tipologia','Soccorso',1);
+INSERT INTO "stats_by_year_group" VALUES(2024,'mezzo','EF456GH',1);
+INSERT INTO "stats_by_year_group" VALUES(2024,'tipologia','Allagamento',1);
+INSERT INTO "stats_by_year_group" VALUES(2024,'tipologia','Incendio',1);
+CREATE TABLE stats_durations (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            interventions INTEGER NOT NULL DEFAULT 0,
+            minutes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (kind, key, year)
+        );
+INSERT INTO "stats_durations" VALUES('anno','',2023,2,225);
+INSERT INTO "stats_durations" VALUES('mezzo','AB123CD',2023,2,225);
+INSERT INTO "stats_durations" VALUES('mezzo','EF456GH',2023,1,150);
+INSERT INTO "stats_durations" VALUES('tipologia','Incendio',2023,1,75);
+INSERT INTO "stats_durations" VALUES('tipologia','Soccorso',2023,1,150);
+INSERT INTO "stats_durations" VALUES('vigile','Bianchi Luca',2023,2,225);
+INSERT INTO "stats_durations" VALUES('vigile','Neri Anna',2023,1,150);
+INSERT INTO "stats_durations" VALUES('vigile','Rossi Mario',2023,2,225);
+INSERT INTO "stats_durations" VALUES('vigile','Verdi Paolo',2023,2,225);
+CREATE TABLE users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE,
+            username TEXT,
+            full_name TEXT,
+            role TEXT DEFAULT 'user',
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+CREATE TABLE vehicles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            license_plate TEXT UNIQUE NOT NULL,
+            model TEXT NOT NULL,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+CREATE INDEX idx_participants_personnel ON intervention_participants(personnel_id);
+CREATE INDEX idx_participants_name ON intervention_participants(full_name);
+CREATE INDEX idx_vehicles_vehicle ON intervention_vehicles(vehicle_id);
+CREATE INDEX idx_vehicles_plate ON intervention_vehicles(license_plate);
+CREATE INDEX idx_interventions_year_exit_at ON interventions(year, exit_at);
+CREATE INDEX idx_interventions_created_at ON interventions(created_at);
+CREATE INDEX idx_personnel_active_name ON personnel(is_active, full_name);
+CREATE INDEX idx_personnel_name ON personnel(full_name);
+CREATE INDEX idx_vehicles_active ON vehicles(is_active, license_plate);
+CREATE INDEX idx_users_active ON users(is_active);
+CREATE INDEX idx_access_requests_status ON access_requests(status);
+CREATE INDEX idx_interventions_anomalie ON interventions(year, id)
+        WHERE (exit_at IS NULL OR return_at IS NULL OR return_at < exit_at)
+    ;
+CREATE INDEX idx_interventions_exit_at_roles ON interventions(exit_at, squad_leader, driver);
+CREATE INDEX idx_interventions_type_exit_at ON interventions(intervention_type, exit_at);
+CREATE INDEX idx_interventions_address_key
+        ON interventions(address_key, exit_at)
+    ;
+CREATE TRIGGER interventions_fts_insert AFTER INSERT ON interventions BEGIN
+            INSERT INTO interventions_fts (rowid, address, intervention_type, squad_leader, driver, participants) VALUES (NEW.id, NEW.address, NEW.intervention_type, NEW.squad_leader, NEW.driver, CASE WHEN json_valid(NEW.participants)
+    THEN (SELECT group_concat(value, ' ') FROM json_each(NEW.participants))
+    ELSE NEW.participants END);
+        END;
+CREATE TRIGGER interventions_fts_delete AFTER DELETE ON interventions BEGIN
+            DELETE FROM interventions_fts WHERE rowid = OLD.id;
+        END;
+CREATE TRIGGER interventions_fts_update
+        AFTER UPDATE OF address, intervention_type, squad_leader, driver, participants ON interventions BEGIN
+            DELETE FROM interventions_fts WHERE rowid = OLD.id;
+            INSERT INTO interventions_fts (rowid, address, intervention_type, squad_leader, driver, participants) VALUES (NEW.id, NEW.address, NEW.intervention_type, NEW.squad_leader, NEW.driver, CASE WHEN json_valid(NEW.participants)
+    THEN (SELECT group_concat(value, ' ') FROM json_each(NEW.participants))
+    ELSE NEW.participants END);
+        END;
+CREATE TRIGGER interventions_export_insert
+                AFTER INSERT ON interventions BEGIN
+                    INSERT INTO export_versions (year, version) VALUES (NEW.year, 1)
+                    ON CONFLICT (year) DO UPDATE SET version = version + 1;
+                END;
+CREATE TRIGGER interventions_export_delete
+                AFTER DELETE ON interventions BEGIN
+                    INSERT INTO export_versions (year, version) VALUES (OLD.year, 1)
+                    ON CONFLICT (year) DO UPDATE SET version = version + 1;
+                END;
+CREATE TRIGGER interventions_export_update
+                AFTER UPDATE OF report_number, year, exit_time, return_time, address, intervention_type, squad_leader, driver, participants, vehicles_used ON interventions BEGIN
+                    INSERT INTO export_versions (year, version) VALUES (OLD.year, 1)
+                    ON CONFLICT (year) DO UPDATE SET version = version + 1;
+            INSERT INTO export_versions (year, version) VALUES (NEW.year, 1)
+                    ON CONFLICT (year) DO UPDATE SET version = version + 1;
+                END;
+CREATE TRIGGER intervention_participants_export_insert
+                AFTER INSERT ON intervention_participants BEGIN
+                    INSERT INTO export_versions (year, version) VALUES ((SELECT year FROM interventions WHERE id = NEW.intervention_id), 1)
+                    ON CONFLICT (year) DO UPDATE SET version = version + 1;
+                END;
+CREATE TRIGGER intervention_participants_export_delete
+                AFTER DELETE ON intervention_participants BEGIN
+                    INSERT INTO export_versions (year, version) VALUES ((SELECT year FROM interventions WHERE id = OLD.intervention_id), 1)
+                    ON CONFLICT (year) DO UPDATE SET version = version + 1;
+                END;
+CREATE TRIGGER intervention_participants_export_update
+                AFTER UPDATE OF full_name, position ON intervention_participants BEGIN
+                    INSERT INTO export_versions (year, version) VALUES ((SELECT year FROM interventions WHERE id = OLD.intervention_id), 1)
+                    ON CONFLICT (year) DO UPDATE SET version = version + 1;
+            INSERT INTO export_versions (year, version) VALUES ((SELECT year FROM interventions WHERE id = NEW.intervention_id), 1)
+                    ON CONFLICT (year) DO UPDATE SET version = version + 1;
+                END;
+CREATE TRIGGER intervention_vehicles_export_insert
+                AFTER INSERT ON intervention_vehicles BEGIN
+                    INSERT INTO export_versions (year, version) VALUES ((SELECT year FROM interventions WHERE id = NEW.intervention_id), 1)
+                    ON CONFLICT (year) DO UPDATE SET version = version + 1;
+                END;
+CREATE TRIGGER intervention_vehicles_export_delete
+                AFTER DELETE ON intervention_vehicles BEGIN
+                    INSERT INTO export_versions (year, version) VALUES ((SELECT year FROM interventions WHERE id = OLD.intervention_id), 1)
+                    ON CONFLICT (year) DO UPDATE SET version = version + 1;
+                END;
+CREATE TRIGGER intervention_vehicles_export_update
+                AFTER UPDATE OF license_plate, position ON intervention_vehicles BEGIN
+                    INSERT INTO export_versions (year, version) VALUES ((SELECT year FROM interventions WHERE id = OLD.intervention_id), 1)
+                    ON CONFLICT (year) DO UPDATE SET version = version + 1;
+            INSERT INTO export_versions (year, version) VALUES ((SELECT year FROM interventions WHERE id = NEW.intervention_id), 1)
+                    ON CONFLICT (year) DO UPDATE SET version = version + 1;
+                END;
+DELETE FROM "sqlite_sequence";
+INSERT INTO "sqlite_sequence" VALUES('interventions',4);
+COMMIT;
+PRAGMA user_version = 14;
@@ -0,0 +1,126 @@
+# tests/test_bot.py
+import asyncio
+import io
+import os
+import zipfile
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('telegram')
+
+import bot
+import esportazione
+from bot import MAX_MESSAGGIO, VigiliBot, lunghezza_telegram, tronca_telegram
+from conftest import nuovo_intervento
+from database import DatabasePool
+from esportazione import prepara_export_anno
+
+
+class Messaggio:
+    """Messaggio finto: registra risposte e documenti inviati dal bot"""
+
+    def __init__(self, risposte, documenti, text):
+        self.risposte, self.documenti, self.text = risposte, documenti, text
+
+    async def reply_text(self, testo, **kwargs):
+        self.risposte.append(testo)
+
+    async def reply_document(self, document, filename=None, **kwargs):
+        self.documenti.append((filename, document.read()))
+        return SimpleNamespace(document=SimpleNamespace(file_id=f'file-{len(self.documenti)}'))
+
+
+@pytest.fixture
+def chat(conn, tmp_path, monkeypatch):
+    """Conversazione con il bot di un admin: chat(testo) passa il messaggio a handle_message"""
+    pool = DatabasePool(str(tmp_path / 'vigili.db'), size=1)
+    monkeypatch.setattr(bot, 'db', pool)
+    monkeypatch.setattr(esportazione, 'CARTELLA_CACHE', str(tmp_path / 'cache_export'))
+
+    async def admin(user_id):
+        return True, True
+    monkeypatch.setattr(bot.autorizzazioni, 'stato', admin)
+
+    vigili_bot = VigiliBot.__new__(VigiliBot)
+    context = SimpleNamespace(user_data={})
+    risposte, documenti = [], []
+
+    async def conversazione(messaggi):
+        for testo in messaggi:
+            update = SimpleNamespace(effective_user=SimpleNamespace(id=1),
+                                     message=Messaggio(risposte, documenti, testo))
+            await vigili_bot.handle_message(update, context)
+        await pool.stop_writer()
+
+    def invia(*messaggi):
+        asyncio.run(conversazione(messaggi))
+        return risposte, documenti
+
+    yield invia
+    pool.close()
+
+
+def test_tronca_conta_le_emoji_come_telegram():
+    testo = '🔥' * 5000
+    assert len(testo[:MAX_MESSAGGIO]) == MAX_MESSAGGIO
+    assert lunghezza_telegram(testo[:MAX_MESSAGGIO]) == 2 * MAX_MESSAGGIO
+    assert tronca_telegram(testo) == '🔥' * (MAX_MESSAGGIO // 2)
+
+
+def test_tronca_non_spezza_le_emoji():
+    testo = 'a' + '🔥' * MAX_MESSAGGIO
+    troncato = tronca_telegram(testo)
+    assert troncato == 'a' + '🔥' * (MAX_MESSAGGIO // 2 - 1)
+    assert lunghezza_telegram(troncato) == MAX_MESSAGGIO - 1
+    assert tronca_telegram('breve 📍') == 'breve 📍'
+
+
+def test_esporta_zip_dal_menu(conn, chat):
+    nuovo_intervento(conn, year=2024, exit_time='03/02/2024 10:00', return_time='03/02/2024 11:30')
+    nuovo_intervento(conn)
+    risposte, documenti = chat('📁 Esporta Dati', '🗜️ Esporta ZIP', '🔙 Indietro')
+    assert 'Comando non riconosciuto.' not in risposte
+    assert len(documenti) == 1 and documenti[0][0].endswith('.zip')
+    with zipfile.ZipFile(io.BytesIO(documenti[0][1])) as archivio:
+        assert {'interventi_2024.csv', 'interventi_2025.csv'} <= set(archivio.namelist())
+    # Indietro chiude il menu: i messaggi successivi tornano ai comandi normali
+    assert chat('🗜️ Esporta ZIP')[0][-1] == 'Comando non riconosciuto.'
+
+
+def test_esporta_novita_per_destinazione_scritta(conn, chat):
+    primo = nuovo_intervento(conn)
+    risposte, documenti = chat('📁 Esporta Dati', '🆕 Esporta Novità', 'Provincia')
+    assert 'Comando non riconosciuto.' not in risposte
+    assert [nome.split('_2')[0] for nome, _ in documenti] == ['interventi_novita_Provincia']
+    assert len(documenti[0][1].decode('utf-8').splitlines()) == 2
+    # Il watermark è avanzato dopo l'invio: la stessa destinazione non riceve di nuovo l'intervento
+    assert conn.execute("SELECT last_id FROM export_watermarks WHERE target = 'Provincia'").fetchone() == (primo,)
+    chat('🆕 Esporta Novità', '🎯 Provincia')
+    assert len(documenti) == 1
+    assert risposte[-2].startswith('✅ Nessun nuovo intervento per Provincia')
+
+    secondo = nuovo_intervento(conn)
+    chat('🆕 Esporta Novità', '🎯 Provincia', '🔙 Indietro')
+    assert len(documenti) == 2 and len(documenti[1][1].decode('utf-8').splitlines()) == 2
+    assert conn.execute("SELECT last_id FROM export_watermarks WHERE target = 'Provincia'").fetchone() == (secondo,)
+    assert risposte[-1] == 'Operazione annullata.'
+
+
+def test_export_anno_riscrive_il_csv_cancellato(conn, chat, monkeypatch):
+    """Il CSV cancellato da un export concorrente tra preparazione e invio viene riscritto"""
+    nuovo_intervento(conn)
+    cancellati = []
+
+    def prepara_e_cancella(conn, anno, rigenera=False):
+        voce = prepara_export_anno(conn, anno, rigenera)
+        if not cancellati:
+            os.remove(voce.percorso)
+            cancellati.append(voce.percorso)
+        return voce
+    monkeypatch.setattr(bot, 'prepara_export_anno', prepara_e_cancella)
+
+    risposte, documenti = chat('📁 Esporta Dati', '📅 Esporta 2025')
+    assert cancellati and not any(risposta.startswith('❌') for risposta in risposte)
+    assert [nome for nome, _ in documenti] == ['interventi_2025.csv']
+    assert len(documenti[0][1].decode('utf-8').splitlines()) == 2
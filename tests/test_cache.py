@@ -0,0 +1,47 @@
+# tests/test_cache.py
+import pytest
+
+from cache import IndiceNomi
+
+RUOLINO = ['Rossi Mario', 'Rossi Marco', 'Bianchi Luca', 'Verdi Paolo', 'Niccolò Bernasconi', 'Sala Giovanni']
+
+
+@pytest.fixture
+def indice():
+    indice = IndiceNomi()
+    assert indice.aggiorna(RUOLINO) == (len(RUOLINO), 0)
+    return indice
+
+
+@pytest.mark.parametrize('testo, nome', [
+    ('rossi  MARIO', 'Rossi Mario'),  # stessa forma normalizzata
+    ('Mario Rossi', 'Rossi Mario'),  # parole invertite
+    ('Niccolo Bernasconi', 'Niccolò Bernasconi'),  # accenti
+    ('Bianki Luca', 'Bianchi Luca'),  # errori di battitura
+    ('Verdi Paoli', 'Verdi Paolo'),
+    ('sala giovani', 'Sala Giovanni'),
+    ('Rosi Marco', 'Rossi Marco'),  # simile a due nomi, ma con distacco
+    ('Bernasconi', 'Niccolò Bernasconi'),  # solo cognome, unico
+])
+def test_risolve_il_nome_giusto(indice, testo, nome):
+    assert indice.risolvi(testo) == (nome, [])
+
+
+@pytest.mark.parametrize('testo, candidati', [
+    ('rossi', ['Rossi Marco', 'Rossi Mario']),  # cognome condiviso: pari merito, in ordine alfabetico
+    ('Rossi Mari', ['Rossi Mario', 'Rossi Marco']),  # troppo poco distacco tra i due
+    ('Zanzibar', []),
+    ('', []),
+])
+def test_ambiguo_restituisce_i_candidati(indice, testo, candidati):
+    assert indice.risolvi(testo) == (None, candidati)
+
+
+def test_aggiorna_indicizza_solo_le_differenze(indice):
+    assert indice.aggiorna(RUOLINO) == (0, 0)
+    assert indice.aggiorna(['Rossi Mario', 'Bianchi Luca', 'Neri Anna']) == (1, 4)
+    # Senza più l'omonimo il cognome basta; i nomi tolti non vengono più proposti
+    assert indice.risolvi('rossi') == ('Rossi Mario', [])
+    assert indice.risolvi('Verdi Paolo') == (None, [])
+    assert indice.risolvi('neri anna') == ('Neri Anna', [])
+    assert indice.cerca('Rossi Marco') == [('Rossi Mario', 0.75)]
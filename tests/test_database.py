@@ -0,0 +1,32 @@
+# tests/test_database.py
+import asyncio
+
+from database import DatabasePool, connect
+
+
+def test_run_legge_da_un_solo_snapshot(tmp_path):
+    """Una scrittura committata tra due letture di db.run non è visibile alla seconda"""
+    percorso = str(tmp_path / 'vigili.db')
+    with connect(percorso) as conn:
+        conn.execute('CREATE TABLE t (x INTEGER)')
+        conn.execute('INSERT INTO t VALUES (1)')
+
+    def leggi(conn):
+        prima = conn.execute('SELECT COUNT(*) FROM t').fetchone()[0]
+        altra = connect(percorso)
+        with altra:
+            altra.execute('INSERT INTO t VALUES (2)')
+        altra.close()
+        dopo = conn.execute('SELECT COUNT(*) FROM t').fetchone()[0]
+        return prima, dopo
+
+    async def scenario():
+        pool = DatabasePool(percorso, size=1)
+        try:
+            return await pool.run(leggi), await pool.fetchone('SELECT COUNT(*) FROM t')
+        finally:
+            pool.close()
+
+    (prima, dopo), (totale,) = asyncio.run(scenario())
+    assert prima == dopo == 1
+    assert totale == 2
@@ -0,0 +1,170 @@
+# tests/test_esportazione.py
+import asyncio
+import csv
+import io
+import os
+import zipfile
+
+import pytest
+
+import esportazione
+from conftest import nuovo_intervento
+from database import DatabasePool, connect
+from esportazione import INTESTAZIONE_CSV, prepara_export_anno
+from migrations import applica_migrazioni
+
+
+@pytest.fixture(autouse=True)
+def cartella_cache(tmp_path, monkeypatch):
+    cartella = tmp_path / 'cache_export'
+    monkeypatch.setattr(esportazione, 'CARTELLA_CACHE', str(cartella))
+    return cartella
+
+
+def _righe_csv(dati):
+    return list(csv.reader(io.StringIO(dati.decode('utf-8'))))
+
+
+def test_export_anno_da_un_solo_snapshot(conn, inserisci):
+    """Un inserimento committato tra la lettura della versione e quella delle righe non finisce nel CSV"""
+    inserisci(year=2025)
+    percorso = conn.execute('PRAGMA database_list').fetchone()[2]
+
+    def prepara(conn):
+        def in_mezzo(sql):
+            if 'ORDER BY exit_at, id' in sql and not inserito:
+                altra = connect(percorso)
+                inserito.append(nuovo_intervento(altra, year=2025))
+                altra.close()
+
+        inserito = []
+        conn.set_trace_callback(in_mezzo)
+        try:
+            return prepara_export_anno(conn, 2025)
+        finally:
+            conn.set_trace_callback(None)
+
+    async def scenario():
+        pool = DatabasePool(percorso, size=1)
+        try:
+            durante = await pool.run(prepara)
+            with open(durante.percorso, 'rb') as file_csv:
+                righe = _righe_csv(file_csv.read())
+            return durante, righe, await pool.run(prepara_export_anno, 2025)
+        finally:
+            pool.close()
+
+    durante, righe, dopo = asyncio.run(scenario())
+    assert durante.riepilogo['totale'] == 1
+    assert righe[0] == INTESTAZIONE_CSV and len(righe) == 2
+    # L'inserimento ha cambiato versione: il prossimo export lo contiene
+    assert dopo.versione > durante.versione
+    assert dopo.riepilogo['totale'] == 2
+
+
+def test_zip_un_csv_per_anno(conn, inserisci):
+    inserisci(year=2024, exit_time='03/02/2024 10:00', return_time='03/02/2024 11:30', address='Via Università 3, Erba')
+    inserisci(year=2025, participants=('Rossi Mario', 'Neri Anna'), vehicles=('AB123CD', 'EF456GH'))
+    inserisci(year=2025, exit_time='04/02/2025 22:00', return_time='05/02/2025 01:00')
+    # Anno ancora negli aggregati ma senza interventi: niente CSV vuoto nell'archivio
+    vuoto = inserisci(year=2023, exit_time='03/02/2023 10:00', return_time='03/02/2023 11:30')
+    conn.execute('DELETE FROM interventions WHERE id = ?', (vuoto,))
+    conn.commit()
+
+    file_zip, riepilogo = esportazione.esporta_zip(conn)
+    assert riepilogo['totale'] == 3 and riepilogo['anni'] == [2025, 2024]
+    with file_zip, zipfile.ZipFile(file_zip) as archivio:
+        assert archivio.testzip() is None
+        assert archivio.namelist() == ['interventi_2025.csv', 'interventi_2024.csv', 'personale.csv', 'mezzi.csv']
+        assert riepilogo['dimensione_csv'] == sum(voce.file_size for voce in archivio.infolist())
+        for anno in riepilogo['anni']:
+            file_csv, _ = esportazione.esporta_csv(conn, anno)
+            with file_csv:
+                assert archivio.read(f'interventi_{anno}.csv') == file_csv.read()
+        assert _righe_csv(archivio.read('personale.csv'))[0] == esportazione.INTESTAZIONE_PERSONALE
+        assert _righe_csv(archivio.read('mezzi.csv'))[0] == esportazione.INTESTAZIONE_MEZZI
+
+
+def test_zip_senza_interventi(conn):
+    file_zip, riepilogo = esportazione.esporta_zip(conn)
+    assert file_zip is None
+    assert riepilogo['totale'] == 0 and riepilogo['anni'] == []
+
+
+def test_cache_export_dopo_ripristino(conn, inserisci, tmp_path):
+    """Dopo un ripristino la versione dell'anno torna indietro: il CSV in cache non va riusato"""
+    backup = connect(str(tmp_path / 'backup.db'))
+    conn.backup(backup)
+    inserisci(year=2025, address='Via Prima 1, Erba')
+    prima = prepara_export_anno(conn, 2025)
+
+    # Ripristino del backup all'avvio, poi un intervento diverso: stessa versione
+    backup.backup(conn)
+    backup.close()
+    inserisci(year=2025, address='Via Seconda 2, Erba')
+    percorso_db = conn.execute('PRAGMA database_list').fetchone()[2]
+    esportazione.svuota_cache_export(percorso_db)
+    dopo = prepara_export_anno(conn, 2025)
+    assert dopo.versione == prima.versione
+    with open(dopo.percorso, 'rb') as file_csv:
+        assert [riga[6] for riga in _righe_csv(file_csv.read())[1:]] == ['Via Seconda 2, Erba']
+
+
+def test_cache_export_condivisa_tra_database(conn, inserisci, tmp_path):
+    altro = connect(str(tmp_path / 'altro.db'))
+    applica_migrazioni(altro)
+    inserisci(year=2025, address='Via Prima 1, Erba')
+    nuovo_intervento(altro, year=2025, address='Via Seconda 2, Erba')
+
+    # Stessa cartella, stesso anno, stessa versione: ogni database ha il suo CSV
+    versioni = set()
+    for db, indirizzo in ((conn, 'Via Prima 1, Erba'), (altro, 'Via Seconda 2, Erba')):
+        voce = prepara_export_anno(db, 2025)
+        versioni.add(voce.versione)
+        with open(voce.percorso, 'rb') as file_csv:
+            assert _righe_csv(file_csv.read())[1][6] == indirizzo
+    altro.close()
+    assert len(versioni) == 1
+
+
+def test_cache_export_non_cancella_versioni_successive(conn, inserisci):
+    """Un export con uno snapshot più vecchio non cancella il CSV appena scritto a una versione successiva"""
+    inserisci(year=2025)
+    percorso_db = conn.execute('PRAGMA database_list').fetchone()[2]
+    vecchio = connect(percorso_db)
+    vecchio.execute('BEGIN')
+    vecchio.execute('SELECT version FROM export_versions').fetchall()
+
+    inserisci(year=2025)
+    nuova = prepara_export_anno(conn, 2025)
+    precedente = prepara_export_anno(vecchio, 2025)
+    vecchio.rollback()
+    vecchio.close()
+    assert precedente.versione < nuova.versione
+    assert os.path.exists(nuova.percorso) and os.path.exists(precedente.percorso)
+
+    # Il prossimo export alla versione corrente cancella solo le precedenti
+    assert prepara_export_anno(conn, 2025, rigenera=True).percorso == nuova.percorso
+    os.remove(nuova.percorso)
+    prepara_export_anno(conn, 2025, rigenera=True)
+    assert not os.path.exists(precedente.percorso)
+
+
+def test_zip_riscrive_il_csv_cancellato(conn, inserisci, monkeypatch):
+    """Se il CSV dell'anno sparisce tra la preparazione e l'apertura, l'anno viene riscritto"""
+    inserisci(year=2025)
+    prepara = esportazione.prepara_export_anno
+    cancellati = []
+
+    def prepara_e_cancella(conn, anno, rigenera=False):
+        voce = prepara(conn, anno, rigenera)
+        if not cancellati:
+            os.remove(voce.percorso)
+            cancellati.append(voce.percorso)
+        return voce
+    monkeypatch.setattr(esportazione, 'prepara_export_anno', prepara_e_cancella)
+
+    file_zip, riepilogo = esportazione.esporta_zip(conn)
+    assert cancellati and riepilogo['totale'] == 1
+    with file_zip, zipfile.ZipFile(file_zip) as archivio:
+        assert len(_righe_csv(archivio.read('interventi_2025.csv'))) == 2
@@ -0,0 +1,48 @@
+# tests/test_indirizzi.py
+import pytest
+
+from indirizzi import completa_indirizzi, luoghi_ricorrenti, normalizza_indirizzo
+from migrations import indirizzi_senza_virgola
+
+
+@pytest.mark.parametrize('testo, chiave', [
+    ('V. Roma n.12/A, Erba (CO)', 'via roma 12a, erba'),
+    ('P.zza Mercato, 22036 Erba', 'piazza mercato, erba'),
+    ('Via Roma, 12, Erba', 'via roma 12, erba'),
+    ('via roma 12 a', 'via roma 12a'),
+    ('Via Cantù snc - Erba', 'via cantu, erba'),
+    ('  ', ''),
+    (None, ''),
+    # Senza virgola: il comune dopo il civico si riconosce, un numero nel nome della via no
+    ('Via Dante 5 Erba', 'via dante 5, erba'),
+    ('via dante n. 5 Erba (CO)', 'via dante 5, erba'),
+    ('Via Dante 5/A 22036 Erba CO', 'via dante 5a, erba'),
+    ('Via 4 Novembre 10', 'via 4 novembre 10'),
+    ('Via 4 Novembre 10 Erba', 'via 4 novembre 10, erba'),
+    ('Via 4 Novembre Erba', 'via 4 novembre erba'),
+])
+def test_normalizza_indirizzo(testo, chiave):
+    assert normalizza_indirizzo(testo) == chiave
+
+
+def test_stesso_luogo_scritto_in_modi_diversi():
+    varianti = ['Via Dante 5, Erba', 'Via Dante 5 Erba', 'VIA DANTE N. 5, ERBA (CO)', 'v. Dante 5 - Erba']
+    assert {normalizza_indirizzo(v) for v in varianti} == {'via dante 5, erba'}
+
+
+def test_luoghi_ricorrenti_raggruppa_le_varianti(conn, inserisci):
+    inserisci(address='Via Dante 5, Erba', exit_time='01/02/2025 10:00')
+    inserisci(address='Via Dante 5 Erba', exit_time='05/02/2025 10:00')
+    inserisci(address='Piazza Mercato, Erba')
+    assert luoghi_ricorrenti(conn) == [('via dante 5, erba', 2, '2025-02-05 10:00')]
+
+
+def test_migrazione_ricalcola_solo_le_chiavi_senza_comune(conn, inserisci):
+    senza, con = inserisci(address='Via Dante 5 Erba'), inserisci(address='Via Roma 1, Erba')
+    # Chiave scritta dalla normalizzazione precedente
+    conn.execute("UPDATE interventions SET address_key = 'via dante 5 erba' WHERE id = ?", (senza,))
+    indirizzi_senza_virgola(conn)
+    chiavi = dict(conn.execute('SELECT id, address_key FROM interventions'))
+    assert chiavi == {senza: None, con: 'via roma 1, erba'}
+    assert completa_indirizzi(conn) == 1
+    assert conn.execute('SELECT address_key FROM interventions WHERE id = ?', (senza,)).fetchone()[0] == 'via dante 5, erba'
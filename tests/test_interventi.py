@@ -0,0 +1,62 @@
+# tests/test_interventi.py
+import json
+
+from interventi import PARTECIPANTI_SQL, MEZZI_SQL, elenco, pagina_interventi
+from migrations import tabelle_collegamento
+
+
+def _stesso_istante(conn, ids, created_at):
+    conn.executemany('UPDATE interventions SET created_at = ? WHERE id = ?', [(created_at, i) for i in ids])
+    conn.commit()
+
+
+def test_collegamenti_in_ordine(conn, inserisci):
+    intervention_id = inserisci(participants=['Rossi Mario', 'Neri Anna'], vehicles=['AB123CD', 'EF456GH'])
+    partecipanti, mezzi = conn.execute(
+        f'SELECT {PARTECIPANTI_SQL}, {MEZZI_SQL} FROM interventions WHERE id = ?', (intervention_id,)
+    ).fetchone()
+    assert partecipanti == 'Rossi Mario, Neri Anna'
+    assert mezzi == 'AB123CD, EF456GH'
+
+
+def test_elenco_ripiega_sul_json():
+    assert elenco('Rossi Mario', '["Altro"]') == 'Rossi Mario'
+    assert elenco(None, json.dumps(['Rossi Mario', 'Neri Anna'])) == 'Rossi Mario, Neri Anna'
+    assert elenco(None, None) == ''
+
+
+def test_migrazione_json_salta_righe_non_valide(conn, inserisci):
+    valido = inserisci()
+    rotto = inserisci()
+    conn.execute('DELETE FROM intervention_participants')
+    conn.execute('DELETE FROM intervention_vehicles')
+    conn.execute("UPDATE interventions SET participants = 'non json' WHERE id = ?", (rotto,))
+
+    tabelle_collegamento(conn)
+    collegati = {row[0] for row in conn.execute('SELECT intervention_id FROM intervention_participants')}
+    assert collegati == {valido}
+
+
+def test_pagine_avanti_e_indietro_con_created_at_uguali(conn, inserisci):
+    ids = [inserisci() for _ in range(8)]
+    # Importazione: sei interventi nello stesso secondo, in mezzo a due isolati
+    _stesso_istante(conn, ids[:1], '2025-01-01 08:00:00')
+    _stesso_istante(conn, ids[1:7], '2025-01-02 09:00:00')
+    _stesso_istante(conn, ids[7:], '2025-01-03 10:00:00')
+    atteso = [ids[7]] + ids[6:0:-1] + [ids[0]]
+
+    pagine, cursore = [], None
+    while True:
+        pagina = pagina_interventi(conn, cursore, limite=3)
+        if not pagina:
+            break
+        pagine.append([row[0] for row in pagina])
+        cursore = (pagina[-1][1], pagina[-1][0])
+    assert [i for pagina in pagine for i in pagina] == atteso
+    assert [len(pagina) for pagina in pagine] == [3, 3, 2]
+
+    # Indietro dalla prima riga di ogni pagina: la pagina precedente, dalla più vicina al cursore
+    for precedente, pagina in zip(pagine, pagine[1:]):
+        prima = conn.execute('SELECT created_at, id FROM interventions WHERE id = ?', (pagina[0],)).fetchone()
+        righe = pagina_interventi(conn, prima, indietro=True, limite=3)
+        assert [row[0] for row in reversed(righe)] == precedente
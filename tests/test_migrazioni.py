@@ -0,0 +1,77 @@
+# tests/test_migrazioni.py
+import os
+
+import pytest
+
+from database import connect
+from migrations import VERSIONE_SCHEMA, applica_migrazioni, versione_corrente
+from statistiche import ricostruisci_statistiche
+
+from conftest import nuovo_intervento
+
+# Dump dei database creati dal codice di ogni rilascio (schema iniziale con quattro
+# interventi scritti solo nelle colonne JSON, poi applica_migrazioni di quel rilascio)
+CARTELLA_SCHEMI = os.path.join(os.path.dirname(__file__), 'schemi')
+VERSIONI_RILASCIATE = sorted(int(nome[1:-4]) for nome in os.listdir(CARTELLA_SCHEMI) if nome.endswith('.sql'))
+
+TABELLE_AGGREGATE = ('stats_by_year', 'stats_by_type', 'stats_by_vehicle', 'stats_by_month',
+                     'stats_durations', 'stats_by_year_group')
+
+
+def _database_rilasciato(percorso, versione):
+    conn = connect(percorso)
+    with open(os.path.join(CARTELLA_SCHEMI, f'v{versione}.sql'), encoding='utf-8') as dump:
+        conn.executescript(dump.read())
+    return conn
+
+
+def _schema(conn):
+    """Colonne di ogni tabella e nomi di indici e trigger"""
+    oggetti = conn.execute("SELECT type, name, tbl_name FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'").fetchall()
+    colonne = {
+        nome: [row[1:3] for row in conn.execute(f'PRAGMA table_info("{nome}")')]
+        for tipo, nome, _ in oggetti if tipo == 'table'
+    }
+    return colonne, sorted((tipo, nome) for tipo, nome, _ in oggetti if tipo != 'table')
+
+
+def _aggregati(conn):
+    return {tabella: sorted(conn.execute(f'SELECT * FROM {tabella}').fetchall(), key=repr)
+            for tabella in TABELLE_AGGREGATE}
+
+
+@pytest.fixture(scope='module')
+def schema_nuovo(tmp_path_factory):
+    conn = connect(str(tmp_path_factory.mktemp('nuovo') / 'vigili.db'))
+    applica_migrazioni(conn)
+    schema = _schema(conn)
+    conn.close()
+    return schema
+
+
+def test_un_dump_per_ogni_versione_rilasciata():
+    # Nuova migrazione: aggiungere il dump della versione rilasciata (vedi CARTELLA_SCHEMI)
+    assert VERSIONI_RILASCIATE[-1] == VERSIONE_SCHEMA
+    assert VERSIONI_RILASCIATE[0] == 0
+
+
+@pytest.mark.parametrize('versione', VERSIONI_RILASCIATE)
+def test_aggiornamento_da_ogni_versione_rilasciata(tmp_path, schema_nuovo, versione):
+    conn = _database_rilasciato(str(tmp_path / 'vigili.db'), versione)
+    assert versione_corrente(conn) == versione
+    assert applica_migrazioni(conn) == VERSIONE_SCHEMA
+    assert versione_corrente(conn) == VERSIONE_SCHEMA
+    assert _schema(conn) == schema_nuovo
+    assert conn.execute('SELECT COUNT(*) FROM interventions').fetchone()[0] == 4
+    assert conn.execute('SELECT COUNT(*) FROM intervention_vehicles').fetchone()[0] == 4
+
+    # Aggregati popolati come un ricalcolo completo, e ancora coerenti dopo un nuovo inserimento
+    migrati = _aggregati(conn)
+    assert migrati['stats_by_year'] and migrati['stats_by_vehicle'] and migrati['stats_by_year_group']
+    ricostruisci_statistiche(conn)
+    assert _aggregati(conn) == migrati
+    nuovo_intervento(conn, report_number='99', year=2024, exit_time='01/03/2024 12:00', return_time='01/03/2024 13:00')
+    incrementali = _aggregati(conn)
+    ricostruisci_statistiche(conn)
+    assert _aggregati(conn) == incrementali
+    conn.close()
@@ -0,0 +1,32 @@
+# tests/test_query_plans.py
+"""Nessuna query dei moduli del bot legge una tabella per intero (vedi python benchmark.py piani)"""
+import pytest
+
+from benchmark import db_piani, piano_query, query_moduli, scansione_ammessa
+
+QUERY = query_moduli()
+
+
+@pytest.fixture(scope='module')
+def db_sintetico(tmp_path_factory):
+    conn = db_piani(str(tmp_path_factory.mktemp('piani') / 'piani.db'), righe=20000)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize('sql', [sql for _, _, sql in QUERY], ids=[f'{m}:{r}' for m, r, _ in QUERY])
+def test_nessuna_scansione_completa(db_sintetico, sql):
+    risultato = piano_query(db_sintetico, sql)
+    if risultato is None:
+        pytest.skip('frammento riusato in altre query')
+    dettagli, scansioni = risultato
+    if scansioni:
+        assert scansione_ammessa(sql), f"scansione completa: {scansioni}\n" + '\n'.join(dettagli)
+
+
+def test_scansione_di_un_indice_conta(db_sintetico):
+    """Leggere tutto un indice coprente è comunque una lettura completa"""
+    _, scansioni = piano_query(db_sintetico, 'SELECT DISTINCT year FROM interventions')
+    assert scansioni and 'USING COVERING INDEX' in scansioni[0]
+    _, scansioni = piano_query(db_sintetico, 'SELECT COUNT(*) FROM interventions WHERE year = ?')
+    assert scansioni == []
@@ -0,0 +1,103 @@
+# tests/test_ricerca.py
+import pytest
+
+from ricerca import cerca_interventi, intervallo_date, pagina_filtrata, query_fts
+
+
+def test_query_fts():
+    assert query_fts('Via Garibaldi 12') == '"Via" "Garibaldi" "12"'
+    assert query_fts('incendio gar') == '"incendio" "gar"*'
+    assert query_fts(' ?! ') == ''
+
+
+def test_ranking_su_tutto_l_archivio(conn, inserisci):
+    # Il più pertinente (parola nell'indirizzo, peso maggiore) è anche il più vecchio
+    pertinente = inserisci(address='Via Garibaldi 3, Erba', driver='Verdi Paolo')
+    conn.executemany('''
+        INSERT INTO interventions (report_number, year, exit_time, address, squad_leader, driver,
+                                   participants, vehicles_used)
+        VALUES (?, 2025, '03/02/2025 10:00', 'Via Milano 1, Erba', 'Bianchi Luca', 'Garibaldi Anna', '[]', '[]')
+    ''', [(f'r{i}',) for i in range(1100)])
+    conn.commit()
+
+    risultati = cerca_interventi(conn, 'garibaldi', colonne='interventions.id')
+    assert risultati[0] == (pertinente,)
+    assert len(risultati) == 10
+    # A parità di punteggio i più recenti
+    assert [r[0] for r in risultati[1:]] == sorted((r[0] for r in risultati[1:]), reverse=True)
+    assert risultati[1][0] == conn.execute('SELECT MAX(id) FROM interventions').fetchone()[0]
+
+
+def test_partecipanti_solo_per_gli_admin(conn, inserisci):
+    inserisci(participants=['Zanetti Carla'])
+    assert cerca_interventi(conn, 'zanetti') == []
+    assert len(cerca_interventi(conn, 'zanetti', partecipanti=True)) == 1
+
+
+@pytest.mark.parametrize('testo, intervallo', [
+    ('2026', ('2026-01-01', '2027-01-01')),
+    ('T1 2026', ('2026-01-01', '2026-04-01')),
+    ('12/2025', ('2025-12-01', '2026-01-01')),
+    ('15/06/2026', ('2026-06-15', '2026-06-16')),
+    ('03/2026 - 06/2026', ('2026-03-01', '2026-07-01')),
+    ('01/03/2026 - 15/06/2026', ('2026-03-01', '2026-06-16')),
+    ('2025 → T1 2026', ('2025-01-01', '2026-04-01')),
+    ('06/2026 - 03/2026', None),
+    ('13/2026', None),
+    ('31/02/2026', None),
+    ('2025 - 2026 - 2027', None),
+    ('marzo', None),
+    ('', None),
+])
+def test_intervallo_date(testo, intervallo):
+    assert intervallo_date(testo) == intervallo
+
+
+def _sfoglia(conn, filtri, partecipanti=False, limite=3):
+    """Tutte le pagine in avanti, poi di nuovo indietro dall'ultima: (pagine avanti, pagine indietro)"""
+    avanti, cursore = [], None
+    while True:
+        righe, precedente, successiva = pagina_filtrata(conn, filtri, partecipanti, cursore, limite=limite)
+        assert precedente == bool(avanti)
+        avanti.append([r[0] for r in righe])
+        if not successiva:
+            break
+        cursore = righe[-1][1:2] + righe[-1][:1]
+    indietro = [avanti[-1]]
+    while True:
+        prima = conn.execute('SELECT exit_at, id FROM interventions WHERE id = ?', (indietro[0][0],)).fetchone()
+        righe, precedente, successiva = pagina_filtrata(conn, filtri, partecipanti, prima, indietro=True, limite=limite)
+        assert successiva
+        indietro.insert(0, [r[0] for r in righe])
+        if not precedente:
+            break
+    return avanti, indietro
+
+
+def test_pagine_filtrate_con_uscite_uguali(conn, inserisci):
+    # Sette interventi alla stessa ora di uscita, tra uno prima e uno dopo, più uno fuori periodo
+    fuori = inserisci(exit_time='31/12/2024 23:00')
+    ids = [inserisci(exit_time='01/03/2025 08:00')]
+    ids += [inserisci(exit_time='02/03/2025 09:30') for _ in range(7)]
+    ids += [inserisci(exit_time='03/03/2025 10:00')]
+    inizio, fine = intervallo_date('2025')
+
+    avanti, indietro = _sfoglia(conn, {'inizio': inizio, 'fine': fine})
+    assert [i for pagina in avanti for i in pagina] == ids[::-1]
+    assert [len(pagina) for pagina in avanti] == [3, 3, 3]
+    assert indietro == avanti
+    assert fuori not in sum(avanti, [])
+
+
+def test_filtri_mezzo_e_vigile(conn, inserisci):
+    con_mezzo = [inserisci(vehicles=['EF456GH'], exit_time=f'0{g}/03/2025 10:00') for g in range(1, 6)]
+    inserisci(vehicles=['AB123CD'])
+    partecipante = inserisci(participants=['Zanetti Carla'], squad_leader='Neri Anna')
+
+    avanti, indietro = _sfoglia(conn, {'mezzo': 'EF456GH'}, limite=2)
+    assert sum(avanti, []) == con_mezzo[::-1]
+    assert indietro == avanti
+    # I partecipanti contano solo per chi può vederli (admin)
+    assert pagina_filtrata(conn, {'vigile': 'Zanetti Carla'})[0] == []
+    assert [r[0] for r in pagina_filtrata(conn, {'vigile': 'Zanetti Carla'}, True)[0]] == [partecipante]
+    assert [r[0] for r in pagina_filtrata(conn, {'vigile': 'Neri Anna'})[0]] == [partecipante]
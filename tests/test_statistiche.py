@@ -0,0 +1,54 @@
+# tests/test_statistiche.py
+import asyncio
+
+from conftest import nuovo_intervento
+from database import DatabasePool, connect
+from statistiche import leggi_statistiche, statistiche_avanzate
+
+
+def test_statistiche_da_un_solo_snapshot(conn, inserisci):
+    """Un inserimento committato durante leggi_statistiche non compare solo in alcune letture"""
+    for _ in range(3):
+        inserisci()
+    percorso = conn.execute('PRAGMA database_list').fetchone()[2]
+
+    def leggi(conn):
+        inserito = []
+
+        def in_mezzo(sql):
+            # Dopo la prima lettura (totali per anno), prima di tipologie e mezzi
+            if 'first_exit_time' in sql and not inserito:
+                altra = connect(percorso)
+                inserito.append(nuovo_intervento(altra, intervention_type='Soccorso'))
+                altra.close()
+
+        conn.set_trace_callback(in_mezzo)
+        try:
+            return leggi_statistiche(conn)
+        finally:
+            conn.set_trace_callback(None)
+
+    async def scenario():
+        pool = DatabasePool(percorso, size=1)
+        try:
+            return await pool.run(leggi), await pool.run(leggi_statistiche)
+        finally:
+            pool.close()
+
+    durante, dopo = asyncio.run(scenario())
+    assert durante['totale'] == sum(n for _, n in durante['per_tipologia']) == 3
+    assert durante['per_mezzo'][0][1] == 3
+    assert dopo['totale'] == sum(n for _, n in dopo['per_tipologia']) == 4
+
+
+def test_istogramma_orario_senza_uscite_senza_ora(conn, inserisci):
+    inserisci(exit_time='03/02/2025', return_time='03/02/2025 12:00')
+    inserisci(exit_time='04.02.2025', return_time='04/02/2025 12:00')
+    inserisci(exit_time='03/02/2025 00:30', return_time='03/02/2025 01:00')
+    inserisci(exit_time='03/02/2025 10:00', return_time='03/02/2025 11:00')
+
+    stats = statistiche_avanzate(conn)
+    assert stats['senza_ora'] == 2
+    assert stats['per_ora'][0] == 1 and stats['per_ora'][10] == 1 and sum(stats['per_ora']) == 2
+    # Il giorno della settimana resta noto anche senza ora
+    assert sum(stats['per_giorno']) == 4